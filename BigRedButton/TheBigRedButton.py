@@ -69,27 +69,18 @@ class TheBigRedButton:
     def the_big_red_button(self):
 
         # ---------------------------------- First modify the workers ------------------------------------------------
-        for worker in self.split_machines_to_modify:
-            # for every machine disable the ones with - in the name, i.e. the splits.
-            if "-" in worker:
-                u_DeadlineToolbox.modify_worker(slave=worker, set_worker_state=self.worker_state)
+        # for every machine disable the ones with - in the name, i.e. the splits.
+        u_DeadlineToolbox.modify_workers([worker for worker in self.split_machines_to_modify if "-" in worker],
+                                         set_worker_state=self.worker_state
+                                         )
 
         # ----------------------------------- Then Requeue the tasks on them if needed---------------------------------
         if self.requeue_tasks:
-            for job in self.jobs_in_state:
-                # We want to leave sims unaffected as they could be multiple hours in length
-                if job.JobGroup != "sims":
-                    # get the TaskCollection on that job
-                    job_task_collection = RepositoryUtils.GetJobTasks(job, True)
-                    # set up a list to add tasks to be re-queued into
-                    task_that_need_to_be_requeued = []
-                    # loop through the tasks to see if we need to requeue any
-                    for task in job_task_collection.TaskCollectionTasks:
-                        if task.TaskSlaveName in self.split_machines_to_modify:
-                            if task.TaskStatus == "Rendering":
-                                task_that_need_to_be_requeued.append(task)
-                    # Requeue the tasks
-                    RepositoryUtils.RequeueTasks(job, task_that_need_to_be_requeued)
+            # We want to leave sims unaffected as they could be multiple hours in length
+            u_DeadlineToolbox.requeue_rendering_tasks(self.split_machines_to_modify,
+                                                      jobs=self.jobs_in_state,
+                                                      job_filter=lambda job: job.JobGroup != "sims"
+                                                      )
 
         # ----------------------------- Edit the Nuke limit to add or remove the split machines----------------------
         RepositoryUtils.SetLimitGroup("nuke render license limit",
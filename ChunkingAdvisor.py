@@ -0,0 +1,151 @@
+#! /usr/bin/python
+"""
+
+Chunking Advisor:
+
+Works out the frames per task a job should have before it starts rendering, from how much of each task is spent
+starting the application (the overhead) and how much rendering each frame. Light Nuke and MayaCmd jobs at one frame
+per task spend most of their time launching the application, so they're chunked up, while heavy frames and jobs that
+need every machine they can get are left with small chunks. Used by the u_TaskTimeAggregation event.
+
+Deadline doesn't report the startup time of a task on its own, so it's measured from the u_FarmStateStore TaskTimeStore
+job totals: across the jobs of a plugin and show, the average task time is fitted as overhead + frames per task x
+frame time. Jobs rendered at different frames per task give the fit its slope. If a plugin and show don't have enough
+jobs, the plugin's fit is used, and if that doesn't either, the job is left alone.
+
+The frames per task chosen is the smallest that keeps the overhead under max_overhead_fraction of each task, as long
+as the job still has a task for every slot it can render on (machines x concurrent tasks), and a task isn't longer
+than max_task_seconds or half the job's timeout.
+
+Example:
+    model = ChunkingModel.train(task_time_store.get_jobs().values())
+    frames_per_task = advise_frames_per_task(job, model, machines=40)
+
+"""
+
+import math
+
+# The plugins whose jobs are chunked. Sims and other single task jobs are left alone.
+chunked_plugins = ["Nuke", "MayaCmd", "Houdini"]
+excluded_groups = ["sims"]
+# The most of each task we want to spend starting the application.
+max_overhead_fraction = 0.1
+# The longest we want a task to be, so a requeue or a timeout doesn't lose too much.
+max_task_seconds = 30 * 60
+# The fewest jobs a plugin / show or plugin needs to be fitted.
+min_jobs = 5
+
+
+def fit_task_costs(job_points):
+    """
+    Fit the average task time of jobs against their average frames per task.
+
+    Args:
+        job_points: list: (frames per task, task seconds) for each job.
+    Returns:
+        (float, float): The overhead seconds per task and the seconds per frame, or None if they can't be fitted.
+    """
+    if len(job_points) < min_jobs or len(set(frames for frames, seconds in job_points)) < 2:
+        return None
+    mean_frames = sum(frames for frames, seconds in job_points) / float(len(job_points))
+    mean_seconds = sum(seconds for frames, seconds in job_points) / float(len(job_points))
+    covariance = sum((frames - mean_frames) * (seconds - mean_seconds) for frames, seconds in job_points)
+    variance = sum((frames - mean_frames) ** 2 for frames, seconds in job_points)
+    frame_seconds = covariance / variance
+    if frame_seconds <= 0:
+        return None
+    # A negative overhead is noise, so there's no reason to chunk.
+    overhead_seconds = max(0.0, mean_seconds - frame_seconds * mean_frames)
+    return overhead_seconds, frame_seconds
+
+
+class ChunkingModel:
+
+    def __init__(self, task_costs=None):
+        """
+        Args:
+            task_costs: dict: {(plugin, show) or (plugin,): (overhead seconds, frame seconds)}, from train().
+        """
+        self.task_costs = task_costs or {}
+
+    @classmethod
+    def train(cls, records):
+        """
+        Fit the task costs of each plugin / show and plugin.
+
+        Args:
+            records: list: TaskTimeStore job rows, i.e. dicts with "plugin", "pool", "timed_tasks", "timed_frames"
+            and "render_seconds". Jobs without any timed frames are skipped.
+        Returns:
+            ChunkingModel
+        """
+        # {(plugin, show) or (plugin,): [(frames per task, task seconds) for each job]}
+        group_points = {}
+        for record in records:
+            if not record["timed_tasks"] or not record.get("timed_frames"):
+                continue
+            job_point = (record["timed_frames"] / float(record["timed_tasks"]),
+                         record["render_seconds"] / float(record["timed_tasks"]))
+            group_points.setdefault((record["plugin"], record.get("pool", "")), []).append(job_point)
+            group_points.setdefault((record["plugin"],), []).append(job_point)
+        task_costs = {}
+        for key, job_points in group_points.items():
+            costs = fit_task_costs(job_points)
+            if costs is not None:
+                task_costs[key] = costs
+        return cls(task_costs)
+
+    def get_task_costs(self, plugin, show=""):
+        """
+        Returns:
+            (float, float): The overhead seconds per task and the seconds per frame, or None if there isn't a fit.
+        """
+        return self.task_costs.get((plugin, show)) or self.task_costs.get((plugin,))
+
+
+def best_frames_per_task(frame_count, overhead_seconds, frame_seconds, slots, task_seconds_limit=max_task_seconds):
+    """
+    Returns the frames per task that balances the overhead against how many slots the job can render on at once.
+
+    Args:
+        frame_count: int: The frames in the job.
+        overhead_seconds: float: The time each task spends starting the application.
+        frame_seconds: float: The time each frame takes to render.
+        slots: int: How many tasks the job can render at once.
+        task_seconds_limit: float: The longest a task should take.
+    """
+    # The smallest chunk that keeps the overhead under the max fraction of the task.
+    overhead_frames = int(math.ceil(overhead_seconds * (1 - max_overhead_fraction)
+                                    / (max_overhead_fraction * frame_seconds)))
+    # Keep a task for every slot, so chunking doesn't leave machines idle.
+    parallel_frames = frame_count // max(slots, 1)
+    task_limit_frames = int((task_seconds_limit - overhead_seconds) // frame_seconds)
+    return max(1, min(overhead_frames, parallel_frames, task_limit_frames, frame_count))
+
+
+def advise_frames_per_task(job, model, machines):
+    """
+    Work out the frames per task for a job that hasn't started rendering.
+
+    Args:
+        job: The Deadline job.
+        model: ChunkingModel
+        machines: int: The machines the job can render on, i.e. its group, or its machine limit if that's lower.
+    Returns:
+        int: The frames per task, or None to leave the job alone.
+    """
+    if job.JobPlugin not in chunked_plugins or job.JobGroup in excluded_groups or job.JobTaskCount <= 1:
+        return None
+    if job.JobRenderingTasks or job.JobCompletedTasks:
+        return None
+    task_costs = model.get_task_costs(job.JobPlugin, job.JobPool)
+    if task_costs is None:
+        return None
+    overhead_seconds, frame_seconds = task_costs
+    task_seconds_limit = max_task_seconds
+    if job.JobTaskTimeoutSeconds:
+        task_seconds_limit = min(task_seconds_limit, job.JobTaskTimeoutSeconds / 2.0)
+    # Roughly, as the last task can have fewer frames.
+    frame_count = job.JobTaskCount * job.JobFramesPerTask
+    slots = machines * max(job.JobConcurrentTasks, 1)
+    return best_frames_per_task(frame_count, overhead_seconds, frame_seconds, slots, task_seconds_limit)
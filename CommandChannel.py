@@ -0,0 +1,266 @@
+#! /usr/bin/python
+"""
+
+Command Channel:
+
+Runs the commands we used to send through ClientUtils.ExecuteCommand / ExecuteCommandAndGetOutput. Each of those calls
+starts a new deadlinecommand process, which takes hundreds of milliseconds before it does anything.
+For use in deadline scripting
+
+Commands are submitted to a channel, then flushed as one batch with the results returned in the order they were
+submitted. The RepositoryBackend runs the commands in-process with RepositoryUtils, using the repository connection the
+sandbox already has, so no process is started at all. The worker settings a batch changes are fetched with one
+GetSlaveSettingsList call, and only the workers whose settings actually change are saved, so disabling 40 workers
+costs one fetch and at most 40 saves, rather than 40 fetches and 40 saves.
+
+Each thread has its own queue of commands, so the toolbox's shared channel can be used from thread pools, and a flush
+only runs the commands its own thread submitted.
+
+The backend can be given a FakeRepository instead of RepositoryUtils, which adds a delay to each call like a round
+trip to the repository, so the channel can be tried out and benchmarked without Deadline, see benchmark().
+
+Example:
+    channel = CommandChannel()
+    for worker_name in worker_names:
+        channel.submit("SetSlaveSetting", worker_name, "SlaveEnabled", False)
+    results = channel.flush()
+
+"""
+
+import threading
+import time
+
+try:
+    from Deadline.Scripting import *
+except ImportError:
+    # Outside of Deadline, e.g. when running the benchmark with the fake repository.
+    RepositoryUtils = None
+
+
+class RepositoryBackend:
+    """
+    Runs commands in-process with RepositoryUtils. Only the commands we use are supported.
+    """
+
+    def __init__(self, repository=None):
+        # RepositoryUtils, or a FakeRepository.
+        self.repository = repository or RepositoryUtils
+
+    def run_batch(self, commands):
+        """
+        Args:
+            commands: list: (command, args) tuples, e.g. ("SetSlaveSetting", ("render01", "SlaveEnabled", False)).
+        Returns:
+            results: list: The result of each command, in the same order.
+        """
+        for command, args in commands:
+            if not hasattr(self, "command_{}".format(command.lstrip("-"))):
+                raise ValueError("The command '{}' isn't supported by the RepositoryBackend.".format(command))
+
+        results = [None] * len(commands)
+        # The worker settings changes are made together, so each worker is fetched and saved at most once.
+        setting_changes = dict((index, args) for index, (command, args) in enumerate(commands)
+                               if command.lstrip("-") == "SetSlaveSetting")
+        if setting_changes:
+            setting_results = self.set_worker_settings(list(setting_changes.values()))
+            for index, result in zip(setting_changes, setting_results):
+                results[index] = result
+        for index, (command, args) in enumerate(commands):
+            if index not in setting_changes:
+                results[index] = getattr(self, "command_{}".format(command.lstrip("-")))(*args)
+        return results
+
+    def set_worker_settings(self, setting_changes):
+        """
+        Change the worker settings with one GetSlaveSettingsList call, only saving the workers whose settings change.
+
+        Args:
+            setting_changes: list: (worker name, setting name, value) tuples.
+        Returns:
+            results: list: The result of each change, an empty string, or the error if the worker doesn't exist.
+        """
+        worker_names = set(worker_name for worker_name, setting_name, value in setting_changes)
+        settings_by_worker = dict((worker_settings.SlaveName, worker_settings)
+                                  for worker_settings in self.repository.GetSlaveSettingsList(True)
+                                  if worker_settings.SlaveName in worker_names)
+        results = []
+        # Keeps the order the workers were first changed in.
+        changed_workers = []
+        for worker_name, setting_name, value in setting_changes:
+            worker_settings = settings_by_worker.get(worker_name)
+            if worker_settings is None:
+                results.append("Error: The worker '{}' doesn't exist.".format(worker_name))
+                continue
+            if getattr(worker_settings, setting_name) != value:
+                setattr(worker_settings, setting_name, value)
+                if worker_settings not in changed_workers:
+                    changed_workers.append(worker_settings)
+            results.append("")
+        for worker_settings in changed_workers:
+            self.repository.SaveSlaveSettings(worker_settings)
+        return results
+
+    def command_SetSlaveSetting(self, worker_name, setting_name, value):
+        return self.set_worker_settings([(worker_name, setting_name, value)])[0]
+
+    def command_GetPoolNames(self):
+        return list(self.repository.GetPoolNames())
+
+    def close(self):
+        pass
+
+
+class FakeWorkerSettings:
+    """
+    The worker settings the channel changes, with the same property names as Deadline's SlaveSettings.
+    """
+
+    def __init__(self, worker_name, enabled=True):
+        self.SlaveName = worker_name
+        self.SlaveEnabled = enabled
+
+
+class FakeRepository:
+    """
+    Stands in for RepositoryUtils, with a delay on each call like a round trip to the repository, and counts the calls.
+    """
+
+    def __init__(self, worker_names, call_seconds=0.01, pool_names=("none",)):
+        self.worker_settings = dict((worker_name, FakeWorkerSettings(worker_name)) for worker_name in worker_names)
+        self.call_seconds = call_seconds
+        self.pool_names = list(pool_names)
+        # {call name: how many times it was called}
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def call(self, call_name):
+        with self.lock:
+            self.calls[call_name] = self.calls.get(call_name, 0) + 1
+        time.sleep(self.call_seconds)
+
+    def GetSlaveSettings(self, worker_name, invalidate):
+        self.call("GetSlaveSettings")
+        return self.worker_settings.get(worker_name)
+
+    def GetSlaveSettingsList(self, invalidate):
+        self.call("GetSlaveSettingsList")
+        return list(self.worker_settings.values())
+
+    def SaveSlaveSettings(self, worker_settings):
+        self.call("SaveSlaveSettings")
+        self.worker_settings[worker_settings.SlaveName] = worker_settings
+
+    def GetPoolNames(self):
+        self.call("GetPoolNames")
+        return list(self.pool_names)
+
+
+class CommandChannel:
+    """
+    Queues up commands, then runs them as one batch through the backend.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or RepositoryBackend()
+        # Each thread's queued commands.
+        self.thread_state = threading.local()
+
+    @property
+    def pending_commands(self):
+        if not hasattr(self.thread_state, "pending_commands"):
+            self.thread_state.pending_commands = []
+        return self.thread_state.pending_commands
+
+    def submit(self, command, *args):
+        """
+        Queue a command to run on the next flush.
+
+        Returns:
+            int: The index of the command's result in the list returned by flush().
+        """
+        self.pending_commands.append((command, args))
+        return len(self.pending_commands) - 1
+
+    def flush(self):
+        """
+        Run all the commands this thread has queued.
+
+        Returns:
+            results: list: The result of each command, in the order they were submitted.
+        """
+        commands, self.thread_state.pending_commands = self.pending_commands, []
+        if not commands:
+            return []
+        return self.backend.run_batch(commands)
+
+    def execute(self, command, *args):
+        """
+        Run a single command straight away, along with anything already queued, and return its result.
+        """
+        index = self.submit(command, *args)
+        return self.flush()[index]
+
+    def close(self):
+        self.backend.close()
+
+
+def benchmark(worker_count=40, call_seconds=0.01):
+    """
+    Compare disabling workers one command at a time, a fetch and a save per worker like the old
+    ClientUtils.ExecuteCommand calls did, with sending the same commands through the channel as one batch. Half the
+    workers are already disabled, as they usually are when a cron runs again. This uses the FakeRepository, so it runs
+    without Deadline.
+
+    Args:
+        worker_count: int: How many workers to disable.
+        call_seconds: float: The delay on each repository call.
+    Returns:
+        dict: The seconds and repository calls taken each way, and the commands per second through the channel.
+    """
+    worker_names = ["render{:02d}".format(number) for number in range(worker_count)]
+    commands = [("SetSlaveSetting", (worker_name, "SlaveEnabled", False)) for worker_name in worker_names]
+
+    def fake_repository():
+        repository = FakeRepository(worker_names, call_seconds=call_seconds)
+        for worker_name in worker_names[::2]:
+            repository.worker_settings[worker_name].SlaveEnabled = False
+        return repository
+
+    per_command_repository = fake_repository()
+    start_time = time.time()
+    for command, args in commands:
+        worker_name, setting_name, value = args
+        worker_settings = per_command_repository.GetSlaveSettings(worker_name, True)
+        setattr(worker_settings, setting_name, value)
+        per_command_repository.SaveSlaveSettings(worker_settings)
+    per_command_seconds = time.time() - start_time
+
+    channel_repository = fake_repository()
+    start_time = time.time()
+    channel = CommandChannel(backend=RepositoryBackend(channel_repository))
+    for command, args in commands:
+        channel.submit(command, *args)
+    channel.flush()
+    channel.close()
+    channel_seconds = time.time() - start_time
+
+    results = {"commands": worker_count,
+               "per_command_seconds": per_command_seconds,
+               "per_command_calls": sum(per_command_repository.calls.values()),
+               "channel_seconds": channel_seconds,
+               "channel_calls": sum(channel_repository.calls.values()),
+               "channel_commands_per_second": worker_count / channel_seconds
+               }
+    print("# {} commands: {:.3f} seconds and {} repository calls one at a time, {:.3f} seconds and {} calls through "
+          "the channel ({:.0f} commands per second).".format(worker_count,
+                                                             per_command_seconds,
+                                                             results["per_command_calls"],
+                                                             channel_seconds,
+                                                             results["channel_calls"],
+                                                             results["channel_commands_per_second"]
+                                                             ))
+    return results
+
+
+if __name__ == "__main__":
+    benchmark()
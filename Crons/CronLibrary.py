@@ -10,9 +10,32 @@ u_environment_utils.setup_python_site_packages()
 from Deadline.Scripting import *
 from System.Collections.Specialized import *
 from scripts.General.u_DeadlineToolbox import u_DeadlineToolbox
+from scripts.General.u_FarmStateStore import u_FarmStateStore
+from scripts.General.u_JobPatch import u_JobPatch
 from scripts.General.u_RestartHolidayUsers import restart_holiday_users
+from scripts.General.u_RollingRestart import u_RollingRestart
 from workalendar.europe import UnitedKingdom
 from datetime import datetime
+import functools
+import time
+
+
+def lazy_property(fetch_function):
+	"""
+	Decorator for a CronLibrary property that is fetched the first time a cron step uses it, then reused for the rest
+	of the cron. How long the fetch took is printed, so we can see what each cron spends its time on.
+	"""
+	attribute_name = "_" + fetch_function.__name__
+
+	@property
+	@functools.wraps(fetch_function)
+	def wrapper(self):
+		if attribute_name not in self.__dict__:
+			start_time = time.time()
+			self.__dict__[attribute_name] = fetch_function(self)
+			print("# Fetched {} in {:.3f} seconds.".format(fetch_function.__name__, time.time() - start_time))
+		return self.__dict__[attribute_name]
+	return wrapper
 
 
 class CronLibrary:
@@ -20,21 +43,13 @@ class CronLibrary:
 	def __init__(self, site):
 		"""
 		Initialise all the reused, site dependent and static variables.
+
+		The farm state (workers, jobs, pools and Shotgrid) isn't fetched here, it's fetched by the lazy properties below
+		when a cron step first needs it. This way a cron only waits on the state it uses.
 		"""
-		# Get list of all the workstations at the site (e.g. "na_ne_workstations").
-		self.site_artist_machines = u_DeadlineToolbox.get_slave_names_in_group(site + "_workstations")
-		# Get list of all the render nodes at the site (e.g. "na_ne_render_nodes").
-		self.site_render_nodes = u_DeadlineToolbox.get_slave_names_in_group(site + "_render_nodes")
-		# Get list of London machines currently assigned to Montreal artists from Shotgrid.
-		self.mtl_artist_london_machines_list = u_DeadlineToolbox.get_ldn_machines_assigned_to_mtl_artists()
-		# Get list of the loud machines (this is a temp group in LDN until they are removed from the floor).
-		self.loud_worker_list = u_DeadlineToolbox.get_slave_names_in_group("pizza_boxes_on_floor")
-		# Get the active and pending jobs on the farm.
-		self.active_pending_jobs = RepositoryUtils.GetJobsInState(["Active", "Pending"])
-		# Get failed jobs for resetting group to 251
-		self.failed_jobs = RepositoryUtils.GetJobsInState(["Failed"])
-		# Get an updated list of all pools.
-		self.all_pools = RepositoryUtils.GetPoolNames()
+		self.site = site
+		# Leases on the jobs we modify, so event handlers don't change the same job at the same time as the cron.
+		self.job_lease_store = u_FarmStateStore.JobLeaseStore()
 		# List of current CG render plugins we use.
 		self.cg_renderers = ["Arnold", "Mantra"]
 		# List of names of pools that we don't want added to the workstations
@@ -58,35 +73,98 @@ class CronLibrary:
 									 "Maya and Houdini Machine Limit": 0
 									 }
 
+	@lazy_property
+	def site_artist_machines(self):
+		# Get list of all the workstations at the site (e.g. "na_ne_workstations").
+		site_artist_machines = u_DeadlineToolbox.get_slave_names_in_group(self.site + "_workstations")
 		# As we have artists in MTL using LDN machines; we want to treat those LDN machines as if they were in MTL,
 		# so they are available when needed by the artist during their working hours.
 		# We also want to exclude these machines from the "eu_w" pool of machines for the same reason.
-		if site == "na_ne":
+		if self.site == "na_ne":
 			for worker in self.mtl_artist_london_machines_list:
 				# The way we report machine names in Shotgrid is a mismatch of lower and upper cases, deadline is always
 				# lower, so make sure we append/remove the lower case string.
 				# Else we get x not present in list Value Errors.
-				self.site_artist_machines.append(worker.lower())
-		if site == "eu_w":
+				site_artist_machines.append(worker.lower())
+		if self.site == "eu_w":
 			for worker in self.mtl_artist_london_machines_list:
 				# First check if the machine is in the list. Groups can be removed from machines on Deadline if they
 				# have been reinstalled or recently added to the farm. Regardless, if it's location on Shotgrid is
 				# London, it should be in the eu_w_workstations group.
-				if worker.lower() not in self.site_artist_machines:
-					RepositoryUtils.AddGroupToSlave(worker.lower(), "eu_w_workstations")
-					print("Added {} to the {}_workstations group in Deadline.".format(worker.lower(), site))
+				if worker.lower() not in site_artist_machines:
+					u_DeadlineToolbox.add_group_to_slave(worker.lower(), "eu_w_workstations")
+					print("Added {} to the {}_workstations group in Deadline.".format(worker.lower(), self.site))
 				# If a worker is not in the list already due to it not being in the group, we don't need to worry about
 				# removing it, hence elif. It will be in the list next time around and hit this elif then too.
 				# If the worker does exist in the list, remove it.
-				elif worker.lower() in self.site_artist_machines:
-					self.site_artist_machines.remove(worker.lower())
+				elif worker.lower() in site_artist_machines:
+					site_artist_machines.remove(worker.lower())
+		return site_artist_machines
+
+	@lazy_property
+	def site_render_nodes(self):
+		# Get list of all the render nodes at the site (e.g. "na_ne_render_nodes").
+		return u_DeadlineToolbox.get_slave_names_in_group(self.site + "_render_nodes")
+
+	@lazy_property
+	def mtl_artist_london_machines_list(self):
+		# Get list of London machines currently assigned to Montreal artists from Shotgrid.
+		return u_DeadlineToolbox.get_ldn_machines_assigned_to_mtl_artists()
+
+	@lazy_property
+	def loud_worker_list(self):
+		# Get list of the loud machines (this is a temp group in LDN until they are removed from the floor).
+		return u_DeadlineToolbox.get_slave_names_in_group("pizza_boxes_on_floor")
+
+	@lazy_property
+	def active_pending_jobs(self):
+		# Get the active and pending jobs on the farm.
+		return RepositoryUtils.GetJobsInState(["Active", "Pending"])
+
+	@lazy_property
+	def failed_jobs(self):
+		# Get failed jobs for resetting group to 251
+		return RepositoryUtils.GetJobsInState(["Failed"])
 
-	def clear_workstation_pools(self):
+	@lazy_property
+	def all_pools(self):
+		# Get an updated list of all pools.
+		return RepositoryUtils.GetPoolNames()
+
+	def workstation_render_pools(self):
 		"""
-		Remove all the pools from each workstation at a given site.
+		Returns the render pools the site's workstations are given during the day.
 		"""
-		for worker in self.site_artist_machines:
-			RepositoryUtils.SetPoolsForSlave(worker, [""])
+		excluded_pools = list(self.excluded_workstation_pools)
+		# Temp remove mm pool from mtl workstations only. As mm submission is borked till config2.
+		if any("mtl" in worker for worker in self.site_artist_machines):
+			excluded_pools.append("mm")
+		return set(pool for pool in self.all_pools if pool not in excluded_pools)
+
+	def render_pool_workstations(self):
+		"""
+		Returns the site's workstations that are given the render pools during the day.
+		"""
+		loud_workers = set(self.loud_worker_list)
+		# leave loud workers out of the render pool during the day
+		return [worker for worker in self.site_artist_machines if worker not in loud_workers]
+
+	def loud_workstation_render_pools(self):
+		"""
+		Returns the render pools the loud workstations are given overnight, i.e. all but the excluded and mtl pools.
+		"""
+		return set(pool for pool in self.all_pools
+				   if "mtl" not in pool and pool not in self.excluded_workstation_pools)
+
+	def get_workers_for_user_group(self, user_group):
+		"""
+		Returns the machines of a user group's users, from the comment on the machine (where we put the last logged-in
+		user). The worker inventory indexes this, so we only fetch the workers once.
+		"""
+		workers = []
+		for user_name in RepositoryUtils.GetUserGroup(user_group):
+			workers.extend(u_DeadlineToolbox.worker_inventory.get_workers_for_user(user_name))
+		return workers
 
 	def set_cg_to_group(self, group):
 		"""
@@ -94,11 +172,16 @@ class CronLibrary:
 		comp machines during the day. We also do this for failed jobs as if artists resume them in the morning,
 		they would render on all machines, which isn't wanted.
 		"""
-		for jobs_list in [self.active_pending_jobs, self.failed_jobs]:
-			for job in jobs_list:
-				if job.JobPlugin in self.cg_renderers or "arnold license limit" in job.JobLimitGroups:
-					job.JobGroup = group
-					RepositoryUtils.SaveJob(job)
+		def desired_state(job):
+			if job.JobPlugin in self.cg_renderers or "arnold license limit" in job.JobLimitGroups:
+				return {"JobGroup": group}
+			return None
+
+		# Only the jobs not already in the group are saved.
+		return u_JobPatch.bulk_patch_jobs(list(self.active_pending_jobs) + list(self.failed_jobs),
+										  desired_state,
+										  lease_store=self.job_lease_store
+										  )
 
 	def reset_houdini_engine_licence_limit(self, no_of_licenses):
 		"""
@@ -149,66 +232,25 @@ class CronLibrary:
 
 	def requeue_tasks_on_list_of_machines(self, list_of_machines):
 		"""
-		This function re-queues any rendering tasks on a given list of machines.
+		This function re-queues any rendering tasks on a given list of machines, including their splits.
+
+		Returns:
+			report: u_DeadlineToolbox.RequeueReport
 		"""
-		for job in self.active_pending_jobs:
+		def cg_job_filter(job):
 			# Add an exception for if we need a test job on a workstation, and we don't want it to be affected by
 			# the requeue script. (Put these types of jobs in the render_testing pool)
-			if "render_testing" not in job.JobPool:
-				# use the u_render check tool to determine if the job is u_render (CommandLine arnold) If the
-				u_render_job_check = u_DeadlineToolbox.is_job_u_render(job)
-				if u_render_job_check or job.JobPlugin in self.cg_renderers:
-					# get the TaskCollection on that job
-					job_task_collection = RepositoryUtils.GetJobTasks(job, True)
-					# set up a list to add tasks to be re-queued into
-					task_that_need_to_be_requeued = []
-					# If the worker on a task is in the list of site workstations and is rendering,
-					# add it to the list of tasks to be re-queued
-					for task in job_task_collection.TaskCollectionTasks:
-						if any(worker in task.TaskSlaveName for worker in list_of_machines):
-							if task.TaskStatus == "Rendering":
-								task_that_need_to_be_requeued.append(task)
-					# Requeue the tasks
-					RepositoryUtils.RequeueTasks(job, task_that_need_to_be_requeued)
-
-	def add_render_pools_to_workstations(self):
-		"""
-		Adds render pools to each workstation
-		"""
-		# Temp remove mm pool from mtl workstations only. As mm submission is borked till config2.
-		if any("mtl" in worker for worker in self.site_artist_machines):
-			self.excluded_workstation_pools.append("mm")
-		for worker in self.site_artist_machines:
-			# leave loud workers out of the render pool during the day
-			if worker not in self.loud_worker_list:
-				for pool in self.all_pools:
-					if pool not in self.excluded_workstation_pools:
-						RepositoryUtils.AddPoolToSlave(worker, pool)
-
-	def modify_worker_state_for_user_group(self, user_group, worker_state):
-		"""
-		People working late need their machine to not be enabled by the farm overnight.
-		Some leads who are always in meetings need their machine disabled, so it doesn't get used on the farm when
-		it goes idle for an hour
-		"""
-		# Get the user group users
-		user_group_users = RepositoryUtils.GetUserGroup(user_group)
-		for user_name in user_group_users:
-			# Get the user's machine by comparing it with the comment on the machine (where we put the last
-			# logged-in user)
-			all_worker_settings = RepositoryUtils.GetSlaveSettingsList(True)
-			for worker in all_worker_settings:
-				if worker.SlaveComment == user_name:
-					u_DeadlineToolbox.modify_worker(worker.SlaveName, set_worker_state=worker_state)
-
-	def add_loud_workstations_to_render_pool(self):
-		"""
-		Adds all pools except excluded pools i.e. windows, pdg etc...
-		"""
-		for worker in self.loud_worker_list:
-			for pool in self.all_pools:
-				if "mtl" not in pool and pool not in self.excluded_workstation_pools:
-					RepositoryUtils.AddPoolToSlave(worker, pool)
+			if "render_testing" in job.JobPool:
+				return False
+			# use the u_render check tool to determine if the job is u_render (CommandLine arnold)
+			return u_DeadlineToolbox.is_job_u_render(job) or job.JobPlugin in self.cg_renderers
+
+		return u_DeadlineToolbox.requeue_rendering_tasks(list_of_machines,
+														 jobs=self.active_pending_jobs,
+														 job_filter=cg_job_filter,
+														 match_machine_splits=True,
+														 lease_store=self.job_lease_store
+														 )
 
 	def force_start_workers(self):
 		"""
@@ -216,37 +258,53 @@ class CronLibrary:
 		logged out. This won't impact the user if they're still using it as the worker will go offline when it detects
 		input.
 		"""
-		for worker in self.site_artist_machines:
-			SlaveUtils.SendRemoteCommand(worker, "LaunchSlave")
+		# Sent to all the workstations at once, so an unreachable one doesn't hold up the rest.
+		# Launching a worker that's already running does nothing, so the workstations that time out can be tried again.
+		return u_DeadlineToolbox.remote_command_executor.send(self.site_artist_machines, "LaunchSlave",
+															   retry_on_timeout=True)
 
 	def restart_render_nodes(self):
 		"""
 		Restart all the site's render nodes, after it finishes with the job rendering on it. This helps lessen random
 		machine errors.
+
+		The nodes are restarted a few at a time (see u_RollingRestart), so this runs until they're all
+		back, for up to 6 hours. It's run on its own by the u_RenderNodeRestart cron, so it doesn't hold up any other
+		cron steps.
 		"""
 		# Restart each render node after the last task has completed on it.
-		for worker in self.site_render_nodes:
-			SlaveUtils.SendRemoteCommand(worker, "OnLastTaskComplete RestartMachine")
+		return u_RollingRestart.RollingRestart(
+			remote_command_executor=u_DeadlineToolbox.remote_command_executor
+		).run(self.site_render_nodes)
 
 	def set_job_plugin_priority(self, plugin, priority):
 		"""
 		Set all the jobs of a certain plugin to a given priority.
 		"""
-		for job in self.active_pending_jobs:
-			if job.JobPlugin == plugin:
-				job.JobPriority = priority
-				# if the priority is above 50 we need to note it in the job extra info, as this is referenced in the
-				# Farm Notification System.
-				if priority > 50:
-					job.JobExtraInfo9 = "Automatic raised priority job"
-				RepositoryUtils.SaveJob(job)
+		def desired_state(job):
+			if job.JobPlugin != plugin:
+				return None
+			fields = {"JobPriority": priority}
+			# if the priority is above 50 we need to note it in the job extra info, as this is referenced
+			# in the Farm Notification System.
+			if priority > 50:
+				fields["JobExtraInfo9"] = "Automatic raised priority job"
+			return fields
+
+		return u_JobPatch.bulk_patch_jobs(self.active_pending_jobs,
+										  desired_state,
+										  lease_store=self.job_lease_store
+										  )
 
 	def remove_machine_limits_on_all_jobs(self):
 		"""
 		Remove all machine limits for active and pending jobs.
 		"""
-		for job in self.active_pending_jobs:
-			RepositoryUtils.SetMachineLimitMaximum(job.JobId, 0)
+		# Only the jobs that have a machine limit are written.
+		return u_JobPatch.bulk_patch_jobs(self.active_pending_jobs,
+										  lambda job: {"JobMachineLimit": 0},
+										  lease_store=self.job_lease_store
+										  )
 
 	def reset_force_machine_limit_values(self):
 		"""
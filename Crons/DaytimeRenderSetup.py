@@ -3,6 +3,7 @@
 """
 """
 from scripts.General.Crons import u_CronLibrary
+from scripts.General.Crons import u_FarmStateReconciler
 import socket
 
 
@@ -28,28 +29,23 @@ def eu_w_1030_cron():
     - Adds the render pools back to the LDN workstations.
     - Re-enables workstations disabled the previous night in the "u_OvernightDisableMachine" group.
     - Disables workstations of leads/HODs in the "u_DisableMachineDuringDay" group.
+      (These three are the "1030" farm state in u_FarmStateReconciler.)
      """
     # Instantiate the cron library with the site location.
     cron_lib_instance = u_CronLibrary.CronLibrary(site="eu_w")
 
     # Run the needed functions.
-    cron_lib_instance.add_render_pools_to_workstations()
-    cron_lib_instance.modify_worker_state_for_user_group(user_group="u_OvernightDisableMachine",
-                                                     worker_state=True
-                                                     )
-    cron_lib_instance.modify_worker_state_for_user_group(user_group="u_DisableMachineDuringDay",
-                                                     worker_state=False
-                                                     )
+    u_FarmStateReconciler.FarmStateReconciler(cron_lib_instance).reconcile("1030")
     cron_lib_instance.reset_user_groups(groups=["u_OvernightDisableMachine"])
 
 def ne_ne_0930_cron():
     """
     This is a cron that will run at 09:30am Mon-Fri in MTL.
-    - Adds the render pools back to the MTL workstations.
+    - Adds the render pools back to the MTL workstations. (The "0930" farm state in u_FarmStateReconciler.)
      """
     # Instantiate the cron library with the site location.
     cron_lib_instance = u_CronLibrary.CronLibrary(site="na_ne")
 
     # Run the needed functions.
-    cron_lib_instance.add_render_pools_to_workstations()
+    u_FarmStateReconciler.FarmStateReconciler(cron_lib_instance).reconcile("0930")
 
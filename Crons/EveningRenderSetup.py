@@ -3,6 +3,7 @@
 """
 """
 from scripts.General.Crons import u_CronLibrary
+from scripts.General.Crons import u_FarmStateReconciler
 import socket
 
 
@@ -27,7 +28,6 @@ def eu_w_1900_cron():
 	This is a cron that will run at 19:00pm Mon-Fri in LDN.
 	- Adds loud workstations back into render pool.
 	- Force starts all workstations, allowing the farm to use them even if the user doesn't log out.
-	- Restart the site's workstations to prevent long term errors.
 	- Remove the group from CG renders.
 	- Set remaining Nuke jobs to 95 priority. This allows them to go through before prioritised CG.
 	- Remove any machine limits on jobs.
@@ -35,33 +35,29 @@ def eu_w_1900_cron():
 	- Reset "u_TimeoutErrorHandling" values.
 	- Disable workers in the "u_OvernightDisableMachine" group. (Usually for people working late)
 	- Enable workers in the "u_DisableMachineDuringDay" group. Allows lead / HOD machines to be used on the farm.
+	The loud workstation pools and the user group worker states are the "1900" farm state in u_FarmStateReconciler.
+	They're reconciled separately, so the worker states still change last.
 	"""
 
 	# Instantiate the cron library with the site location.
 	cron_lib_instance = u_CronLibrary.CronLibrary(site="eu_w")
+	reconciler = u_FarmStateReconciler.FarmStateReconciler(cron_lib_instance)
 
 	# Run the needed functions.
-	cron_lib_instance.add_loud_workstations_to_render_pool()
+	reconciler.reconcile("1900", parts=["pools"])
 	cron_lib_instance.force_start_workers()
-	cron_lib_instance.restart_render_nodes()
 	cron_lib_instance.set_cg_to_group(group="none")
 	cron_lib_instance.set_job_plugin_priority(plugin="Nuke", priority=95)
 	cron_lib_instance.remove_machine_limits_on_all_jobs()
 	cron_lib_instance.reset_force_machine_limit_values()
 	cron_lib_instance.reset_timeout_error_handling_values()
-	cron_lib_instance.modify_worker_state_for_user_group(user_group="u_OvernightDisableMachine",
-													 worker_state=False
-													 )
-	cron_lib_instance.modify_worker_state_for_user_group(user_group="u_DisableMachineDuringDay",
-													 worker_state=True
-													 )
+	reconciler.reconcile("1900", parts=["worker_states"])
 
 
 def ne_ne_1800_cron():
 	"""
 	This is a cron that will run at 18:00pm Mon-Fri in MTL.
 	- Force starts all workstations, allowing the farm to use them even if the user doesn't log out.
-	- Restart the site's workstations to prevent long term errors.
 	"""
 
 	# Instantiate the cron library with the site location.
@@ -69,5 +65,4 @@ def ne_ne_1800_cron():
 
 	# Run the needed functions.
 	cron_lib_instance.force_start_workers()
-	cron_lib_instance.restart_render_nodes()
 
@@ -0,0 +1,194 @@
+#! /usr/bin/python
+
+"""
+Farm State Reconciler:
+
+Brings the farm to the state we want for each site's cron window, instead of the crons re-applying every step to
+every worker each day. The state for each window is described in farm_state_windows below: the pools of the site's
+workstations and loud workstations, which user groups' workers are enabled or disabled, and limit maximums.
+
+The reconciler takes one bulk snapshot of the workers (through the u_DeadlineToolbox worker inventory) and the limits
+it needs, diffs it against the desired state, and only applies the operations for what's different. So the time a cron
+takes, and the load it puts on the repository, depends on how much has changed rather than on the size of the farm.
+
+In dry-run mode the plan is printed but nothing is changed. Set the U_RECONCILER_DRY_RUN environment variable to "1"
+to dry-run the crons.
+
+Example:
+	cron_lib_instance = u_CronLibrary.CronLibrary(site="eu_w")
+	FarmStateReconciler(cron_lib_instance).reconcile("0830")
+"""
+
+from Deadline.Scripting import *
+from scripts.General.u_DeadlineToolbox import u_DeadlineToolbox
+import os
+import time
+
+# The desired state of each site, for each cron window ("HHMM" local time).
+#   workstation_pools: "none" to remove all pools from the site's workstations, or "render" to make sure they have
+#   all the render pools (the loud workstations are left alone).
+#   loud_workstation_pools: "render" to make sure the loud workstations have the render pools, except the mtl ones.
+#   user_group_workers_enabled: {user group: True to enable or False to disable the machines of its users}
+#   limit_maximums: {limit name: maximum}
+# A cron can reconcile these parts of its window separately, to keep the order of its other steps.
+reconcile_parts = ("pools", "worker_states", "limits")
+# {window state key: the part it belongs to}
+window_state_parts = {"workstation_pools": "pools",
+					  "loud_workstation_pools": "pools",
+					  "user_group_workers_enabled": "worker_states",
+					  "limit_maximums": "limits"
+					  }
+farm_state_windows = {
+	"eu_w": {
+		"0830": {"workstation_pools": "none",
+				 "limit_maximums": {"houdini": 6}
+				 },
+		"1030": {"workstation_pools": "render",
+				 "user_group_workers_enabled": {"u_OvernightDisableMachine": True,
+												"u_DisableMachineDuringDay": False
+												}
+				 },
+		"1900": {"loud_workstation_pools": "render",
+				 "user_group_workers_enabled": {"u_OvernightDisableMachine": False,
+												"u_DisableMachineDuringDay": True
+												}
+				 },
+	},
+	"na_ne": {
+		"0730": {"workstation_pools": "none"},
+		"0930": {"workstation_pools": "render"},
+	},
+}
+
+
+class FarmStateReconciler:
+
+	def __init__(self, cron_library, dry_run=None):
+		"""
+		Args:
+			cron_library: u_CronLibrary.CronLibrary: The site's cron library, for its worker lists and the rules of which
+			workers get which pools.
+			dry_run: bool: Only print the plan. Defaults to the U_RECONCILER_DRY_RUN environment variable.
+		"""
+		self.cron_library = cron_library
+		self.site = cron_library.site
+		if dry_run is None:
+			dry_run = os.environ.get("U_RECONCILER_DRY_RUN", "0") == "1"
+		self.dry_run = dry_run
+
+	def desired_worker_pools(self, window_state):
+		"""
+		Returns:
+			dict: {worker name: (mode, pools)}. A mode of "exact" means the worker should have exactly these pools,
+			"include" means it should have at least these pools.
+		"""
+		desired_pools = {}
+		workstation_pools = window_state.get("workstation_pools")
+		if workstation_pools == "none":
+			for worker in self.cron_library.site_artist_machines:
+				desired_pools[worker] = ("exact", set())
+		elif workstation_pools == "render":
+			pools = self.cron_library.workstation_render_pools()
+			for worker in self.cron_library.render_pool_workstations():
+				desired_pools[worker] = ("include", pools)
+		if window_state.get("loud_workstation_pools") == "render":
+			pools = self.cron_library.loud_workstation_render_pools()
+			for worker in self.cron_library.loud_worker_list:
+				desired_pools[worker] = ("include", pools)
+		return desired_pools
+
+	def desired_worker_states(self, window_state):
+		"""
+		Returns:
+			dict: {worker name: True to be enabled, or False to be disabled}
+		"""
+		desired_states = {}
+		for user_group, worker_state in window_state.get("user_group_workers_enabled", {}).items():
+			for worker in self.cron_library.get_workers_for_user_group(user_group):
+				desired_states[worker] = worker_state
+		return desired_states
+
+	def plan(self, window, parts=reconcile_parts):
+		"""
+		Diff the desired state of a window against a snapshot of the farm.
+
+		Args:
+			window: string: The cron window, e.g. "1900".
+			parts: list: The parts of the window to diff, from reconcile_parts.
+		Returns:
+			operations: list: (operation, target, value) tuples, e.g. ("SetPoolsForSlave", "render01", ["2d"]).
+		"""
+		window_state = dict((key, value) for key, value in farm_state_windows[self.site][window].items()
+							if window_state_parts[key] in parts)
+		# One bulk fetch of all the workers, the diff below is against this snapshot.
+		u_DeadlineToolbox.worker_inventory.refresh()
+		inventory = u_DeadlineToolbox.worker_inventory
+		operations = []
+
+		for worker, (mode, pools) in sorted(self.desired_worker_pools(window_state).items()):
+			current_pools = set(inventory.get_pools_for_worker(worker))
+			if mode == "exact" and current_pools != pools:
+				operations.append(("SetPoolsForSlave", worker, sorted(pools)))
+			elif mode == "include" and not pools.issubset(current_pools):
+				operations.append(("SetPoolsForSlave", worker, sorted(current_pools | pools)))
+
+		for worker, worker_state in sorted(self.desired_worker_states(window_state).items()):
+			worker_settings = inventory.worker_settings.get(worker)
+			if worker_settings is not None and worker_settings.SlaveEnabled != worker_state:
+				operations.append(("SetSlaveEnabled", worker, worker_state))
+
+		for limit_name, maximum in sorted(window_state.get("limit_maximums", {}).items()):
+			limit_group = RepositoryUtils.GetLimitGroup(limit_name, True)
+			if limit_group is None or limit_group.LimitGroupLimit != maximum:
+				operations.append(("SetLimitGroupMaximum", limit_name, maximum))
+
+		return operations
+
+	def apply(self, operations):
+		"""
+		Apply the operations from plan(). The pools are set concurrently and the worker state changes are sent as one
+		batch.
+		"""
+		workers_to_modify = {True: [], False: []}
+		worker_pools = {}
+		for operation, target, value in operations:
+			if operation == "SetPoolsForSlave":
+				worker_pools[target] = value
+			elif operation == "SetSlaveEnabled":
+				workers_to_modify[value].append(target)
+			elif operation == "SetLimitGroupMaximum":
+				RepositoryUtils.SetLimitGroupMaximum(target, value)
+		if worker_pools:
+			u_DeadlineToolbox.set_pools_for_workers(worker_pools)
+		for worker_state, worker_names in workers_to_modify.items():
+			if worker_names:
+				u_DeadlineToolbox.modify_workers(worker_names, set_worker_state=worker_state)
+		# Our snapshot is out of date for the workers we enabled or disabled.
+		changed_workers = workers_to_modify[True] + workers_to_modify[False]
+		if changed_workers:
+			u_DeadlineToolbox.worker_inventory.refresh(changed_workers)
+
+	def reconcile(self, window, parts=reconcile_parts):
+		"""
+		Bring the site to the desired state for a cron window, or print the plan in dry-run mode.
+
+		Args:
+			window: string: The cron window, e.g. "1900".
+			parts: list: The parts of the window to reconcile, from reconcile_parts. Defaults to all of them.
+		Returns:
+			operations: list: The operations that were needed.
+		"""
+		start_time = time.time()
+		operations = self.plan(window, parts)
+		for operation in operations:
+			print("# {}plan: {} {} {}".format("Dry-run " if self.dry_run else "", *operation))
+		if not self.dry_run:
+			self.apply(operations)
+		print("# Reconciled {} {} with {} operations in {:.3f} seconds{}.".format(
+			self.site,
+			window,
+			len(operations),
+			time.time() - start_time,
+			" (dry-run, nothing was changed)" if self.dry_run else ""
+		))
+		return operations
@@ -0,0 +1,48 @@
+#! /usr/bin/python
+
+"""
+Restarts each site's render nodes a few at a time overnight. This waits for the nodes to come back, which can take
+hours, so it's its own cron rather than a step of EveningRenderSetup.
+"""
+from scripts.General.Crons import u_CronLibrary
+import socket
+
+
+def __main__(*args):
+	# Here we determine if the file is being run on the MTL pulse, or pulse1/2 (which are located in london)...
+	# ...then run the associated location's cron.
+	machine_name = socket.gethostname()
+	eu_w_pulses = ["pulse1", "pulse2"]
+	na_ne_pulse = "pulse-mtl-001"
+	if machine_name in eu_w_pulses:
+		eu_w_1900_cron()
+	elif machine_name == na_ne_pulse:
+		ne_ne_1800_cron()
+	else:
+		print("You are attempting to run cron this locally. This is designed to be run on a localised pulse server"
+			  "due to the nature of the functions being run."
+			  "Please ask systems to do this for you if you need to test on a pulse server.")
+
+
+def eu_w_1900_cron():
+	"""
+	This is a cron that will run at 19:00pm Mon-Fri in LDN, alongside EveningRenderSetup.
+	- Restart the site's render nodes a few at a time to prevent long term errors.
+	"""
+	# Instantiate the cron library with the site location.
+	cron_lib_instance = u_CronLibrary.CronLibrary(site="eu_w")
+
+	# Run the needed functions.
+	cron_lib_instance.restart_render_nodes()
+
+
+def ne_ne_1800_cron():
+	"""
+	This is a cron that will run at 18:00pm Mon-Fri in MTL, alongside EveningRenderSetup.
+	- Restart the site's render nodes a few at a time to prevent long term errors.
+	"""
+	# Instantiate the cron library with the site location.
+	cron_lib_instance = u_CronLibrary.CronLibrary(site="na_ne")
+
+	# Run the needed functions.
+	cron_lib_instance.restart_render_nodes()
@@ -5,6 +5,7 @@ To run this script use the following cmd in a linux terminal
 """
 
 from scripts.General.Crons import u_CronLibrary
+from scripts.General.Crons import u_FarmStateReconciler
 import socket
 
 
@@ -28,8 +29,9 @@ def eu_w_0830_cron():
 	"""
 	This is a cron that will run at 08:30am Mon-Fri in LDN.
 	- Remove all Pools from LDN workstations, so they can no longer pick up jobs until added in a later cron.
-	- Set any left over CG to the "251gb" group.
 	- Reset the Houdini license limit for when we change it overnight
+	  (These two are the "0830" farm state in u_FarmStateReconciler.)
+	- Set any left over CG to the "251gb" group.
 	- Reset the priority lists
 	- Check for and restart any users who forgot to log out and went on holiday / on set.
 	"""
@@ -37,9 +39,8 @@ def eu_w_0830_cron():
 	cron_lib_instance = u_CronLibrary.CronLibrary(site="eu_w")
 
 	# Run the needed functions.
-	cron_lib_instance.clear_workstation_pools()
+	u_FarmStateReconciler.FarmStateReconciler(cron_lib_instance).reconcile("0830")
 	cron_lib_instance.set_cg_to_group(group="251gb")
-	cron_lib_instance.reset_houdini_engine_licence_limit(no_of_licenses=6)
 	cron_lib_instance.reset_user_groups(groups=["u_PriorityUsers", "u_CT_Users"])
 	cron_lib_instance.restart_holiday_onset_users()
 
@@ -48,10 +49,11 @@ def ne_ne_0730_cron():
 	"""
 	This is a cron that will run at 07:30am Mon-Fri in MTL.
 	- Remove all Pools from MTL workstations, so they can no longer pick up jobs until added in a later cron.
+	  (The "0730" farm state in u_FarmStateReconciler.)
 	"""
 	# Instantiate the cron library with the site location.
 	cron_lib_instance = u_CronLibrary.CronLibrary(site="na_ne")
 
 	# Run the needed functions.
-	cron_lib_instance.clear_workstation_pools()
+	u_FarmStateReconciler.FarmStateReconciler(cron_lib_instance).reconcile("0730")
 # todo when they get more machines add the "cg_to_251_group" to this func.
@@ -14,13 +14,22 @@ u_environment_utils.setup_python_site_packages()
 from Deadline.Scripting import *
 import os
 import time
-import random
 from datetime import datetime
 import csv
+from concurrent.futures import ThreadPoolExecutor
 from System.Collections.Specialized import *
 from python.utilities import emailutils
+from scripts.General.u_CommandChannel import u_CommandChannel
+from scripts.General.u_FarmStateStore import u_FarmStateStore
+from scripts.General.u_JobPatch import u_JobPatch
+from scripts.General.u_RemoteCommandExecutor import u_RemoteCommandExecutor
 import pytz
 
+# Runs the commands we used to start a deadlinecommand process for, e.g. setting worker settings.
+command_channel = u_CommandChannel.CommandChannel()
+# Sends remote commands to many workers at once, with timeouts and retries.
+remote_command_executor = u_RemoteCommandExecutor.RemoteCommandExecutor()
+
 
 def modify_job(job,
                set_priority=0,
@@ -36,7 +45,8 @@ def modify_job(job,
                nuke_continue_on_error=None
                ):
     """
-    This function waits a random amount of time, then suspends the job before doing other actions defined below:
+    This function builds a JobPatch from the options defined below and applies it to the job in one save.
+    The job is only suspended if the frames per task or concurrent tasks are changed.
 
     :param job: The Deadline Job class to modify
     :param int set_priority: Option to modify the priority of the job and define what to set it to.
@@ -49,82 +59,50 @@ def modify_job(job,
     :param int set_concurrent_tasks: Option to set the concurrent tasks of the job.
     :param int set_frames_per_task: Option to set the frames per each task of the job.
     :param int set_machine_limit: Option to set the machine limit of a job.
+    :return bool: True if anything was changed on the job.
     """
-
-    # wait for a random amount of seconds to avoid doing multiple rounds of suspending and resuming.
-    random_number = random.uniform(2, 5)
-    time.sleep(random_number)
-    print("# waiting {} seconds before suspending the job, to avoid multiple rounds of "
-          "suspending and resuming".format(random_number))
-
-    # Suspend the job
-    RepositoryUtils.SuspendJob(job)
+    patch = u_JobPatch.JobPatch(job)
 
     if set_priority:
-        print("# the set_priority arg was found, so the priority will be set to '{}'".format(set_priority))
-        # Lower the priority
-        job.JobPriority = set_priority
+        patch.set_field("JobPriority", set_priority)
 
     if set_timeout_to_0:
-        print("# the set_timeout_to_0 arg was found, so the timeout will be set to infinity")
         # Set the timeout to infinity
-        job.JobTaskTimeoutSeconds = 0
+        patch.set_field("JobTaskTimeoutSeconds", 0)
 
     if set_group:
-        print("# the set_group arg was found, so the job group will be set to '{}'".format(set_group))
         # Change the group of machines a job is being rendered on
-        job.JobGroup = set_group
+        patch.set_field("JobGroup", set_group)
 
     if override_job_failure_detection:
-        print("# Override job failure detection arg was found. Setting to 'True'. This will remove the upper "
-              "error limit on the job")
         # Remove the error limit on the job
-        job.JobOverrideJobFailureDetection = True
+        patch.set_field("JobOverrideJobFailureDetection", True)
 
     if override_task_failure_detection:
-        print("# Override task failure detection arg was found. Setting to 'True'. This will remove the upper "
-              "error limit on the task")
-        job.JobOverrideTaskFailureDetection = True
+        # Remove the error limit on the task
+        patch.set_field("JobOverrideTaskFailureDetection", True)
 
     if set_failure_detection:
-        print("# the set_failure_detection arg was found. the new amount of errors that will occur before failing "
-              "is '{}'".format(set_failure_detection))
         # Change the amount of errors a job can have before failing
-        job.JobOverrideJobFailureDetection = True
-        job.JobFailureDetectionJobErrors = set_failure_detection
+        patch.set_field("JobOverrideJobFailureDetection", True)
+        patch.set_field("JobFailureDetectionJobErrors", set_failure_detection)
 
     if append_job_comment:
-        print("# The set_job_comment arg was found. Appending the job comment to include other things")
-        # Get the existing job comment and add out comment before it
-        existing_job_comment = job.JobComment
-        new_job_comment = "{} -- {}".format(existing_job_comment, append_job_comment)
-        job.JobComment = new_job_comment
+        patch.append_comment(append_job_comment)
 
     if set_concurrent_tasks is not None:
-        print("# Setting concurrent tasks to: {}".format(set_concurrent_tasks))
-        job.JobConcurrentTasks = set_concurrent_tasks
+        patch.set_field("JobConcurrentTasks", set_concurrent_tasks)
 
     if set_frames_per_task is not None:
-        print("# Setting frames per task to: {}".format(set_frames_per_task))
-        RepositoryUtils.SetJobFrameRange(job, job.JobFrames, set_frames_per_task)
+        patch.set_frames_per_task(set_frames_per_task)
 
     if nuke_continue_on_error:
-        print("# This job continued on error: ", job)
-        job.SetJobPluginInfoKeyValue("ContinueOnError", "True")
-
-    # Save the job
-    RepositoryUtils.SaveJob(job)
-
-    # This is after the save job as with the changes above we are using a cached version of the job to make changes
-    # to, then saving it. Doing it after the save updates the machine limit in the monitor live, as it doesnt need
-    # to be saved.
+        patch.set_plugin_info("ContinueOnError", "True")
 
     if set_machine_limit is not None:
-        print("# Setting machine limit to: {}".format(set_machine_limit))
-        RepositoryUtils.SetMachineLimitMaximum(job.JobId, set_machine_limit)
+        patch.set_machine_limit(set_machine_limit)
 
-    # Resuming the job
-    RepositoryUtils.ResumeJob(job)
+    return patch.apply()
 
 
 def modify_worker(slave,
@@ -144,16 +122,22 @@ def modify_worker(slave,
         time.sleep(time_delay_secs)
 
     if set_worker_state is not None:
-        state_string = ""
-        if set_worker_state:
-            state_string = "enable"
-        elif not set_worker_state:
-            state_string = "disable"
-        # Setup the command to set the worker state
-        cmd_args = ["SetSlaveSetting", slave, 'SlaveEnabled', set_worker_state]
-        # run the command to disable the worker
-        ClientUtils.ExecuteCommand(cmd_args)
-        print("'# executed the command to {} the machine '{}'.".format(state_string, slave))
+        modify_workers([slave], set_worker_state=set_worker_state)
+
+
+def modify_workers(worker_names, set_worker_state):
+    """
+    Enable or disable a list of workers, sending the commands as one batch through the command channel.
+
+    :param list worker_names: The deadline machines or "slaves" to modify.
+    :param bool set_worker_state: Set the workers to be enabled: True, or disabled: False.
+    """
+    state_string = "enable" if set_worker_state else "disable"
+    for worker_name in worker_names:
+        command_channel.submit("SetSlaveSetting", worker_name, "SlaveEnabled", set_worker_state)
+    command_channel.flush()
+    for worker_name in worker_names:
+        print("'# executed the command to {} the machine '{}'.".format(state_string, worker_name))
 
 
 def log_creator(error_report,
@@ -213,48 +197,289 @@ def send_email(subject, message, addressee_list):
                           )
 
 
-def get_slave_names_in_group(group_name=""):
+class WorkerInventory:
+    """
+    An index of every worker's settings, built from one bulk fetch and shared by everything in this process.
+
+    It maps the logged-in user (which we put in the worker's comment) to their workers, groups to their workers, and
+    each worker to its groups and pools. This replaces calling RepositoryUtils.GetSlaveSettingsList(True) for every
+    user, and the deadlinecommand -GetSlaveNamesInGroup subprocess for every group.
+
+    The inventory is reloaded once it is older than the TTL, which can be set with the U_WORKER_INVENTORY_TTL_SECONDS
+    environment variable. On a reload, only the workers whose comment, groups or pools changed are re-indexed. When
+    our own code changes a worker, e.g. add_group_to_slave(), just that worker is reloaded.
+    """
+
+    def __init__(self, ttl_seconds=None):
+        self.ttl_seconds = ttl_seconds or int(os.environ.get("U_WORKER_INVENTORY_TTL_SECONDS",
+                                                             os.environ.get("U_GROUP_CACHE_TTL_SECONDS", 300)))
+        # {worker name: worker settings}
+        self.worker_settings = {}
+        # {worker name: (comment, groups, pools)}, used to find what changed on a reload.
+        self.indexed_state = {}
+        # {user name: set of worker names}
+        self.workers_by_user = {}
+        # {group name: set of worker names}
+        self.workers_by_group = {}
+        self.loaded_time = 0
+
+    def refresh(self, worker_names=None):
+        """
+        Reload the inventory. Only the workers that have changed are re-indexed.
+
+        Args:
+            worker_names: list: Option to only reload these workers, e.g. after we've changed them.
+        """
+        start_time = time.time()
+        if worker_names is None:
+            settings_list = list(RepositoryUtils.GetSlaveSettingsList(True))
+            # Workers that aren't on Deadline anymore need removing from the index.
+            removed_workers = set(self.worker_settings) - set(settings.SlaveName for settings in settings_list)
+        else:
+            settings_list = []
+            removed_workers = set()
+            for worker_name in worker_names:
+                settings = RepositoryUtils.GetSlaveSettings(worker_name, True)
+                if settings is None:
+                    removed_workers.add(worker_name)
+                else:
+                    settings_list.append(settings)
+
+        changed_count = len(removed_workers)
+        for worker_name in removed_workers:
+            self.unindex_worker(worker_name)
+            self.worker_settings.pop(worker_name, None)
+        for settings in settings_list:
+            worker_name = settings.SlaveName
+            self.worker_settings[worker_name] = settings
+            state = (settings.SlaveComment, tuple(settings.SlaveGroups), tuple(settings.SlavePools))
+            if self.indexed_state.get(worker_name) != state:
+                self.unindex_worker(worker_name)
+                self.index_worker(worker_name, state)
+                changed_count += 1
+        if worker_names is None:
+            self.loaded_time = time.time()
+        print("# Refreshed {} workers in the worker inventory, {} changed, in {:.3f} seconds.".format(
+            len(settings_list),
+            changed_count,
+            time.time() - start_time
+        ))
+
+    def index_worker(self, worker_name, state):
+        user_name, groups, pools = state
+        self.indexed_state[worker_name] = state
+        self.workers_by_user.setdefault(user_name, set()).add(worker_name)
+        for group_name in groups:
+            self.workers_by_group.setdefault(group_name, set()).add(worker_name)
+
+    def unindex_worker(self, worker_name):
+        state = self.indexed_state.pop(worker_name, None)
+        if state is None:
+            return
+        user_name, groups, pools = state
+        self.workers_by_user.get(user_name, set()).discard(worker_name)
+        for group_name in groups:
+            self.workers_by_group.get(group_name, set()).discard(worker_name)
+
+    def refresh_if_stale(self, max_age_seconds=None):
+        """
+        Reload the inventory if it's older than the TTL.
+
+        Args:
+            max_age_seconds: int: Option to override the TTL, e.g. 0 to always reload.
+        """
+        if max_age_seconds is None:
+            max_age_seconds = self.ttl_seconds
+        if time.time() - self.loaded_time > max_age_seconds:
+            self.refresh()
+
+    def get_workers_for_user(self, user_name, max_age_seconds=None):
+        """
+        Returns the workers whose comment is the user's name, i.e. the machines they're logged in to.
+        """
+        self.refresh_if_stale(max_age_seconds)
+        return sorted(self.workers_by_user.get(user_name, []))
+
+    def get_workers_in_group(self, group_name, max_age_seconds=None):
+        """
+        Returns a new list of the workers in a group, so callers can change it without changing the inventory.
+        """
+        self.refresh_if_stale(max_age_seconds)
+        return sorted(self.workers_by_group.get(group_name, []))
+
+    def get_groups_for_worker(self, worker_name, max_age_seconds=None):
+        self.refresh_if_stale(max_age_seconds)
+        return list(self.indexed_state.get(worker_name, ("", (), ()))[1])
+
+    def get_pools_for_worker(self, worker_name, max_age_seconds=None):
+        self.refresh_if_stale(max_age_seconds)
+        return list(self.indexed_state.get(worker_name, ("", (), ()))[2])
+
+    def get_worker_settings_list(self, max_age_seconds=None):
+        self.refresh_if_stale(max_age_seconds)
+        return list(self.worker_settings.values())
+
+
+# The inventory shared by everything in this process.
+worker_inventory = WorkerInventory()
+
+
+def get_slave_names_in_group(group_name="", max_age_seconds=None):
 
     """
     This function gets the slave names of all the workers in a group (set up in deadline monitor)
     Then puts them into a list to iterate over.
 
+    The group membership comes from the worker inventory, see WorkerInventory. The list returned is a new list, so
+    it's safe to change.
+
     Args:
         group_name
+        max_age_seconds: Option to override the inventory TTL, e.g. 0 to get the groups fresh from the repository.
     returns: worker_list
 
     :param str group_name: the name of the group to get the list of workers for
 
     """
 
-    cmd_list = ["-GetSlaveNamesInGroup", group_name]
-    cmd_result = ClientUtils.ExecuteCommandAndGetOutput(cmd_list)
-    worker_names = str(cmd_result)
-    worker_list = worker_names.splitlines()
+    return worker_inventory.get_workers_in_group(group_name, max_age_seconds=max_age_seconds)
+
+
+def add_group_to_slave(worker_name, group_name):
+    """
+    Add a group to a worker, and reload that worker in the worker inventory so the change is picked up.
+    """
+    RepositoryUtils.AddGroupToSlave(worker_name, group_name)
+    worker_inventory.refresh([worker_name])
+
+
+class RequeueReport:
+    """
+    What requeue_rendering_tasks() did, and how long it took.
+    """
+
+    def __init__(self):
+        self.jobs_checked = 0
+        # The jobs we had to get the tasks for, as they had rendering tasks.
+        self.jobs_loaded = 0
+        # {job ID: [task IDs]}
+        self.requeued_tasks = {}
+        self.seconds = 0
+
+    @property
+    def requeued_task_count(self):
+        return sum(len(task_ids) for task_ids in self.requeued_tasks.values())
+
+    def __str__(self):
+        return "Requeued {} tasks on {} jobs in {:.3f} seconds. Checked {} jobs, loaded the tasks of {}.".format(
+            self.requeued_task_count,
+            len(self.requeued_tasks),
+            self.seconds,
+            self.jobs_checked,
+            self.jobs_loaded
+        )
+
 
-    return worker_list
+def requeue_rendering_tasks(worker_names, jobs=None, job_filter=None, match_machine_splits=False, lease_store=None):
+    """
+    Requeue the tasks rendering on a list of workers.
+
+    Jobs without any rendering tasks are skipped before their tasks are loaded. For the rest, their rendering tasks are
+    indexed by worker, then looked up in a set of the worker names, and RequeueTasks is only called for jobs that have
+    tasks to requeue.
+
+    Args:
+        worker_names: list: The workers to requeue the rendering tasks on.
+        jobs: list: Option to check these jobs, instead of all the active jobs.
+        job_filter: function: Option to only requeue jobs this returns True for.
+        match_machine_splits: bool: Also requeue tasks on the splits of the workers, e.g. "render27-01" for
+        "render27".
+        lease_store: u_FarmStateStore.JobLeaseStore: Option to take the lease on each job before requeueing it.
+    Returns:
+        report: RequeueReport
+    """
+    start_time = time.time()
+    report = RequeueReport()
+    worker_name_set = set(worker_name.lower() for worker_name in worker_names)
+    if jobs is None:
+        jobs = RepositoryUtils.GetJobsInState("Active")
+    for job in jobs:
+        report.jobs_checked += 1
+        # Only load the tasks of jobs that have something rendering.
+        if not job.JobRenderingTasks:
+            continue
+        if job_filter is not None and not job_filter(job):
+            continue
+        report.jobs_loaded += 1
+        # Index the job's rendering tasks by the worker they're rendering on.
+        rendering_tasks_by_worker = {}
+        for task in RepositoryUtils.GetJobTasks(job, True).TaskCollectionTasks:
+            if task.TaskStatus == "Rendering":
+                rendering_tasks_by_worker.setdefault(task.TaskSlaveName.lower(), []).append(task)
+        tasks_to_requeue = []
+        for worker_name, tasks in rendering_tasks_by_worker.items():
+            if worker_name in worker_name_set or (match_machine_splits
+                                                  and worker_name.split("-")[0] in worker_name_set):
+                tasks_to_requeue.extend(tasks)
+        if not tasks_to_requeue:
+            continue
+        if lease_store is None:
+            RepositoryUtils.RequeueTasks(job, tasks_to_requeue)
+        else:
+            with u_FarmStateStore.job_lease(job.JobId, lease_store=lease_store) as lease_acquired:
+                if not lease_acquired:
+                    continue
+                RepositoryUtils.RequeueTasks(job, tasks_to_requeue)
+        report.requeued_tasks[job.JobId] = [task.TaskId for task in tasks_to_requeue]
+    report.seconds = time.time() - start_time
+    print("# {}".format(report))
+    return report
+
+
+def set_pools_for_workers(desired_pools, max_workers=8):
+    """
+    Set the pools of a list of workers, with one SetPoolsForSlave call for each worker whose pools differ.
+
+    The workers' current pools come from the worker inventory, and the calls run concurrently on a bounded pool of
+    threads, as each worker is independent.
+
+    Args:
+        desired_pools: dict: {worker name: list of the pools the worker should have}. An empty list removes all the
+        worker's pools.
+        max_workers: int: The most workers to set at the same time.
+    Returns:
+        changed_workers: list: The workers whose pools were set.
+    """
+    start_time = time.time()
+    changed_workers = [worker_name for worker_name, pools in sorted(desired_pools.items())
+                       if set(worker_inventory.get_pools_for_worker(worker_name)) != set(pools)]
+
+    def set_pools(worker_name):
+        worker_start_time = time.time()
+        # An empty list doesn't clear the pools, it needs an empty pool name.
+        RepositoryUtils.SetPoolsForSlave(worker_name, sorted(desired_pools[worker_name]) or [""])
+        print("# Set the pools of '{}' in {:.3f} seconds.".format(worker_name, time.time() - worker_start_time))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # list() so any errors from the threads are raised here.
+        list(executor.map(set_pools, changed_workers))
+    if changed_workers:
+        worker_inventory.refresh(changed_workers)
+    print("# Set the pools of {} of {} workers in {:.3f} seconds, the rest already had them.".format(
+        len(changed_workers),
+        len(desired_pools),
+        time.time() - start_time
+    ))
+    return changed_workers
 
 
 def requeue_tasks_on_workers(re_queue_worker_list):
     """
     This function re-queues all the rendering tasks on a list of workers
     """
-    # Get a list of all the active jobs
-    all_active_jobs = RepositoryUtils.GetJobsInState("Active")
-    # Loop through those active jobs to get a list of their tasks
-    for job in all_active_jobs:
-        job_task_collection = RepositoryUtils.GetJobTasks(job, True)
-        # set up a list to add tasks to be re-queued into
-        task_that_need_to_be_requeued = []
-        for task in job_task_collection.TaskCollectionTasks:
-            if task.TaskSlaveName in re_queue_worker_list:
-                # Make sure that we only re-queue rendering tasks, not completed tasks.
-                if task.TaskStatus == "Rendering":
-                    # add the task to the list of tasks to be re-queued
-                    task_that_need_to_be_requeued.append(task)
-        # Requeue the tasks for that job
-        RepositoryUtils.RequeueTasks(job, task_that_need_to_be_requeued)
+    report = requeue_rendering_tasks(re_queue_worker_list)
     print("# I've requeued the tasks on: {}.".format(re_queue_worker_list))
+    return report
 
 
 def set_worker_state_of_user_group(group="", worker_state=None):
@@ -262,11 +487,11 @@ def set_worker_state_of_user_group(group="", worker_state=None):
     Allows you to enable or disable a group of machines quickly.
     """
     user_machines = RepositoryUtils.GetUserGroup(group)
+    workers_to_modify = []
+    # The worker inventory maps the user in the worker's comment to their workers, so we only fetch the workers once.
     for user in user_machines:
-        all_workers = RepositoryUtils.GetSlaveSettingsList(True)
-        for worker in all_workers:
-            if worker.SlaveComment == user:
-                modify_worker(worker.SlaveName, set_worker_state=worker_state)
+        workers_to_modify.extend(worker_inventory.get_workers_for_user(user))
+    modify_workers(workers_to_modify, set_worker_state=worker_state)
 
 
 def get_job_frame_count(job):
@@ -280,8 +505,14 @@ def get_job_frame_count(job):
 def restart_after_task_completion(worker):
     """
     A simpler command to restart the machine after task completion instead of having to remember the string every time.
+
+    Args:
+        worker: The worker to restart, or a list of workers to restart them all at once.
+    Returns:
+        report: u_RemoteCommandExecutor.RemoteCommandReport
     """
-    SlaveUtils.SendRemoteCommand(worker, "OnLastTaskComplete RestartMachine")
+    worker_names = [worker] if isinstance(worker, str) else worker
+    return remote_command_executor.send(worker_names, "OnLastTaskComplete RestartMachine")
 
 
 def cleanup_files(path):
@@ -349,6 +580,7 @@ def create_temp_txt_file_path(job, function_name):
     """
     Return a file path that's unique to the job ID and Name that we use to determine if the function needs to run.
     We often use temp files to stop actions being performed multiple times on jobs.
+    NB: The error handlers now use u_FarmStateStore.SharedIdempotencyStore instead, which is atomic and cleans up.
     Args:
         job: The Deadline Job object: Used to draw the job ID and name for use in the temp file name.
         function_name: string: The name of the function calling this function. Used to determine what folder to put the
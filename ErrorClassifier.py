@@ -0,0 +1,108 @@
+#! /usr/bin/python
+"""
+
+Error Classifier:
+
+Tags a Deadline error report with the classes of the known errors in it, e.g. "stale_file_handle" or "task_timeout".
+For use in the OnJobError event scripts.
+
+Every known error pattern is compiled once, into a single regular expression with a named group per error class, so a
+report message is scanned once however many handlers look at it. The handlers then check for the error classes they
+handle instead of each re-scanning the message with their own re.match loops and substring checks.
+
+The patterns are searched for anywhere in the message. If one error is a more specific version of another, nest it as
+an optional named group inside the other's pattern (see "task_timeout"), as the patterns can't overlap each other.
+
+Example:
+    error_classes = u_ErrorClassifier.classify(errorReport)
+    if "stale_file_handle" in error_classes:
+        ...
+
+"""
+
+import re
+from functools import lru_cache
+
+# The error class and the regex pattern for it. Use re.escape for plain strings, so they're matched exactly.
+error_patterns = [
+    # ------------------------------------------- u_OnJobErrors ---------------------------------------------------
+    ("nuke_cache_dir", re.escape("Error: ERROR: Unable to create cache directory")),
+    # Errors we know don't affect the render, so we override the failure detection for them.
+    ("stale_file_handle", re.escape(" Stale file handle")),
+    ("no_such_file", r"Error: FailRenderException : IOError: \[Errno \d+\] No such file or directory:"),
+    ("file_exists", r"Error: IOError: \[Errno \d+\] File exists: "),
+    ("errors_generated", re.escape(" errors generated")),
+    ("max_user_count", re.escape("Maximum user counted exceeded.")),
+    ("sigsegv", re.escape("signal caught: SIGSEGV -- Invalid memory reference")),
+    ("no_licenses", re.escape("No licenses could be found to run this application.")),
+    ("moov_atom_not_found", re.escape("moov atom not found")),
+    # Errors to do with the heaviness of a job.
+    ("sandbox_unresponsive", re.escape("The Plugin's Sandbox process is alive but unresponsive.")),
+    ("exit_code_9", re.escape("unionLauncher: returning exit code 9")),
+    ("out_of_threads", re.escape("failed to create thread, out of resources.")),
+    # ---------------------------------------- u_DisableMachineErrorHandling --------------------------------------
+    ("no_space_left", re.escape("No space left on device")),
+    ("user_does_not_exist", r"The user '[^']*' does not exist"),
+    ("local_cache_permission", r"Permission denied: '/localCache/"),
+    # -------------------------------------------- u_AssErrorHandling ---------------------------------------------
+    ("ass_cant_read", r"\[ass\] can't read in"),
+    ("ass_line", r"\[ass\] line"),
+    # ------------------------------------------ u_TimeoutErrorHandling -------------------------------------------
+    # The 3 hour CG timeout set on submission is nested, so a 3 hour timeout is tagged with both classes. The adaptive
+    # timeouts can be any length, so u_SendErrorEmailToArtist checks the plugin for CG timeouts instead.
+    ("task_timeout", re.escape("The Worker did not complete the task before the Regular Task Timeout limit")
+     + "(?P<task_timeout_3_hours>" + re.escape(" of 00d 03h 00m 00s") + ")?"),
+    # ------------------------------------------ u_SendErrorEmailToArtist -----------------------------------------
+    ("camera_error", re.escape("Error:       Unable to initialize rendering module with given camera")),
+    ("geo_error", re.escape("Error:       Unable to save geometry for")),
+    ("ifd_error", re.escape("mantra: Unable to open IFD file")),
+    ("texture_error", re.escape(" [htoa.texture] Error converting texture")),
+    ("cook_error", re.escape("Error:       Cook error in input:")),
+    ("hip_error", re.escape("Error:       Unexpected end of .hip file")),
+    ("max_ram_used", re.escape("Error: FailRenderException : Process returned non-zero exit code '9'")),
+]
+
+
+def compile_error_patterns(patterns):
+    """
+    Compile a list of (error class, pattern) into one regex, with each pattern in a named group of its error class.
+
+    Args:
+        patterns: list: (error class, pattern) tuples, like error_patterns above.
+    Returns:
+        compiled_pattern: re.Pattern
+    """
+    return re.compile("|".join("(?P<{}>{})".format(error_class, pattern) for error_class, pattern in patterns))
+
+
+# Compile the patterns once, when the module is first imported.
+error_matcher = compile_error_patterns(error_patterns)
+
+
+@lru_cache(maxsize=256)
+def classify_message(report_message):
+    """
+    Returns the error classes found in an error message. This is cached, as the same message comes in over and over
+    again when every task of a job hits the same error.
+
+    Args:
+        report_message: string: The message of the error report.
+    Returns:
+        error_classes: frozenset: The names of the error classes found, e.g. frozenset({"stale_file_handle"}).
+    """
+    error_classes = set()
+    for match in error_matcher.finditer(report_message):
+        error_classes.update(error_class for error_class, matched in match.groupdict().items() if matched is not None)
+    return frozenset(error_classes)
+
+
+def classify(errorReport):
+    """
+    Returns the error classes found in a Deadline error report.
+
+    Args:
+        errorReport: The error report from the erroring task.
+    Returns:
+        error_classes: frozenset: The names of the error classes found.
+    """
+    return classify_message(str(errorReport.ReportMessage))
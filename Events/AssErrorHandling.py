@@ -11,7 +11,8 @@ If the file still isnt correct, we fail JUST the task so the rest of the job can
 
 from Deadline.Events import *
 from Deadline.Scripting import *
-import re
+from scripts.General.u_ErrorClassifier import u_ErrorClassifier
+from scripts.General.u_FarmStateStore import u_FarmStateStore
 from System.Collections.Specialized import *
 
 
@@ -28,6 +29,8 @@ class OnError(DeadlineEventListener):
     def __init__(self):
 
         self.OnJobErrorCallback += self.OnJobError
+        # The farm wide leases, shared with the other error handlers and the crons.
+        self.job_lease_store = u_FarmStateStore.JobLeaseStore()
 
     def Cleanup(self):
 
@@ -35,7 +38,15 @@ class OnError(DeadlineEventListener):
 
     def OnJobError(self, job, task, errorReport):
 
-        self.ass_error_handling(errorReport, job)
+        # Only take the lease if the report has an .ass error. These aren't coalesced, as each erroring task needs
+        # pending or failing on its own.
+        if not u_ErrorClassifier.classify(errorReport) & {"ass_cant_read", "ass_line"}:
+            return
+        # Hold the lease on the job while we pend / fail its tasks, so other error handlers don't change it at the
+        # same time.
+        with u_FarmStateStore.job_lease(job.JobId, lease_store=self.job_lease_store) as lease_acquired:
+            if lease_acquired:
+                self.ass_error_handling(errorReport, job)
 
     def ass_error_handling(self, errorReport, job):
 
@@ -55,13 +66,13 @@ class OnError(DeadlineEventListener):
         Returns:
         """
 
-        # Set up the list of errors to look for
-        fail_task_errors = [".*\[ass\] can't read in.*",
-                            ".*\[ass\] line.*"]
+        # Set up the list of error classes from u_ErrorClassifier to look for
+        fail_task_errors = ["ass_cant_read",
+                            "ass_line"]
+        error_classes = u_ErrorClassifier.classify(errorReport)
         # Loop through tasks and errors
-        for regex_pattern in fail_task_errors:
-            match_result = re.match(regex_pattern, errorReport.ReportMessage)
-            if match_result:
+        for error_class in fail_task_errors:
+            if error_class in error_classes:
                 # Set up a list of tasks to fail
                 tasks_to_fail = []
                 # Set up a list of tasks to pend
@@ -9,7 +9,8 @@ For some errors we can fix the machine automatically and re-enable it, if not we
 from Deadline.Events import *
 from Deadline.Scripting import *
 from scripts.General.u_DeadlineToolbox import u_DeadlineToolbox
-import re
+from scripts.General.u_ErrorClassifier import u_ErrorClassifier
+from scripts.General.u_FarmStateStore import u_FarmStateStore
 from System.Collections.Specialized import *
 
 
@@ -26,6 +27,8 @@ class OnError(DeadlineEventListener):
     def __init__(self):
 
         self.OnJobErrorCallback += self.disable_machine_error_handling
+        # Groups errors of the same class on a worker, so during an error storm we only handle them once per window.
+        self.error_coalescer = u_FarmStateStore.ErrorCoalescer()
 
     def Cleanup(self):
         del self.OnJobErrorCallback
@@ -44,30 +47,32 @@ class OnError(DeadlineEventListener):
 
 
         """
-        # List of regular expression patterns to look for in a Deadline Error report
-        disable_machine_error_patterns = ["No space left on device",
-                                          "The user '.*' does not exist",
-                                          ".*Permission denied: '/localCache/.*'"
-                                          ]
-
+        # List of error classes from u_ErrorClassifier to look for in a Deadline Error report
+        disable_machine_errors = ["no_space_left",
+                                  "user_does_not_exist",
+                                  "local_cache_permission"
+                                  ]
         # Get worker name
         worker_name = errorReport.ReportSlaveName
+        # These errors are about the worker, not the job, so group them by worker.
+        error_classes = self.error_coalescer.filter_error_classes("u_DisableMachineErrorHandling",
+                                                                  worker_name,
+                                                                  u_ErrorClassifier.classify(errorReport)
+                                                                  & set(disable_machine_errors)
+                                                                  )
 
         setup_and_send_email = True
         disable_machine_reason = ""
 
-        for regex_error_pattern in disable_machine_error_patterns:
-            # example of error message from Deadline 
+        for error_class in disable_machine_errors:
+            # example of error message from Deadline for "user_does_not_exist"
             # "The user 'vili' does not exist"
-            # use regular expression matching to match the regex error patterns listed above
-            # with the errorReport.ReportMessage string
-            match_result = re.match(regex_error_pattern, errorReport.ReportMessage)
-            if match_result:
+            if error_class in error_classes:
                 # Always disable the worker as we don't want to run any other jobs on it until fixed.
                 u_DeadlineToolbox.modify_worker(worker_name, set_worker_state=False)
                 # This error is usually caused if the sssd service on the machine stops running. A restart will
                 # usually solve this, but we can also restart the sssd with a commandline command.
-                if regex_error_pattern == "The user '.*' does not exist":
+                if error_class == "user_does_not_exist":
                     # This script is located at "/Volumes/resources/bin/u_restart_sssd_service.sh"
                     sssd_command_result = SlaveUtils.SendRemoteCommandWithResults(worker_name, "Execute u_restart_sssd_service.sh -X")
                     # Create / append a log for this error
@@ -93,10 +98,10 @@ class OnError(DeadlineEventListener):
                         setup_and_send_email = False
 
                 # If it is a cache error, tell the wrangler what to do next.
-                if regex_error_pattern == ".*Permission denied: '/localCache/.*'":
+                if error_class == "local_cache_permission":
                     disable_machine_reason = "Local Cache drive needs re-mounting. Ask systems to do this for you."
 
-                if regex_error_pattern == "No space left on device":
+                if error_class == "no_space_left":
                     disable_machine_reason = "The system has run out of storage, contact systems."
 
                 # If we have to disable a machine, set up an email and send it to the wrangler
@@ -6,10 +6,11 @@ This file contains functions that will check for errors in the error report, and
 from Deadline.Events import *
 from Deadline.Scripting import *
 from scripts.General.u_DeadlineToolbox import u_DeadlineToolbox
+from scripts.General.u_ErrorClassifier import u_ErrorClassifier
 from scripts.General.u_FarmNotificationSystem import u_FarmNotificationSystem
+from scripts.General.u_FarmStateStore import u_FarmStateStore
+from scripts.General.u_JobPatch import u_JobPatch
 import logging
-import os
-import re
 from System.Collections.Specialized import *
 
 
@@ -27,23 +28,81 @@ class OnError(DeadlineEventListener):
 
         self.OnJobErrorCallback += self.OnJobError
         self.worker = ""
+        self.error_classes = frozenset()
+        # The error classes from u_ErrorClassifier that each function handles.
+        # Errors we know don't affect a render, so we override the failure detection.
+        self.failure_detection_errors = ["stale_file_handle",
+                                         "no_such_file",
+                                         "file_exists",
+                                         "errors_generated",
+                                         "max_user_count",
+                                         "sigsegv",
+                                         "no_licenses",
+                                         "moov_atom_not_found"
+                                         ]
+        self.plugin_crash_handling_errors = [
+            # This error happens when a Nuke job is too heavy and causes the session to crash. We should catch this
+            # and lower the number of concurrent tasks to lighten the load on the machine.
+            "sandbox_unresponsive",
+            # exit code 9 relates to a overload of system resources (we saw this with the ghost processes causing
+            # machines to max out RAM). It would be good to also set concurrent tasks to 1 for these heavy jobs
+            "exit_code_9",
+            "out_of_threads"
+        ]
+        # Failed QuickTime jobs fail again on their next error, so they're resumed on every error rather than once per
+        # coalescing window.
+        self.uncoalesced_errors = ["moov_atom_not_found"]
+        # Groups errors of the same class on a job, so during an error storm we only handle them once per window.
+        self.error_coalescer = u_FarmStateStore.ErrorCoalescer()
+        # The farm wide leases, shared with the other error handlers and the crons.
+        self.job_lease_store = u_FarmStateStore.JobLeaseStore()
+        # Remembers the actions we've already performed on a job, across the whole farm, as the errors come from every
+        # worker.
+        self.idempotency_store = u_FarmStateStore.SharedIdempotencyStore()
 
     def Cleanup(self):
         del self.OnJobErrorCallback
 
     def OnJobError(self, job, task, errorReport):
         self.worker = errorReport.ReportSlaveName
+        # Find the known errors in the report once, so each function just checks for the error classes it handles.
+        error_classes = u_ErrorClassifier.classify(errorReport)
 
         # Run the functions to look for the error to handle
+        # The nuke cache is cleared on the worker, so group those errors by worker instead of by job.
+        self.error_classes = self.error_coalescer.filter_error_classes("u_OnJobErrors",
+                                                                       self.worker,
+                                                                       error_classes & {"nuke_cache_dir"}
+                                                                       )
         self.clear_nuke_caches(errorReport)
-        self.override_failure_detection(errorReport, job)
-        self.plugin_crash_handling(errorReport, job)
+        uncoalesced_error_classes = error_classes & set(self.uncoalesced_errors)
+        self.error_classes = self.error_coalescer.filter_error_classes(
+            "u_OnJobErrors",
+            job.JobId,
+            error_classes & set(self.failure_detection_errors + self.plugin_crash_handling_errors)
+            - uncoalesced_error_classes
+        ) | uncoalesced_error_classes
+        # If every error has already been handled in this window, we don't need to take the lease.
+        if not self.error_classes:
+            return
+        # Hold the lease on the job while we check and change it, so other error handlers don't change it at the
+        # same time.
+        with u_FarmStateStore.job_lease(job.JobId, lease_store=self.job_lease_store) as lease_acquired:
+            if lease_acquired:
+                self.override_failure_detection(errorReport, job)
+                self.plugin_crash_handling(errorReport, job)
+            else:
+                # Let the next errors handle it, rather than dropping the rest of the window.
+                self.error_coalescer.release_window("u_OnJobErrors",
+                                                    job.JobId,
+                                                    self.error_classes - uncoalesced_error_classes
+                                                    )
 
     def clear_nuke_caches(self, errorReport):
         """
         Clear Nuke Caches /var/tmp/nuke when the related error occurs
         """
-        if "Error: ERROR: Unable to create cache directory" in errorReport.ReportMessage:
+        if "nuke_cache_dir" in self.error_classes:
             # Send Remote Command to Clear Cache
             # The path for this script is: /Volumes/resources/bin/clearnukecache.sh
             SlaveUtils.SendRemoteCommandWithResults(self.worker, "Execute clearNukeCache.sh -X")
@@ -55,63 +114,33 @@ class OnError(DeadlineEventListener):
         If we know an error doesn't affect a render we can ignore its errors here.
         """
 
-        failure_detection_errors = [".* Stale file handle",
-                                    "Error: FailRenderException : IOError: [Errno .*] No such file or directory:.*",
-                                    "Error: IOError: [Errno .*] File exists: ",
-                                    ".* errors generated",
-                                    ".*Maximum user counted exceeded..*",
-                                    ".*signal caught: SIGSEGV -- Invalid memory reference.*",
-                                    ".*No licenses could be found to run this application..*",
-                                    ".*moov atom not found.*"
-                                    ]
-        # This creates a filepath using the function name as the folder and the job info as the file name.
-        # We use temp files to check and stop actions being performed multiple times.
-        job_failure_detection_file_path = u_DeadlineToolbox.create_temp_txt_file_path(job,
-                                                                                      function_name="failure_detection"
-                                                                                      )
-        # for each error string in the list above use regular expression matching to match the regex error patterns
-        # with the errorReport.ReportMessage string
-        for regex_error_pattern in failure_detection_errors:
-            match_result = re.match(regex_error_pattern, errorReport.ReportMessage)
-            if match_result:
-                # If the failure detection file doesn't exist yet, set no. of errors allowed to infinity and append
-                # the job comment to reflect the change
-                if not os.path.isfile(job_failure_detection_file_path):
-                    # For moov atom not found we want to just resume the failed job as QTs fail after 1 error
-                    if regex_error_pattern == ".*moov atom not found.*":
+        # This key is set in the idempotency store once we've overridden the failure detection on the job. This stops
+        # us repeating the same action.
+        failure_detection_key = u_FarmStateStore.idempotency_key(job.JobId, "failure_detection")
+        # for each error class in the list above, check if it was found in the errorReport.ReportMessage
+        for error_class in self.failure_detection_errors:
+            if error_class in self.error_classes:
+                # For moov atom not found we want to just resume the failed job as QTs fail after 1 error
+                if error_class == "moov_atom_not_found":
+                    if self.idempotency_store.get(failure_detection_key) is None:
                         RepositoryUtils.ResumeFailedJob(job)
-                        break
-                    else:
-                        u_DeadlineToolbox.modify_job(job,
-                                                     override_job_failure_detection=True,
-                                                     override_task_failure_detection=True,
-                                                     append_job_comment="Job and Task failure detection set to 0"
-                                                     )
-
-                        # Now write out the temp failure detection file for this job. This stops the us repeating the
-                        # same action.
-                        with open(job_failure_detection_file_path, "w") as failure_detection_file:
-                            failure_detection_file.write(regex_error_pattern)
-                        # If we've found and remedied the error, break out of the loop.
-                        break
-                # if a file is found do nothing
-                else:
-                    pass
+                # If the key wasn't set yet, set no. of errors allowed to infinity and append the job comment to
+                # reflect the change
+                elif self.idempotency_store.check_and_set(failure_detection_key, value=error_class):
+                    # None of these changes need the job suspending, so in-flight tasks keep rendering.
+                    patch = u_JobPatch.JobPatch(job)
+                    patch.set_field("JobOverrideJobFailureDetection", True)
+                    patch.set_field("JobOverrideTaskFailureDetection", True)
+                    patch.append_comment("Job and Task failure detection set to 0")
+                    patch.apply()
+                # Only the first error found is handled, so break out of the loop.
+                break
 
     def plugin_crash_handling(self, errorReport, job):
         """
         When a specific error occurs which is to do with the heaviness of a job, this function will alter parameters
         of the job to try and get it to run more efficiently.
         """
-        plugin_crash_handling_errors = [
-            # This error happens when a Nuke job is too heavy and causes the session to crash. We should catch this
-            # and lower the number of concurrent tasks to lighten the load on the machine.
-            "The Plugin's Sandbox process is alive but unresponsive.",
-            # exit code 9 relates to a overload of system resources (we saw this with the ghost processes causing
-            # machines to max out RAM). It would be good to also set concurrent tasks to 1 for these heavy jobs
-            "unionLauncher: returning exit code 9",
-            "failed to create thread, out of resources."
-        ]
         # Store the job info before we make any changes.
         prev_job_info = {
             "concurrent": job.JobConcurrentTasks,
@@ -119,9 +148,8 @@ class OnError(DeadlineEventListener):
             "frames per task": job.JobFramesPerTask,
             "priority": job.JobPriority
         }
-        # Set up a path for the timeout error log to be put
-        timeout_error_path = u_DeadlineToolbox.create_temp_txt_file_path(job,
-                                                                         function_name="job_adjustment_error_handling")
+        # This key is set in the idempotency store once we've modified the job, so we only do it once.
+        job_adjustment_key = u_FarmStateStore.idempotency_key(job.JobId, "job_adjustment_error_handling")
         # Set up FNS messages
         job_params_changed_reason = "The job had an error on it which caused the program to " \
                                     "crash. These settings have been changed to help the " \
@@ -131,26 +159,28 @@ class OnError(DeadlineEventListener):
         job_params_changed_prod_suggestion = "This is usually down to poor optimisation or" \
                                              "a buggy script. Please ask your artist to further" \
                                              " optimise their script."
-        if any(error in errorReport.ReportMessage for error in plugin_crash_handling_errors):
+        if any(error_class in self.error_classes for error_class in self.plugin_crash_handling_errors):
             # We dont want to change sims tasks as they need to run as one job.
             if not job.JobGroup == "sims":
                 job_frame_count = u_DeadlineToolbox.get_job_frame_count(job)
                 # for larger jobs, we dont want to adjust the whole job just because one frame bugged.
                 if job_frame_count < 1000:
-                    # if the file doesn't already exist, modify the job
-                    if not os.path.isfile(timeout_error_path):
-                        u_DeadlineToolbox.modify_job(job,
-                                                     set_concurrent_tasks=1,
-                                                     set_frames_per_task=1,
-                                                     override_task_failure_detection=True,
-                                                     override_job_failure_detection=True,
-                                                     )
+                    # if the key isn't already set, modify the job
+                    if self.idempotency_store.check_and_set(job_adjustment_key, value=errorReport.ReportMessage):
+                        # The patch only suspends the job if the concurrent tasks or frames per task actually change.
+                        patch = u_JobPatch.JobPatch(job)
+                        patch.set_field("JobConcurrentTasks", 1)
+                        patch.set_frames_per_task(1)
+                        patch.set_field("JobOverrideTaskFailureDetection", True)
+                        patch.set_field("JobOverrideJobFailureDetection", True)
+                        job_changed = patch.apply()
                         parameters_changed = "Concurrent Tasks {} > 1" \
                                              "\nFrames Per Task {} > 1".format(prev_job_info["concurrent"],
                                                                                prev_job_info["frames per task"]
                                                                                )
-                        # Inform the producers and artist of the change if it is a high prio shot.
-                        fns_needed = u_DeadlineToolbox.farm_notification_system_check(job)
+                        # Inform the producers and artist of the change if it is a high prio shot and we actually
+                        # changed something.
+                        fns_needed = job_changed and u_DeadlineToolbox.farm_notification_system_check(job)
                         if fns_needed:
                             fns = u_FarmNotificationSystem.FarmNotificationSystem(job)
                             fns.on_parameters_changed(job,
@@ -159,5 +189,3 @@ class OnError(DeadlineEventListener):
                                                       job_params_changed_artist_suggestion,
                                                       job_params_changed_prod_suggestion
                                                       )
-                        with open(timeout_error_path, "w") as timeout_error_file:
-                            timeout_error_file.write(errorReport.ReportMessage)
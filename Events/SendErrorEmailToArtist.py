@@ -5,12 +5,12 @@ Copyright Union VFX 2020
 
 """
 
-import os
-import os.path
 from Deadline.Events import *
 from Deadline.Scripting import *
 from System.Collections.Specialized import *
 from scripts.General.u_DeadlineToolbox import u_DeadlineToolbox
+from scripts.General.u_ErrorClassifier import u_ErrorClassifier
+from scripts.General.u_FarmStateStore import u_FarmStateStore
 
 
 def GetDeadlineEventListener():
@@ -26,12 +26,47 @@ class OnError(DeadlineEventListener):
     def __init__(self):
 
         self.OnJobErrorCallback += self.OnJobError
+        # The error classes from u_ErrorClassifier we have a message for.
+        self.artist_error_classes = {"camera_error",
+                                     "geo_error",
+                                     "ifd_error",
+                                     "texture_error",
+                                     "cook_error",
+                                     "hip_error",
+                                     "cg_task_timeout",
+                                     "max_ram_used"
+                                     }
+        # Groups errors of the same class on a job, so during an error storm we only handle them once per window.
+        self.error_coalescer = u_FarmStateStore.ErrorCoalescer()
+        # Remembers the jobs we've already emailed about, across the whole farm, as the errors come from every worker.
+        self.idempotency_store = u_FarmStateStore.SharedIdempotencyStore()
 
     def Cleanup(self):
         del self.OnJobErrorCallback
 
+    def classify(self, job, errorReport):
+        """
+        The u_ErrorClassifier error classes, plus "cg_task_timeout" for a timeout on a CG job. CG timeouts are set
+        per job by u_TaskTimeAggregation, so they can't be told apart by the timeout in the message.
+        """
+        error_classes = u_ErrorClassifier.classify(errorReport)
+        if "task_timeout" in error_classes and (job.JobPlugin in ["Arnold", "Mantra"] or "arnold license limit" in
+                                                u_DeadlineToolbox.get_job_limits_as_list(job)):
+            return error_classes | {"cg_task_timeout"}
+        return error_classes
+
     def OnJobError(self, job, task, errorReport):
 
+        # Only carry on for errors we have a message for, once per job in the coalescing window. This is checked first
+        # so a storm of errors doesn't get the user and tasks from the repository for every error.
+        error_classes = self.error_coalescer.filter_error_classes("u_SendErrorEmailToArtist",
+                                                                  job.JobId,
+                                                                  self.classify(job, errorReport)
+                                                                  & self.artist_error_classes
+                                                                  )
+        if not error_classes:
+            return
+
         # Get username and other info needed
         user = job.JobUserName
         user_info = RepositoryUtils.GetUserInfo(user, True)
@@ -45,8 +80,9 @@ class OnError(DeadlineEventListener):
             if task.TaskId == task_id:
                 task_list.append(task)
 
-        # temp file info. Use these files to verify if an email has already been sent.
-        temp_file_path = u_DeadlineToolbox.create_temp_txt_file_path(job, "farm_emails")
+        # Use this key to verify if an email has already been sent. It's shared with u_SendErrorEmailToWrangler, so only
+        # one email is sent per job.
+        farm_emails_key = u_FarmStateStore.idempotency_key(job.JobId, "farm_emails")
 
         # Email setup
         signature = "\nThank You \n\n" \
@@ -66,53 +102,54 @@ class OnError(DeadlineEventListener):
         def suspend_job():
             RepositoryUtils.SuspendJob(job)
 
-        # The error dict, containing the error string, custom message to send to the artist and the action performed
-        # on the job.
+        # The error dict, containing the error class from u_ErrorClassifier, custom message to send to the artist and the
+        # action performed on the job.
         error_action_dict = {
             "CameraError": {  # Houdini error
-                "error": "Error:       Unable to initialize rendering module with given camera",
+                "error_class": "camera_error",
                 "message": "Can you check your camera selection? make sure to select the deepest "
                            "level of the camera node.",
                 "action": suspend_job
             },
             "GeoError": {  # Houdini error
-                "error": "Error:       Unable to save geometry for",
+                "error_class": "geo_error",
                 "message": "Suggestion: check your frame range or your sources, and retry the task",
                 "action": suspend_task
             },
             "IFDError": {  # Houdini error
-                "error": "mantra: Unable to open IFD file",
+                "error_class": "ifd_error",
                 "message": "Suggestion: check your outputs paths or $JOB settings",
                 "action": suspend_job
             },
             "TextureError": {  # htoa error
-                "error": " [htoa.texture] Error converting texture",
+                "error_class": "texture_error",
                 "message": " Can you disable the option Auto Generate TX Textures under the Arnold Node--->"
                            "Properties--->Textures Tab?",
                 "action": suspend_task
             },
             "CookError": {  # Houdini error
-                "error": "Error:       Cook error in input:",
+                "error_class": "cook_error",
                 "message": "Suggestion: check your sources and caches for the failing frame, and retry the task",
                 "action": suspend_task
             },
             "HipError": {  # Houdini error
-                "error": "Error:       Unexpected end of .hip file",
+                "error_class": "hip_error",
                 "message": "Try to resubmit your scene",
                 "action": suspend_task
             },
-            "3HourTimeout": {  # Timeout error
-                "error": "The Worker did not complete the task before the Regular Task Timeout limit of 00d 03h 00m 00s",
+            "CGTimeout": {  # Timeout error
+                "error_class": "cg_task_timeout",
                 "message": "The priority has been lowered to 10, putting it at the bottom of the render queue."
                            "\n\nIf this is unexpected, please investigate what may be causing your scene to have such"
                            "high frame times."
                            "\nIf it is expected, please let your producer know before submitting a job with frame "
                            "times this high, so the wrangler can adjust settings to not let it timeout. "
-                           "\n\nEvery 3hr timeout could waste as much as 20% of the farm's daily capacity!",
+                           "\n\nEvery timeout wastes the render time the task had used, which for heavy frames "
+                           "can be a large part of the farm's daily capacity!",
                 "action": None  # actions are taken in the u_TimeoutErrorHandling.py script.
             },
             "MaxRAMUsed": { # houdini error
-                "error": "Error: FailRenderException : Process returned non-zero exit code '9'",
+                "error_class": "max_ram_used",
                 "message": "Your job has maxed out the RAM on our machines! This is usually caused by a particularly "
                            "heavy scene."
                            "\n\nSome settings have been automatically adjusted to help it get through, but it may "
@@ -123,10 +160,11 @@ class OnError(DeadlineEventListener):
 
         # Send custom messages and actions for the job to the artist.
         for type_error in error_action_dict:
-            # Check if the error message is in the error report
-            if error_action_dict[type_error]["error"] in errorReport.ReportMessage:
+            # Check if the error was found in the error report
+            if error_action_dict[type_error]["error_class"] in error_classes:
                 # Check that we haven't already emailed this person about this job.
-                if not os.path.exists(temp_file_path) and email != "":
+                # This sets the key if not, and it expires after a day like the old farm_emails temp files did.
+                if email != "" and self.idempotency_store.check_and_set(farm_emails_key, ttl_seconds=86400):
                     #  Find and execute the action associated with that error e.g. suspend job / task.
                     error_action = error_action_dict[type_error]["action"]
                     # if there is an action needed for this task, do it.
@@ -134,10 +172,8 @@ class OnError(DeadlineEventListener):
                         error_action()
                     # put the custom message into the message template from above.
                     message = message_template.replace("solution", error_action_dict[type_error]["message"])
-                    # Send the email and create a temp file, so we don't send another.
+                    # Send the email. The key is already set, so we don't send another.
                     u_DeadlineToolbox.send_email(subject=subject,
                                                  message=message,
                                                  addressee_list=[email]
                                                  )
-                    with open(temp_file_path, 'w'):  # create the temp file
-                        pass
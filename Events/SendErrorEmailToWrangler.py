@@ -6,10 +6,10 @@ Copyright Union VFX 2020
 
 """
 
-import os
 from Deadline.Events import *
 from System.Collections.Specialized import *
 from scripts.General.u_DeadlineToolbox import u_DeadlineToolbox
+from scripts.General.u_FarmStateStore import u_FarmStateStore
 
 
 def GetDeadlineEventListener():
@@ -25,6 +25,10 @@ class OnError(DeadlineEventListener):
     def __init__(self):
 
         self.OnJobErrorCallback += self.OnJobError
+        # Groups all errors on a job, so during an error storm we only check if the email is needed once per window.
+        self.error_coalescer = u_FarmStateStore.ErrorCoalescer()
+        # Remembers the jobs we've already emailed about, across the whole farm, as the errors come from every worker.
+        self.idempotency_store = u_FarmStateStore.SharedIdempotencyStore()
 
     def cleanup(self):
 
@@ -32,28 +36,29 @@ class OnError(DeadlineEventListener):
 
     def OnJobError(self, job, task, errorReport):
 
+        # This emails on any error, so there is no error class to group by.
+        if not self.error_coalescer.should_handle("u_SendErrorEmailToWrangler", job.JobId, "any_error"):
+            return
+
         user = job.JobUserName
         job_name = job.JobName
         error = errorReport.ReportMessage
-        farm_email_path = "/Volumes/resources/pipeline/logs/deadline/farm_emails"
-        # temp file info. Use these files to verify if an email has already been sent.
-        temp_file_path = u_DeadlineToolbox.create_temp_txt_file_path(job, "farm_emails")
+        # Use this key to verify if an email has already been sent. It's shared with u_SendErrorEmailToArtist, so only
+        # one email is sent per job.
+        farm_emails_key = u_FarmStateStore.idempotency_key(job.JobId, "farm_emails")
 
         # setup body of the email
         message = "The job {} \n from {} is erroring:\n \n {} \n Check the farm " \
                   "\n \n This is an automated message, if you need help please contact wrangler@unionvfx.com".format(
             job_name, user.capitalize(), error)
 
-        # Check if there is a temp file already for this job. If not send the email and create the file.
-        if not os.path.exists(temp_file_path):
+        # Check if the key is already set for this job. If not set it and send the email. The key expires after a
+        # day, like the old farm_emails temp files did.
+        if self.idempotency_store.check_and_set(farm_emails_key, ttl_seconds=86400):
             u_DeadlineToolbox.send_email(subject="Check the farm",
                                          message=message,
                                          addressee_list=["wrangler@unionvfx.com"]
                                          )
-            with open(temp_file_path, 'w'):
-                pass
-        # If there is a temp file, don't send the email.
+        # If the key is set, don't send the email.
         else:
             pass
-        # Cleanup the temp files.
-        u_DeadlineToolbox.cleanup_files(path=farm_email_path)
@@ -7,8 +7,8 @@ license issues. (sims have been causing me a headache in regards to this)
 
 When the sim completes, it re-enables the other splits we disabled previously.
 
-IMPORTANT: This needs to run AFTER u_ForceGroup.py, as otherwise the job's group will not be set to sims, which we need
-to check for this script to function
+IMPORTANT: This needs to run AFTER u_SubmissionPipelineTriggers.py, as otherwise the job's group will not be set to
+sims by the force group rule, which we need to check for this script to function
 
 """
 
@@ -80,10 +80,11 @@ class SimsSplitModify(DeadlineEventListener):
             if sim_rendering_on in worker:
                 self.workers_to_modify.append(worker)
         # Modify the associated workers
-        for worker_to_modify in self.workers_to_modify:
-            # Ignore if it is the same worker the sim is running on as this will always be enabled.
-            if not worker_to_modify == self.sim_worker:
-                u_DeadlineToolbox.modify_worker(worker_to_modify, set_worker_state=worker_state)
+        # Ignore if it is the same worker the sim is running on as this will always be enabled.
+        u_DeadlineToolbox.modify_workers([worker_to_modify for worker_to_modify in self.workers_to_modify
+                                          if not worker_to_modify == self.sim_worker],
+                                         set_worker_state=worker_state
+                                         )
 
     # When a sim starts rendering, disable the rest of the splits for that machine.
     def OnJobStarted(self, job):
@@ -1,9 +1,9 @@
 #!/usr/bin/python
 
 """
-This file combines the automatic disabling and re-enabling of the split machine scripts in u_SplitMachineModify.py
-It needs to be run AFTER the u_ForceGroup.py script within deadline. Otherwise the "split_machines" group will not
-have been applied yet for this script to work.
+This file handles the automatic disabling of the split machine scripts in u_SplitMachineModify.py
+The re-enabling on submission is done by u_SubmissionPipeline.split_machine_rule, which runs after the group has been
+set.
 """
 
 from Deadline.Events import *
@@ -24,7 +24,6 @@ class SplitMachineHandling(DeadlineEventListener):
 
     # Set up the event callbacks here
     def __init__(self):
-        self.OnJobSubmittedCallback += self.OnJobSubmitted
         self.OnJobFinishedCallback += self.OnJobFinished
         self.OnJobFailedCallback += self.OnJobFailed
         self.OnJobSuspendedCallback += self.OnJobSuspended
@@ -32,38 +31,12 @@ class SplitMachineHandling(DeadlineEventListener):
         self.OnJobRequeuedCallback += self.OnJobRequeued
 
     def Cleanup(self):
-        del self.OnJobSubmittedCallback
         del self.OnJobFinishedCallback
         del self.OnJobFailedCallback
         del self.OnJobSuspendedCallback
         del self.OnJobDeletedCallback
         del self.OnJobRequeuedCallback
 
-    def OnJobSubmitted(self, job):
-        """
-        This automatically runs u_SplitMachineModify.reset_splits() if a Houdini or Maya job is submitted to the farm
-        and one of the split workers is disabled. This helps with Houdini and Maya jobs as they're light and can run on
-        split machines.
-        """
-        # Set up a variable in case we need to change the split machine group name
-        split_machine_group = "split_machines"
-        # Get the nuke limit to check if the Big Red Button is active
-        current_nuke_limit_group = RepositoryUtils.GetLimitGroup("eu_w_nuke render license limit", True)
-        # This is the DENY list
-        current_nuke_limit_group_workers = current_nuke_limit_group.LimitGroupListedSlaves
-        # Check to see if render27-01 is enabled
-        worker_info = RepositoryUtils.GetSlaveSettings("render27-01", True)
-        worker_status = worker_info.SlaveEnabled
-        # Check to see if one of the epic machines is already in the Nuke limit, if so we dont want to adjust it until
-        # we reset the "big red button" - which stops all CG and allows nuke jobs to render on the epic machines.
-        if "render42" in current_nuke_limit_group_workers:
-            # If a job is submitted with one of these plugins get the worker status of render27-01
-            if job.JobGroup == split_machine_group:
-                # If render27-01 is disabled, run the script to enable the splits and remove them from the
-                # nuke limit
-                if not worker_status:
-                    u_SplitMachineModify.reset_splits()
-
     # Here we are checking for if a job, finishes, fails or is suspended, deleted or requeued...
     # Then checking if we need to run the script.
     def OnJobFinished(self, job):
@@ -0,0 +1,37 @@
+#!/usr/bin/python
+
+"""
+This script runs the u_SubmissionPipeline when a job is submitted to the farm.
+
+It replaces the OnJobSubmitted event plugins u_OnJobSubmission, u_ForceGroup, u_ForcePools, u_ForcePriority,
+u_ForceMachineLimit, u_PriorityUser, u_ShotgridPriority and u_SiteLicenseLimitSetting, which have been removed, and the
+OnJobSubmitted callbacks of u_TimeoutErrorHandling and u_SplitMachineHandling. Every submission rule, including the
+timeouts and the split machine handling, runs from here only, once per job, so this plugin must be enabled.
+
+For more information on how this works see the u_SubmissionPipeline.py docstring
+"""
+
+from Deadline.Events import *
+from scripts.General.u_SubmissionPipeline import u_SubmissionPipeline
+from System.Collections.Specialized import *
+
+
+def GetDeadlineEventListener():
+    return SubmissionPipelineTriggers()
+
+
+def CleanupDeadlineEventListener(eventListener):
+    eventListener.Cleanup()
+
+
+class SubmissionPipelineTriggers(DeadlineEventListener):
+
+    # Set up the event callbacks here
+    def __init__(self):
+        self.OnJobSubmittedCallback += self.OnJobSubmitted
+
+    def Cleanup(self):
+        del self.OnJobSubmittedCallback
+
+    def OnJobSubmitted(self, job):
+        u_SubmissionPipeline.SubmissionPipeline().run(job)
@@ -0,0 +1,332 @@
+#!/usr/bin/python
+
+"""
+This script keeps the running totals of the jobs' task render times in the u_FarmStateStore TaskTimeStore, for the
+render planner (ExportCGToCSV) to read instead of getting every task of every job.
+
+It runs on house cleaning, which happens on the pulse, where the render planner runs too, as the store is local to each
+machine. Only the jobs whose completed task count has changed since they were last recorded have their tasks read, and
+at most every 10 minutes per job, so the cost depends on how much has rendered rather than how many tasks are on the
+farm. Jobs that have left the active and pending states get a final update, then are no longer checked.
+
+From those totals it estimates when each active job will finish, and writes it into the job's JobExtraInfo8 so
+producers can see it in the Monitor, e.g. "ETA: 2024-03-01 03:40". The jobs are saved in one batch, and only when
+their ETA has moved by more than 15 minutes or 10% of the time left. Each job is fetched again under its lease just
+before it's saved, and only the fields that still differ are changed, so the save can't undo a change the error
+handlers made since the house cleaning started (e.g. the timeout and priority from u_TimeoutErrorHandling).
+
+The frame times of the tasks are also counted in u_TaskDurationSketch quantile sketches per job, batch and plugin /
+show, and each job with a task timeout has it set to a multiple of its p95 frame time x its frames per task (see
+u_TaskDurationSketch), so re-chunking a job doesn't throw its timeout off, instead of
+the fixed timeouts set on submission. Only a timeout that's still the one u_SubmissionPipeline.timeouts_rule set from
+the u_TimeoutErrorHandling config, or the one we set last time, is changed. So jobs with no timeout (0), a timeout
+removed by the u_TimeoutErrorHandling event, or one a wrangler set by hand are left alone. The timeout we set is kept in
+the job's AdaptiveTaskTimeoutSeconds extra info key, and a job whose timeout no longer matches it was changed by hand,
+so it's left alone from then on. A CG timeout lowers the job's priority and moves it to 251gb for the night (see
+u_TimeoutErrorHandling), so CG jobs never get less than the "Arnold and Mantra Timeout" in that event's config.
+
+Jobs that haven't started rendering have their frames per task set by the u_ChunkingAdvisor, from the application
+startup overhead and frame time measured for their plugin and show. Each job is only re-chunked once, so it doesn't
+undo the frames per task the error handlers or a wrangler set later.
+
+Once a day it also retrains the u_FrameTimeEstimator model from the recorded jobs, and once an hour it deletes the
+expired keys of the u_FarmStateStore SharedIdempotencyStore, so the error handlers don't have to.
+"""
+
+import time
+from datetime import datetime, timedelta
+from Deadline.Events import *
+from Deadline.Scripting import *
+from scripts.General.u_ChunkingAdvisor import u_ChunkingAdvisor
+from scripts.General.u_DeadlineToolbox import u_DeadlineToolbox
+from scripts.General.u_FarmStateStore import u_FarmStateStore
+from scripts.General.u_FrameTimeEstimator import u_FrameTimeEstimator
+from scripts.General.u_JobPatch import u_JobPatch
+from scripts.General.u_TaskDurationSketch import u_TaskDurationSketch
+
+
+def GetDeadlineEventListener():
+    return TaskTimeAggregation()
+
+
+def CleanupDeadlineEventListener(eventListener):
+    eventListener.Cleanup()
+
+
+# How often the frame time model is retrained.
+model_retrain_seconds = 86400
+# The least time between reading the tasks of a job that's still rendering.
+min_job_update_seconds = 600
+
+# The job extra info the ETA is written to (JobExtraInfo9 is used by the Farm Notification System).
+eta_field = "JobExtraInfo8"
+eta_format = "ETA: %Y-%m-%d %H:%M"
+not_rendering_eta = "ETA: not rendering"
+# An ETA is only rewritten if it moves by more than this many minutes, or this fraction of the time left.
+eta_tolerance_minutes = 15
+eta_tolerance_fraction = 0.1
+# A timeout is only rewritten if it moves by more than this fraction.
+timeout_tolerance_fraction = 0.1
+# These keep their fixed timeouts: PDG monitor tasks time themselves out, and [Client] Nuke jobs are kept short.
+fixed_timeout_plugins = ["PDGDeadline"]
+fixed_timeout_batch_tag = "[Client]"
+# The job extra info key the timeout we set is kept in.
+adaptive_timeout_key = "AdaptiveTaskTimeoutSeconds"
+# The jobs u_TimeoutErrorHandling treats as CG, and the config entry of their submission timeout.
+cg_renderers = ["Arnold", "Mantra"]
+cg_limit_group = "arnold license limit"
+cg_timeout_config_entry = "Arnold and Mantra Timeout"
+# The u_TimeoutErrorHandling config entries of the other submission timeouts, and their defaults in minutes, as set by
+# u_SubmissionPipeline.timeouts_rule.
+plugin_timeout_config_entries = {"Nuke": "Nuke Timeout",
+                                 "Houdini": "Maya and Houdini Timeout",
+                                 "MayaCmd": "Maya and Houdini Timeout"
+                                 }
+default_timeout_minutes = {"Nuke Timeout": 15, "Maya and Houdini Timeout": 10, cg_timeout_config_entry: 180}
+
+
+def estimate_job_eta(job, job_task_times, frame_time_estimator, now):
+    """
+    Estimate when a job will finish from its average task time, the tasks it has left and how many of its tasks are
+    rendering at the moment (JobRenderingTasks). The task time is its average frame time x its current frames per
+    task, so a job that's been re-chunked since its tasks rendered, or that's chunked differently to the jobs the
+    estimate comes from, still gets the right task time.
+
+    Args:
+        job: The Deadline job.
+        job_task_times: dict: The job's TaskTimeStore row, or None if it hasn't been recorded.
+        frame_time_estimator: u_FrameTimeEstimator.FrameTimeEstimator: For jobs with no completed tasks yet.
+        now: datetime: The time to estimate from.
+    Returns:
+        The datetime the job should finish, not_rendering_eta if nothing is rendering it, or None if we can't tell.
+    """
+    remaining_tasks = job.JobTaskCount - job.JobCompletedTasks
+    if remaining_tasks <= 0:
+        return None
+    if job_task_times is not None and job_task_times["timed_tasks"]:
+        task_seconds = u_FrameTimeEstimator.record_frame_minutes(job_task_times) * 60 * job.JobFramesPerTask
+    else:
+        task_seconds = frame_time_estimator.estimate_task(job.JobPlugin,
+                                                          frames_per_task=job.JobFramesPerTask,
+                                                          show=job.JobPool,
+                                                          group=job.JobGroup,
+                                                          batch_name=job.JobBatchName
+                                                          ).minutes * 60
+    if not task_seconds:
+        return None
+    if not job.JobRenderingTasks:
+        return not_rendering_eta
+    return now + timedelta(seconds=remaining_tasks * task_seconds / job.JobRenderingTasks)
+
+
+def eta_moved(current_value, eta, now):
+    """
+    Returns True if the new ETA is different enough from the one written on the job to be worth saving.
+    """
+    if eta == not_rendering_eta or current_value == not_rendering_eta:
+        return current_value != eta
+    try:
+        current_eta = datetime.strptime(current_value, eta_format)
+    except (TypeError, ValueError):
+        return True
+    tolerance_minutes = max(eta_tolerance_minutes, eta_tolerance_fraction * (eta - now).total_seconds() / 60.0)
+    return abs((eta - current_eta).total_seconds()) / 60.0 > tolerance_minutes
+
+
+def is_cg_job(job):
+    return job.JobPlugin in cg_renderers or cg_limit_group in job.JobLimitGroups
+
+
+def get_submission_timeouts():
+    """
+    Returns the submission timeouts set in the u_TimeoutErrorHandling config.
+
+    Returns:
+        dict: {config entry: timeout in seconds}
+    """
+    config = RepositoryUtils.GetEventPluginConfig("u_TimeoutErrorHandling")
+    return dict((entry, int(config.GetConfigEntryWithDefault(entry, str(minutes))) * 60)
+                for entry, minutes in default_timeout_minutes.items())
+
+
+def submission_timeout_entry(job):
+    """
+    Returns the u_TimeoutErrorHandling config entry the job's timeout was set from on submission, or None.
+    """
+    if is_cg_job(job):
+        return cg_timeout_config_entry
+    return plugin_timeout_config_entries.get(job.JobPlugin)
+
+
+def adaptive_timeout_seconds(job, sketches, submission_timeouts):
+    """
+    Returns the task timeout the job should have from its task time sketches, or None to leave it as it is.
+
+    Args:
+        job: The Deadline job.
+        sketches: dict: {sketch key: TaskDurationSketch}.
+        submission_timeouts: dict: {config entry: timeout in seconds}, from get_submission_timeouts(). The CG one is
+            also the shortest timeout we give a CG job.
+    """
+    if not job.JobTaskTimeoutSeconds or job.JobPlugin in fixed_timeout_plugins \
+            or fixed_timeout_batch_tag in job.JobBatchName:
+        return None
+    # Only change a timeout that's still the one we set last time, or the one from submission.
+    previous_timeout_seconds = job.GetJobExtraInfoKeyValue(adaptive_timeout_key)
+    if previous_timeout_seconds:
+        if previous_timeout_seconds != str(job.JobTaskTimeoutSeconds):
+            return None
+    elif job.JobTaskTimeoutSeconds != submission_timeouts.get(submission_timeout_entry(job)):
+        return None
+    keys = u_TaskDurationSketch.sketch_keys(job.JobId, job.JobPlugin, job.JobPool, job.JobBatchName)
+    timeout = u_TaskDurationSketch.adaptive_timeout_minutes([sketches.get(key) for key in keys],
+                                                            frames_per_task=job.JobFramesPerTask)
+    if timeout is None:
+        return None
+    timeout_seconds = timeout[0] * 60
+    if is_cg_job(job):
+        timeout_seconds = max(timeout_seconds, submission_timeouts[cg_timeout_config_entry])
+    if abs(timeout_seconds - job.JobTaskTimeoutSeconds) <= timeout_tolerance_fraction * job.JobTaskTimeoutSeconds:
+        return None
+    return timeout_seconds
+
+
+def chunking_key(job_id):
+    return u_FarmStateStore.idempotency_key(job_id, "chunking")
+
+
+def record_job(task_time_store, job, finished=False, sketch_store=None):
+    """
+    Read a job's completed tasks and record the totals of their render times, and add the new ones to its sketches.
+    """
+    # (render seconds, frames) for each completed task.
+    task_render_times = []
+    for task in RepositoryUtils.GetJobTasks(job, True).TaskCollectionTasks:
+        if task.TaskStatus == "Completed":
+            task_render_time_in_secs = int(task.TaskRenderTime.TotalSeconds)
+            if task_render_time_in_secs != 0:
+                task_render_times.append((task_render_time_in_secs, len(task.TaskFrameList)))
+    render_times = [render_seconds for render_seconds, frames in task_render_times]
+    task_time_store.record_job(job.JobId,
+                               job.JobBatchName,
+                               job.JobName,
+                               job.JobPlugin,
+                               job.JobGroup,
+                               job.JobCompletedTasks,
+                               render_times,
+                               finished=finished,
+                               pool=job.JobPool,
+                               timed_frames=sum(frames for render_seconds, frames in task_render_times)
+                               )
+    if sketch_store is not None:
+        u_TaskDurationSketch.record_job_sketch(sketch_store, job.JobId, job.JobPlugin, job.JobPool, job.JobBatchName,
+                                               task_render_times)
+
+
+class TaskTimeAggregation(DeadlineEventListener):
+
+    # Set up the event callbacks here
+    def __init__(self):
+        self.OnHouseCleaningCallback += self.OnHouseCleaning
+        self.task_time_store = u_FarmStateStore.TaskTimeStore()
+        self.job_lease_store = u_FarmStateStore.JobLeaseStore()
+        self.sketch_store = u_FarmStateStore.TaskDurationSketchStore()
+        # Remembers the jobs we've already re-chunked.
+        self.idempotency_store = u_FarmStateStore.IdempotencyStore()
+        # The farm wide keys the error handlers set, which are purged from here.
+        self.shared_idempotency_store = u_FarmStateStore.SharedIdempotencyStore()
+
+    def Cleanup(self):
+        del self.OnHouseCleaningCallback
+
+    def OnHouseCleaning(self):
+        start_time = time.time()
+        # {job ID: (completed tasks when last recorded, when it was recorded)}
+        recorded_jobs = self.task_time_store.get_completed_tasks()
+        current_jobs = RepositoryUtils.GetJobsInState(["Active", "Pending"])
+        current_job_ids = set()
+        updated_count = 0
+        for job in current_jobs:
+            current_job_ids.add(job.JobId)
+            recorded_job = recorded_jobs.get(job.JobId)
+            if recorded_job is None or (recorded_job[0] != job.JobCompletedTasks
+                                        and start_time - recorded_job[1] >= min_job_update_seconds):
+                record_job(self.task_time_store, job, sketch_store=self.sketch_store)
+                updated_count += 1
+
+        # Give the jobs that have finished (or been suspended, failed or deleted) a last update.
+        left_job_ids = [job_id for job_id in recorded_jobs if job_id not in current_job_ids]
+        for job_id in left_job_ids:
+            job = RepositoryUtils.GetJob(job_id, True)
+            if job is not None and job.JobCompletedTasks != recorded_jobs[job_id][0]:
+                record_job(self.task_time_store, job, finished=True, sketch_store=self.sketch_store)
+        self.task_time_store.mark_finished(left_job_ids)
+        # Their tasks stay counted in their batch and plugin / show sketches.
+        self.sketch_store.delete_sketches([u_TaskDurationSketch.job_sketch_key(job_id) for job_id in left_job_ids])
+        purged_count = self.task_time_store.purge_finished_jobs()
+        self.sketch_store.purge_sketches()
+        self.shared_idempotency_store.maybe_purge_expired_keys()
+
+        print("# Updated the task times of {} of {} jobs, finished {} and purged {} in {:.3f} seconds.".format(
+            updated_count,
+            len(current_job_ids),
+            len(left_job_ids),
+            purged_count,
+            time.time() - start_time
+        ))
+
+        self.update_jobs(current_jobs)
+
+        model_age_seconds = u_FrameTimeEstimator.model_age_seconds()
+        if model_age_seconds is None or model_age_seconds > model_retrain_seconds:
+            records = list(self.task_time_store.get_jobs().values())
+            # Score the new model on the most recent jobs before it's used.
+            u_FrameTimeEstimator.backtest(records)
+            u_FrameTimeEstimator.FrameTimeEstimator.train(records).save()
+            print("# Retrained the frame time model from {} jobs.".format(len(records)))
+
+    def update_jobs(self, jobs):
+        """
+        Write the ETA of each active job into its job extra info, set its adaptive task timeout, and chunk it if it
+        hasn't started rendering, saving only the jobs where something has changed.
+        """
+        now = datetime.now()
+        all_job_task_times = self.task_time_store.get_jobs()
+        frame_time_estimator = u_FrameTimeEstimator.FrameTimeEstimator.load()
+        sketches = dict((sketch_key, u_TaskDurationSketch.TaskDurationSketch.from_json(sketch))
+                        for sketch_key, sketch in self.sketch_store.get_sketches().items())
+        chunking_model = u_ChunkingAdvisor.ChunkingModel.train(all_job_task_times.values())
+        inventory = u_DeadlineToolbox.worker_inventory
+        inventory.refresh_if_stale()
+        submission_timeouts = get_submission_timeouts()
+        # desired_state is also called from the bulk_patch_jobs threads, and the local database connection can only be
+        # used from this one, so the jobs we've already re-chunked are read up front.
+        chunked_job_ids = set(job.JobId for job in jobs
+                              if self.idempotency_store.get(chunking_key(job.JobId)) is not None)
+
+        def desired_state(job):
+            if job.JobStatus != "Active":
+                return None
+            fields = {}
+            eta = estimate_job_eta(job, all_job_task_times.get(job.JobId), frame_time_estimator, now)
+            if eta is not None and eta_moved(getattr(job, eta_field), eta, now):
+                fields[eta_field] = eta if eta == not_rendering_eta else eta.strftime(eta_format)
+            timeout_seconds = adaptive_timeout_seconds(job, sketches, submission_timeouts)
+            if timeout_seconds is not None:
+                fields["JobTaskTimeoutSeconds"] = timeout_seconds
+                fields["JobExtraInfoKeyValues"] = {adaptive_timeout_key: str(timeout_seconds)}
+            machines = len(inventory.get_workers_in_group(job.JobGroup))
+            if job.JobMachineLimit:
+                machines = min(machines, job.JobMachineLimit)
+            frames_per_task = u_ChunkingAdvisor.advise_frames_per_task(job, chunking_model, machines)
+            if frames_per_task is not None and frames_per_task != job.JobFramesPerTask \
+                    and job.JobId not in chunked_job_ids:
+                fields["JobFramesPerTask"] = frames_per_task
+            return fields or None
+
+        report = u_JobPatch.bulk_patch_jobs(jobs, desired_state, lease_store=self.job_lease_store)
+        # Only remember the jobs we've re-chunked once the new frames per task is saved, so a failed write is retried.
+        for job_id, fields in report.written_fields.items():
+            if "JobFramesPerTask" in fields:
+                print("# Chunked job '{}' to {} frames per task.".format(job_id, fields["JobFramesPerTask"]))
+                self.idempotency_store.check_and_set(chunking_key(job_id), value=str(fields["JobFramesPerTask"]))
@@ -1,15 +1,17 @@
 #! /usr/bin/python
 """
 This Event occurs when a job times out due to hitting the timeouts we've set
-These timeout values are set in the OnJobSubmitted function and in the Deadline UI
+These timeout values are set on submission by u_SubmissionPipeline.timeouts_rule, using the values in this plugin's
+config in the Deadline UI
 
 When a timeout occurs this also handles what actions we take.
 """
 from Deadline.Events import *
 from Deadline.Scripting import *
 from scripts.General.u_DeadlineToolbox import u_DeadlineToolbox
+from scripts.General.u_ErrorClassifier import u_ErrorClassifier
 from scripts.General.u_FarmNotificationSystem import u_FarmNotificationSystem
-import os
+from scripts.General.u_FarmStateStore import u_FarmStateStore
 from System.Collections.Specialized import *
 
 
@@ -25,13 +27,10 @@ class TimeoutErrorHandling(DeadlineEventListener):
 
     def __init__(self):
 
-        self.OnJobSubmittedCallback += self.OnJobSubmitted
         self.OnJobErrorCallback += self.OnJobError
 
         # CG renderers are determined from the jobs plugin.
         self.cg_renderers = ["Arnold", "Mantra"]
-        # IFD/.ass gen jobs are determined from the job's plugin.
-        self.ass_ifd_gens = ["Houdini", "MayaCmd"]
         # This is a list of job plugins which are not CG renderers for timeouts we still want to set.
         self.non_cg_renderer_plugin_list = ["MayaCmd", "Houdini", "Nuke"]
         # This list will be populated when the job's limits are determined. This is then used when determining if
@@ -42,83 +41,34 @@ class TimeoutErrorHandling(DeadlineEventListener):
         self.job_params_changed_reason = ""
         self.job_params_changed_artist_suggestion = ""
         self.job_params_changed_prod_suggestion = ""
+        # Groups timeouts on a job, so during an error storm we only handle them once per window.
+        self.error_coalescer = u_FarmStateStore.ErrorCoalescer()
+        # The farm wide leases, shared with the other error handlers and the crons.
+        self.job_lease_store = u_FarmStateStore.JobLeaseStore()
+        # Remembers the jobs we've already modified, across the whole farm, as the errors come from every worker.
+        self.idempotency_store = u_FarmStateStore.SharedIdempotencyStore()
 
     def Cleanup(self):
 
-        del self.OnJobSubmittedCallback
         del self.OnJobErrorCallback
 
-    def OnJobSubmitted(self, job):
-        # Get the limit groups of a job, this helps with u_render commandline arnold jobs
-        self.limit_groups = u_DeadlineToolbox.get_job_limits_as_list(job)
-        self.set_timeouts(job)
-
     def OnJobError(self, job, task, errorReport):
+        # Only handle the first timeout on a job in the coalescing window, the rest are counted and skipped before
+        # they queue up on the lease.
+        if "task_timeout" not in u_ErrorClassifier.classify(errorReport):
+            return
+        if not self.error_coalescer.should_handle("u_TimeoutErrorHandling", job.JobId, "task_timeout"):
+            return
         # Get the limit groups of a job, this helps with u_render commandline arnold jobs
         self.limit_groups = u_DeadlineToolbox.get_job_limits_as_list(job)
-        self.timeout_error_handling(errorReport, job)
-
-    def set_timeouts(self, job):
-        """
-        1. Set [Client] Nuke jobs to have a max task time of 3 minutes. This is because they can get stuck and never
-        should take longer than 3 minutes. When it reaches 3 minutes, it will error and requeue.
-        2. Set regular Nuke jobs to have a max task time of 15 minutes. Upon which it will error and change frames per
-        task and concurrent tasks to 1 as well as limit it to max 4 machines in the timeout_error_handling function.
-        Only set these during work hours, as outside of work hours they should have priority and be unrestricted
-        3. Set CG jobs to have a max task time out 3 hours. When that timeout occurs, it will be picked up in the
-        timeout_error_handling function and handled in there.
-        4. Set Houdini (not sims) and Maya jobs to have a timeout of 10 minutes, then set concurrent tasks to 1
-        """
-
-        # Set a default max time, 0 = infinity
-        timeout_in_mins = 0
-        # Get Config Entry values set in deadline UI to use in the script
-        nuke_timeout = int(self.GetConfigEntry("Nuke Timeout"))
-        maya_and_houdini_timeout = int(self.GetConfigEntry("Maya and Houdini Timeout"))
-        arnold_and_mantra_timeout = int(self.GetConfigEntry("Arnold and Mantra Timeout"))
-
-        # Check if a manual timeout value hasn't already been set and it's not a test job.
-        if job.JobTaskTimeoutSeconds == 0 and "render_testing" not in job.JobPool:
-            office_hours = u_DeadlineToolbox.office_hours()
-            # Set the timeouts
-            # Only set the timeouts for nuke and ifd/ass gens during work hours
-            if office_hours:
-                # Set Nuke timeouts to the default value in the Deadline UI, unless its a Client job
-                if job.JobPlugin == "Nuke":
-                    if "[Client]" in job.JobBatchName:
-                        timeout_in_mins = 3
-                    else:
-                        timeout_in_mins = nuke_timeout
-
-                # Set Houdini/Maya timeouts to the UI value, unless it's a sim / test (single task).
-                elif job.JobPlugin in self.ass_ifd_gens:
-                    if job.JobTaskCount == 1:
-                        timeout_in_mins = 0
-                    else:
-                        timeout_in_mins = maya_and_houdini_timeout
-
-            # CG timeouts are not office hours dependent.
-            if job.JobPlugin in self.cg_renderers or "arnold license limit" in self.limit_groups:
-                # only change the timeout for tasks that aren't tests (single task count)
-                if job.JobTaskCount == 1:
-                    timeout_in_mins = 0
-                else:
-                    timeout_in_mins = arnold_and_mantra_timeout
-
-            # Set PDG monitor tasks to time themselves out at 1 hour
-            if job.JobPlugin == "PDGDeadline" and "pdg_mq" in job.JobLimitGroups:
-                timeout_in_mins = 60
-        # Set the timeout.
-        u_DeadlineToolbox.set_job_timeout(job, timeout_in_minutes=timeout_in_mins)
-
-        # Set up a minimum task time for a render to be considered successful. This stops false "completed" renders.
-        # Exclude cmd and PDG jobs as these can have all sorts of different times for different reasons. e.g. a
-        # small copy job script that runs as part of a batch
-        excluded_plugin_list = ["CommandLine", "PDGDeadline"]
-        if job.JobMinRenderTimeSeconds == 0:
-            if job.JobPlugin not in excluded_plugin_list:
-                job.JobMinRenderTimeSeconds = 2
-                RepositoryUtils.SaveJob(job)
+        # Hold the lease on the job while we check and change it, so other error handlers don't change it at the
+        # same time.
+        with u_FarmStateStore.job_lease(job.JobId, lease_store=self.job_lease_store) as lease_acquired:
+            if lease_acquired:
+                self.timeout_error_handling(errorReport, job)
+            else:
+                # Let the next timeout handle it, rather than dropping the rest of the window.
+                self.error_coalescer.release_window("u_TimeoutErrorHandling", job.JobId, ["task_timeout"])
 
     def timeout_error_handling(self, errorReport, job):
         """
@@ -127,8 +77,6 @@ class TimeoutErrorHandling(DeadlineEventListener):
             errorReport:
             job:
         """
-        timeout_errors = ["The Worker did not complete the task before the Regular Task Timeout limit"]
-
         # Get Config Entry values set in deadline UI to use in the script
         nuke_concurrent_tasks = int(self.GetConfigEntry("Nuke Concurrent Tasks"))
         nuke_frames_per_task = int(self.GetConfigEntry("Nuke Frames Per Task"))
@@ -145,8 +93,10 @@ class TimeoutErrorHandling(DeadlineEventListener):
             nuke_machine_limit = ui_nuke_machine_limit
 
         # ----------------------------------- Timeout Error Strings ----------------------------------------------------
-        cg_timeout_reason = "the task reached our set timeout limit of 3 hours. " \
-                            "We do this to ensure jobs don't get stuck behind unexpectedly heavy ones."
+        # The CG timeout can be raised above the config one by u_TaskTimeAggregation, so it's read from the job.
+        cg_timeout_reason = "the task reached our set timeout limit of {} minutes, well beyond how long this " \
+                            "job's tasks usually take. We do this to ensure jobs don't get stuck behind unexpectedly " \
+                            "heavy ones.".format(job.JobTaskTimeoutSeconds // 60)
         cg_timeout_prod_suggestion = "\n\nIf this was expected, please make sure to notify the wrangler using the" \
                                      " Render Planner for the next submission, so we can remove this timeout and " \
                                      "prevent wasted render time."\
@@ -156,7 +106,7 @@ class TimeoutErrorHandling(DeadlineEventListener):
                                        "remove this timeout and prevent wasted render time." \
                                        "\n\nIf this was unexpected, please optimise your job."
         non_cg_timeout_reason = "The job's tasks reached {} minutes. These settings have been changed to help the job" \
-                                " get through faster.".format(job.JobTaskTimeoutSeconds / 60)
+                                " get through faster.".format(job.JobTaskTimeoutSeconds // 60)
         non_cg_artist_suggestion = "\n\nIf this is unexpected, please try to optimise your script."
         non_cg_prod_suggestion = "\n\nIf this is unexpected, please ask your artist to optimise their script."
         # Get job dependencies
@@ -169,7 +119,7 @@ class TimeoutErrorHandling(DeadlineEventListener):
             "priority": job.JobPriority
         }
         # Check for timeout error in the error report.
-        if any(timeout_error in errorReport.ReportMessage for timeout_error in timeout_errors):
+        if "task_timeout" in u_ErrorClassifier.classify(errorReport):
             # ------------------------ CG timeout handling -----------------------------------------------------------
             if job.JobPlugin in self.cg_renderers or "arnold license limit" in self.limit_groups:
                 # This is a CG job, so set the FNS strings to be the CG ones.
@@ -195,9 +145,9 @@ class TimeoutErrorHandling(DeadlineEventListener):
                 self.job_params_changed_reason = non_cg_timeout_reason
                 self.job_params_changed_prod_suggestion = non_cg_prod_suggestion
                 self.job_params_changed_artist_suggestion = non_cg_artist_suggestion
-                # Make sure we haven't already modified the job.
-                timeout_error_path = u_DeadlineToolbox.create_temp_txt_file_path(job, "timeouts")
-                if not os.path.isfile(timeout_error_path):
+                # Make sure we haven't already modified the job. This sets the key in the idempotency store if not.
+                timeouts_key = u_FarmStateStore.idempotency_key(job.JobId, "timeouts")
+                if self.idempotency_store.check_and_set(timeouts_key, value=errorReport.ReportMessage):
                     office_hours = u_DeadlineToolbox.office_hours()
                     # -----------------------SET THE BEHAVIOUR FOR NUKE JOBS-----------------------------------
                     if job.JobPlugin == "Nuke" and "[Client]" not in job.JobBatchName:
@@ -206,12 +156,12 @@ class TimeoutErrorHandling(DeadlineEventListener):
                             # If the frames per task is already 1, don't set the frames per task to any other number,
                             # as if its hit the timeout with 1 frame per task, we'd never want to increase it.
                             if job.JobFramesPerTask == 1:
-                                # we re-set the prio to the value of the original prio as sometimes it would set to 50.
+                                # modify_job goes through a JobPatch, so values the job already has are skipped and
+                                # the job is only suspended if the concurrent tasks actually change.
                                 u_DeadlineToolbox.modify_job(job,
                                                              set_timeout_to_0=True,
                                                              set_concurrent_tasks=1,
-                                                             set_machine_limit=nuke_machine_limit,
-                                                             set_priority=job.JobPriority
+                                                             set_machine_limit=nuke_machine_limit
                                                              )
                                 # For use if FNS needed.
                                 self.parameters_changed = "Concurrent Tasks {} > {}" \
@@ -224,8 +174,7 @@ class TimeoutErrorHandling(DeadlineEventListener):
                                                              set_timeout_to_0=True,
                                                              set_concurrent_tasks=nuke_concurrent_tasks,
                                                              set_frames_per_task=nuke_frames_per_task,
-                                                             set_machine_limit=nuke_machine_limit,
-                                                             set_priority=job.JobPriority
+                                                             set_machine_limit=nuke_machine_limit
                                                              )
                                 self.parameters_changed = "Concurrent Tasks {} > {}" \
                                                           "\nMachine Limit {} > {}" \
@@ -242,8 +191,7 @@ class TimeoutErrorHandling(DeadlineEventListener):
                             u_DeadlineToolbox.modify_job(job,
                                                          set_timeout_to_0=True,
                                                          set_concurrent_tasks=1,
-                                                         set_frames_per_task=1,
-                                                         set_priority=job.JobPriority
+                                                         set_frames_per_task=1
                                                          )
                             self.parameters_changed = "Concurrent Tasks {} > {}" \
                                                       "\nFrames Per Task {} > {}".format(prev_job_info["concurrent"], 1,
@@ -257,8 +205,7 @@ class TimeoutErrorHandling(DeadlineEventListener):
                                 # For high prio jobs we don't want to lower the prio or change the machine limit.
                                 u_DeadlineToolbox.modify_job(job,
                                                              set_timeout_to_0=True,
-                                                             set_concurrent_tasks=maya_houdini_concurrent_tasks,
-                                                             set_priority=job.JobPriority
+                                                             set_concurrent_tasks=maya_houdini_concurrent_tasks
                                                              )
                                 self.parameters_changed = "Concurrent Tasks {} > {}".format(prev_job_info["concurrent"],
                                                                                             maya_houdini_concurrent_tasks
@@ -274,8 +221,7 @@ class TimeoutErrorHandling(DeadlineEventListener):
                         else:
                             u_DeadlineToolbox.modify_job(job,
                                                          set_timeout_to_0=True,
-                                                         set_concurrent_tasks=1,
-                                                         set_priority=job.JobPriority
+                                                         set_concurrent_tasks=1
                                                          )
                             self.parameters_changed = "Concurrent Tasks {} > {}".format(prev_job_info["concurrent"], 1)
                         # If the houdini job has dependencies we don't want to just resume the job, otherwise
@@ -283,11 +229,7 @@ class TimeoutErrorHandling(DeadlineEventListener):
                         if job.JobPlugin == "Houdini":
                             if job_dependencies:
                                 RepositoryUtils.PendJob(job)
-
-                    # Write the file to avoid repeated job modifying.
-                    with open(timeout_error_path, "w") as timeout_error_file:
-                        timeout_error_file.write(errorReport.ReportMessage)
-                # If a file is found do nothing.
+                # If the key was already set do nothing.
                 else:
                     pass
             # If it's a plugin we aren't expecting, pass.
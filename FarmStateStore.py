@@ -0,0 +1,1015 @@
+#! /usr/bin/python
+"""
+
+Farm State Store:
+
+Contains a small local SQLite database for state that event sandboxes and crons running on the same machine need to
+share, e.g. the task time totals and caches the pulse keeps, and the shared marker files for state the whole farm needs
+to agree on, e.g. leases on the jobs being modified, or which actions have already been performed on a job.
+For use in deadline scripting
+
+The database lives on local disk, not on /Volumes, so checking it doesn't cost any NFS round trips. The location can
+be changed with the U_FARM_STATE_DIR environment variable, or by passing state_dir, which is also handy for testing.
+
+OnJobError events run on whichever worker reported the error, so anything that has to happen once per job is kept in
+marker files on /Volumes instead, like the old temp txt files. They're created with O_EXCL, which is atomic over NFS,
+so only one machine can ever create a marker, and they hold when they expire. The location can be changed with the
+U_SHARED_FARM_STATE_DIR environment variable. The machines' clocks are kept in sync, so their expiry times agree.
+
+"""
+
+import errno
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Default folder for the state databases. This is local to each machine.
+default_state_dir = os.environ.get("U_FARM_STATE_DIR",
+                                   os.path.join(os.sep, "var", "tmp", "deadline_farm_state")
+                                   )
+# How long errors of the same class on the same job are grouped together for, before they're handled again.
+default_coalesce_window_seconds = int(os.environ.get("U_ERROR_COALESCE_SECONDS", 60))
+# How long we remember an action has been performed on a job for. Jobs are rarely on the farm for longer than this.
+default_idempotency_ttl_seconds = 30 * 86400
+# Default folder for the shared marker files. This is on NFS, so every machine on the farm sees the same markers.
+default_shared_state_dir = os.environ.get("U_SHARED_FARM_STATE_DIR",
+                                          os.path.join(os.sep, "Volumes", "resources", "pipeline", "logs", "deadline",
+                                                       "farm_state")
+                                          )
+# A marker that can't be read is being written, unless it's older than this.
+unreadable_marker_seconds = 60
+
+
+def connect(db_name="farm_state", state_dir=None):
+    """
+    Returns a connection to one of the local state databases, creating it if needed.
+
+    The connection is in autocommit mode, so callers manage their own transactions with "BEGIN IMMEDIATE". WAL mode
+    lets readers carry on while another process is writing.
+
+    Args:
+        db_name: string: The name of the database file, without the extension.
+        state_dir: string: Option to use a different folder to the default one.
+    Returns:
+        connection: sqlite3.Connection
+    """
+    state_dir = state_dir or default_state_dir
+    # if the directory doesn't exist i.e. it's a new machine, create the dir.
+    if not os.path.isdir(state_dir):
+        os.makedirs(state_dir)
+
+    connection = sqlite3.connect(os.path.join(state_dir, "{}.sqlite".format(db_name)),
+                                 timeout=30,
+                                 isolation_level=None
+                                 )
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+def create_owner_id():
+    """
+    Returns a string that's unique to this process and call, so we know who is holding a lease.
+    """
+    return "{}:{}:{}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex)
+
+
+def make_dirs(path):
+    """
+    Create a folder if it doesn't exist. Another machine may create it at the same time, which is fine.
+    """
+    try:
+        os.makedirs(path)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
+
+
+def marker_file_name(key):
+    """
+    Returns a key as a safe file name, e.g. "5f1a...:timeouts:" stays as it is, but slashes and spaces are replaced.
+    """
+    return "".join(character if character.isalnum() or character in "_.:-" else "_" for character in key)
+
+
+def create_marker(path, expires_at, value=""):
+    """
+    Create a marker file, if it doesn't already exist. This is atomic, even over NFS.
+
+    Returns:
+        bool: True if this call created it.
+    """
+    try:
+        marker_file = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o664)
+    except OSError as error:
+        if error.errno == errno.EEXIST:
+            return False
+        raise
+    try:
+        os.write(marker_file, "{}\n{}".format(expires_at, value).encode("utf-8"))
+    finally:
+        os.close(marker_file)
+    return True
+
+
+def read_marker(path):
+    """
+    Returns:
+        (float, string): When the marker expires and its value, or None if it doesn't exist. A marker that's still
+        being written is given as not expiring for a while.
+    """
+    try:
+        with open(path, "rb") as marker_file:
+            content = marker_file.read().decode("utf-8")
+        expires_at, value = content.split("\n", 1)
+        return float(expires_at), value
+    except (IOError, OSError) as error:
+        if error.errno == errno.ENOENT:
+            return None
+        raise
+    except ValueError:
+        try:
+            return os.path.getmtime(path) + unreadable_marker_seconds, ""
+        except OSError:
+            return None
+
+
+def remove_expired_marker(path):
+    """
+    Remove a marker that has expired. It's renamed away first, which only one machine can do, and it's checked again
+    once it's ours, so a marker someone else set again in the meantime is put back.
+
+    If yet another machine creates the marker while it's renamed away, the one we put back is dropped, so both of
+    their actions go ahead. That needs two machines to set the same key within a few milliseconds of it expiring.
+    """
+    removed_path = "{}.expired.{}".format(path, uuid.uuid4().hex)
+    try:
+        os.rename(path, removed_path)
+    except OSError as error:
+        if error.errno == errno.ENOENT:
+            return
+        raise
+    marker = read_marker(removed_path)
+    if marker is not None and marker[0] > time.time():
+        try:
+            os.link(removed_path, path)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+    os.remove(removed_path)
+
+
+def stat_file(path):
+    """
+    Returns the os.stat of a file, or None if it doesn't exist. It's opened first, which makes NFS fetch its attributes
+    from the server rather than giving cached ones.
+    """
+    try:
+        file_descriptor = os.open(path, os.O_RDONLY)
+    except OSError as error:
+        if error.errno == errno.ENOENT:
+            return None
+        raise
+    try:
+        return os.fstat(file_descriptor)
+    finally:
+        os.close(file_descriptor)
+
+
+def same_file(file_stat, other_file_stat):
+    return file_stat is not None and other_file_stat is not None \
+        and (file_stat.st_dev, file_stat.st_ino) == (other_file_stat.st_dev, other_file_stat.st_ino)
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except OSError as error:
+        if error.errno != errno.ENOENT:
+            raise
+
+
+class JobLeaseStore:
+    """
+    Expiring leases keyed by JobId, shared by the whole farm, so a cron on the pulse and the event handlers on the
+    workers can't change the same job at the same time. Only one owner can hold the lease on a job at once. If the
+    owner dies without releasing it, the lease expires and can be taken by the next handler, so a crashed sandbox can't
+    block a job forever. An owner that needs longer than the lease renews it, see job_lease().
+
+    Each owner writes its own file in the "leases" folder of the shared state folder, named after the job and the
+    owner, and takes the lease by hard linking it to the job's lease file. The link fails if the lease file exists, even
+    over NFS, and an owner holds the lease while the lease file is the same file as its own. The modification time of
+    the file is when the lease expires, so renewing only touches the owner's own file, and never writes over a lease
+    someone else has taken since.
+
+    An expired lease is broken by renaming it away, which only one machine can do, and it's checked again once it's
+    ours, in case its owner renewed it in the meantime. Owners don't renew or release a lease in its last
+    margin_seconds, so a lease is never released or renewed at the same time as it's being broken.
+    """
+
+    def __init__(self, state_dir=None, margin_seconds=5):
+        self.leases_dir = os.path.join(state_dir or default_shared_state_dir, "leases")
+        self.margin_seconds = margin_seconds
+        make_dirs(self.leases_dir)
+
+    def lease_path(self, job_id):
+        return os.path.join(self.leases_dir, marker_file_name(job_id))
+
+    def owner_path(self, job_id, owner):
+        return "{}.owner.{}".format(self.lease_path(job_id), marker_file_name(owner))
+
+    def get_held_lease(self, job_id, owner):
+        """
+        Returns:
+            The os.stat of the lease if the owner holds it, or None.
+        """
+        owner_stat = stat_file(self.owner_path(job_id, owner))
+        lease_stat = stat_file(self.lease_path(job_id))
+        return lease_stat if same_file(lease_stat, owner_stat) else None
+
+    def try_acquire(self, job_id, owner, lease_seconds=120):
+        """
+        Try to take the lease on a job once, without waiting.
+
+        Returns:
+            bool: True if the owner now holds the lease.
+        """
+        if self.get_held_lease(job_id, owner) is not None:
+            return self.renew(job_id, owner, lease_seconds=lease_seconds)
+        path = self.lease_path(job_id)
+        owner_path = self.owner_path(job_id, owner)
+        # A new file each time, so a lease of ours that's being broken can't be mistaken for this one.
+        remove_file(owner_path)
+        create_marker(owner_path, 0, owner)
+        expires_at = time.time() + lease_seconds
+        os.utime(owner_path, (expires_at, expires_at))
+        # A second go, in case the lease expired or was released as we looked at it.
+        for attempt in range(2):
+            try:
+                os.link(owner_path, path)
+                return True
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    remove_file(owner_path)
+                    raise
+            # NFS can report a link that was made as failed if the reply is lost, so check the owner's file too.
+            if os.stat(owner_path).st_nlink == 2:
+                return True
+            lease_stat = stat_file(path)
+            if lease_stat is not None and lease_stat.st_mtime > time.time():
+                break
+            if lease_stat is not None:
+                self.break_expired_lease(job_id)
+        remove_file(owner_path)
+        return False
+
+    def break_expired_lease(self, job_id):
+        """
+        Remove a lease that has expired, along with its owner's file.
+        """
+        path = self.lease_path(job_id)
+        broken_path = "{}.broken.{}".format(path, uuid.uuid4().hex)
+        try:
+            os.rename(path, broken_path)
+        except OSError as error:
+            if error.errno == errno.ENOENT:
+                return
+            raise
+        broken_stat = stat_file(broken_path)
+        if broken_stat.st_mtime > time.time():
+            # It was renewed before we renamed it, so put it back. If someone else has taken the lease in the
+            # meantime, its owner finds out it's lost the lease when it next renews it.
+            try:
+                os.link(broken_path, path)
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+        else:
+            marker = read_marker(broken_path)
+            if marker is not None:
+                owner_path = self.owner_path(job_id, marker[1])
+                if same_file(stat_file(owner_path), broken_stat):
+                    remove_file(owner_path)
+        os.remove(broken_path)
+
+    def acquire(self, job_id, owner, lease_seconds=120, wait_seconds=5, poll_seconds=0.25):
+        """
+        Take the lease on a job, waiting up to wait_seconds for another owner to release it or for it to expire.
+
+        Returns:
+            bool: True if the owner now holds the lease.
+        """
+        deadline = time.time() + wait_seconds
+        while True:
+            if self.try_acquire(job_id, owner, lease_seconds=lease_seconds):
+                return True
+            if time.time() >= deadline:
+                return False
+            time.sleep(poll_seconds)
+
+    def renew(self, job_id, owner, lease_seconds=120):
+        """
+        Extend a lease the owner holds, by touching the owner's own file.
+
+        Returns:
+            bool: True if the owner still held the lease and it was renewed.
+        """
+        lease_stat = self.get_held_lease(job_id, owner)
+        if lease_stat is None or lease_stat.st_mtime - time.time() <= self.margin_seconds:
+            return False
+        expires_at = time.time() + lease_seconds
+        try:
+            os.utime(self.owner_path(job_id, owner), (expires_at, expires_at))
+        except OSError as error:
+            if error.errno == errno.ENOENT:
+                return False
+            raise
+        # If the lease was broken before the touch, the touch only changed our own file.
+        return self.get_held_lease(job_id, owner) is not None
+
+    def release(self, job_id, owner):
+        """
+        Release the lease on a job. This does nothing if the lease has expired and been taken by someone else. A lease
+        in its last margin_seconds is left to expire, as someone may be breaking it.
+        """
+        lease_stat = self.get_held_lease(job_id, owner)
+        if lease_stat is not None and lease_stat.st_mtime - time.time() > self.margin_seconds:
+            remove_file(self.lease_path(job_id))
+        remove_file(self.owner_path(job_id, owner))
+
+
+# The lease store used when job_lease() isn't given one, created on first use.
+default_job_lease_store = None
+
+
+def get_default_job_lease_store():
+    global default_job_lease_store
+    if default_job_lease_store is None:
+        default_job_lease_store = JobLeaseStore()
+    return default_job_lease_store
+
+
+@contextmanager
+def job_lease(job_id, lease_seconds=120, wait_seconds=5, lease_store=None):
+    """
+    Hold the lease on a job while modifying it, so other event handlers and crons don't change it at the same time.
+    The lease is renewed in the background every third of lease_seconds until it's released, so a handler that takes
+    longer than the lease (e.g. sending remote commands or emails) keeps it.
+
+    Example:
+        with u_FarmStateStore.job_lease(job.JobId, lease_store=self.job_lease_store) as lease_acquired:
+            if lease_acquired:
+                ...
+
+    Args:
+        job_id: string: The ID of the job to lease.
+        lease_seconds: int: How long the lease lasts if it isn't renewed, e.g. if the sandbox crashes.
+        wait_seconds: int: How long to wait for another owner before giving up. This is kept short, so a storm of
+        handlers on the same job doesn't hold up the sandboxes.
+        lease_store: JobLeaseStore: The listener's lease store. The shared default one is used if not given.
+    Yields:
+        bool: True if the lease was acquired.
+    """
+    lease_store = lease_store or get_default_job_lease_store()
+    owner = create_owner_id()
+    start_time = time.time()
+    lease_acquired = lease_store.acquire(job_id, owner, lease_seconds=lease_seconds, wait_seconds=wait_seconds)
+    # Only log the wait if someone else was holding the lease, otherwise crons touching every job get very noisy.
+    if lease_acquired and time.time() - start_time > 0.1:
+        print("# Acquired the lease on job '{}' in {:.3f} seconds.".format(job_id, time.time() - start_time))
+    elif not lease_acquired:
+        print("# Could not acquire the lease on job '{}' after {} seconds.".format(job_id, wait_seconds))
+    released = threading.Event()
+
+    def renew_lease():
+        while not released.wait(lease_seconds / 3.0):
+            if not lease_store.renew(job_id, owner, lease_seconds=lease_seconds):
+                print("# Lost the lease on job '{}' before it was released.".format(job_id))
+                return
+
+    if lease_acquired:
+        renewer = threading.Thread(target=renew_lease)
+        renewer.daemon = True
+        renewer.start()
+    try:
+        yield lease_acquired
+    finally:
+        if lease_acquired:
+            released.set()
+            renewer.join()
+            lease_store.release(job_id, owner)
+
+
+class ErrorCoalescer:
+    """
+    Groups errors by handler, job and error class within a time window. The first error in a window is handled, the
+    rest are counted and suppressed. When a job with hundreds of tasks hits the same error, this stops every error
+    running the handler in full, e.g. getting all the job's tasks from the repository or sending remote commands.
+
+    A job's errors come from all the workers rendering it, so each window is claimed with a marker in the
+    SharedIdempotencyStore, and only one worker on the farm handles it. Each machine keeps its own copy of the window in
+    its local database, and only goes to the shared marker for the first error it sees in a window, so the rest of a
+    storm costs no NFS round trips. A machine that didn't claim the window opens its copy when it first sees the error,
+    so it can suppress the errors for up to a window longer than the machine that claimed it. If the handler can't act,
+    e.g. it can't get the lease on the job, it should call release_window(), so the next error is handled instead.
+
+    The handled and suppressed counts are kept per handler and error class on each machine, so we can see how much
+    load was taken off the repository during storms.
+    """
+
+    def __init__(self, connection=None, state_dir=None, window_seconds=None, shared_state_dir=None):
+        self.connection = connection or connect(state_dir=state_dir)
+        self.window_seconds = window_seconds or default_coalesce_window_seconds
+        self.shared_windows = SharedIdempotencyStore(state_dir=shared_state_dir)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS error_windows ("
+                                "handler TEXT NOT NULL, "
+                                "group_id TEXT NOT NULL, "
+                                "error_class TEXT NOT NULL, "
+                                "expires_at REAL NOT NULL, "
+                                "suppressed INTEGER NOT NULL DEFAULT 0, "
+                                "PRIMARY KEY (handler, group_id, error_class))"
+                                )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS error_windows_expiry ON error_windows (expires_at)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS error_counters ("
+                                "handler TEXT NOT NULL, "
+                                "error_class TEXT NOT NULL, "
+                                "handled INTEGER NOT NULL DEFAULT 0, "
+                                "suppressed INTEGER NOT NULL DEFAULT 0, "
+                                "PRIMARY KEY (handler, error_class))"
+                                )
+        # Clear out old windows when a new sandbox starts up.
+        self.purge_expired_windows()
+
+    @staticmethod
+    def window_key(handler_name, group_id, error_class):
+        return "error_window:{}:{}:{}".format(handler_name, group_id, error_class)
+
+    def should_handle(self, handler_name, group_id, error_class):
+        """
+        Check if this error should be handled, or if one like it has already been handled in the current window.
+
+        Args:
+            handler_name: string: The name of the event plugin handling the error, e.g. "u_OnJobErrors".
+            group_id: string: What to group the errors by, usually the job ID.
+            error_class: string: The error class from u_ErrorClassifier.
+        Returns:
+            bool: True if this is the first error in the window on the farm, so it should be handled.
+        """
+        now = time.time()
+        row = self.connection.execute("SELECT expires_at, suppressed FROM error_windows "
+                                      "WHERE handler = ? AND group_id = ? AND error_class = ?",
+                                      (handler_name, group_id, error_class)
+                                      ).fetchone()
+        # Only go to the shared marker if this machine doesn't already have the window open.
+        if row is not None and row[0] > now:
+            handle = False
+        else:
+            handle = self.shared_windows.check_and_set(self.window_key(handler_name, group_id, error_class),
+                                                       value=socket.gethostname(),
+                                                       ttl_seconds=self.window_seconds
+                                                       )
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            if handle:
+                # Start a new window for this group.
+                self.connection.execute("INSERT OR REPLACE INTO error_windows "
+                                        "(handler, group_id, error_class, expires_at, suppressed) "
+                                        "VALUES (?, ?, ?, ?, 0)",
+                                        (handler_name, group_id, error_class, now + self.window_seconds)
+                                        )
+            else:
+                # Another machine may have handled this window, so open this machine's copy of it if it isn't open.
+                self.connection.execute("DELETE FROM error_windows "
+                                        "WHERE handler = ? AND group_id = ? AND error_class = ? AND expires_at <= ?",
+                                        (handler_name, group_id, error_class, now)
+                                        )
+                self.connection.execute("INSERT OR IGNORE INTO error_windows "
+                                        "(handler, group_id, error_class, expires_at, suppressed) "
+                                        "VALUES (?, ?, ?, ?, 0)",
+                                        (handler_name, group_id, error_class, now + self.window_seconds)
+                                        )
+                self.connection.execute("UPDATE error_windows SET suppressed = suppressed + 1 "
+                                        "WHERE handler = ? AND group_id = ? AND error_class = ?",
+                                        (handler_name, group_id, error_class)
+                                        )
+            self.connection.execute("INSERT OR IGNORE INTO error_counters (handler, error_class) VALUES (?, ?)",
+                                    (handler_name, error_class)
+                                    )
+            self.connection.execute("UPDATE error_counters SET {0} = {0} + 1 "
+                                    "WHERE handler = ? AND error_class = ?".format("handled" if handle else "suppressed"),
+                                    (handler_name, error_class)
+                                    )
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+        # Log how many errors the last window suppressed, now it's closed.
+        if handle and row is not None and row[1]:
+            print("# Suppressed {} '{}' errors for '{}' in {} on this machine during the last {} seconds.".format(
+                row[1],
+                error_class,
+                group_id,
+                handler_name,
+                self.window_seconds
+            ))
+        return handle
+
+    def release_window(self, handler_name, group_id, error_classes):
+        """
+        Give up the windows we were handling without handling them, e.g. if we couldn't get the lease on the job, so
+        the next error of each class is handled instead of being suppressed.
+
+        Args:
+            error_classes: list: The error classes whose windows to release.
+        """
+        for error_class in error_classes:
+            self.shared_windows.delete(self.window_key(handler_name, group_id, error_class))
+            self.connection.execute("DELETE FROM error_windows WHERE handler = ? AND group_id = ? AND error_class = ?",
+                                    (handler_name, group_id, error_class)
+                                    )
+
+    def filter_error_classes(self, handler_name, group_id, error_classes):
+        """
+        Returns the error classes that should be handled now, from the error classes found in a report.
+        """
+        return frozenset(error_class for error_class in error_classes
+                         if self.should_handle(handler_name, group_id, error_class))
+
+    def get_counters(self, handler_name=None):
+        """
+        Returns how many errors have been handled and suppressed.
+
+        Args:
+            handler_name: string: Option to only get the counters for one handler.
+        Returns:
+            counters: dict: {(handler, error class): {"handled": int, "suppressed": int}}
+        """
+        query = "SELECT handler, error_class, handled, suppressed FROM error_counters"
+        parameters = ()
+        if handler_name:
+            query += " WHERE handler = ?"
+            parameters = (handler_name,)
+        return {(handler, error_class): {"handled": handled, "suppressed": suppressed}
+                for handler, error_class, handled, suppressed in self.connection.execute(query, parameters)}
+
+    def purge_expired_windows(self):
+        """
+        Delete closed windows, so the table doesn't grow with every job that's ever errored.
+
+        Returns:
+            int: The number of windows deleted.
+        """
+        return self.connection.execute("DELETE FROM error_windows WHERE expires_at <= ?", (time.time(),)).rowcount
+
+
+def idempotency_key(job_id, function_name, error_class=""):
+    """
+    Returns the key for an action performed on a job, e.g. "5f1a...:timeouts:task_timeout".
+
+    Args:
+        job_id: string: The ID of the job.
+        function_name: string: The name of the function performing the action.
+        error_class: string: Option to key the action by the error class from u_ErrorClassifier too.
+    """
+    return "{}:{}:{}".format(job_id, function_name, error_class)
+
+
+class IdempotencyStore:
+    """
+    Keys with an expiry, used to stop actions being performed multiple times by the sandboxes and crons on one machine,
+    e.g. caching the render capacity on the pulse. The keys are local to the machine, so actions that must only happen
+    once across the whole farm, e.g. from OnJobError events, use the SharedIdempotencyStore instead.
+
+    Each key is put in an hour bucket by when it expires, and the buckets are indexed. Cleanup then only deletes the
+    buckets that have fully expired, instead of checking every key. It runs lazily, at most once per purge interval
+    across all the sandboxes on the machine.
+    """
+
+    # The size of the expiry buckets.
+    bucket_seconds = 3600
+
+    def __init__(self, connection=None, state_dir=None, purge_interval_seconds=3600):
+        self.connection = connection or connect(state_dir=state_dir)
+        self.purge_interval_seconds = purge_interval_seconds
+        # Don't check the last purge time on the database until this time, so we aren't checking it on every call.
+        self.next_purge_check = 0
+        self.connection.execute("CREATE TABLE IF NOT EXISTS idempotency_keys ("
+                                "key TEXT PRIMARY KEY, "
+                                "value TEXT NOT NULL, "
+                                "expires_at REAL NOT NULL, "
+                                "expiry_bucket INTEGER NOT NULL)"
+                                )
+        # Databases made before the keys were bucketed need the column adding.
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(idempotency_keys)")]
+        if "expiry_bucket" not in columns:
+            self.connection.execute("ALTER TABLE idempotency_keys ADD COLUMN expiry_bucket INTEGER NOT NULL DEFAULT 0")
+            self.connection.execute("UPDATE idempotency_keys SET expiry_bucket = CAST(expires_at / ? AS INTEGER)",
+                                    (self.bucket_seconds,)
+                                    )
+            self.connection.execute("DROP INDEX IF EXISTS idempotency_keys_expiry")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS idempotency_keys_bucket "
+                                "ON idempotency_keys (expiry_bucket)"
+                                )
+        self.connection.execute("CREATE TABLE IF NOT EXISTS store_info (name TEXT PRIMARY KEY, value REAL NOT NULL)")
+
+    def check_and_set(self, key, value="", ttl_seconds=default_idempotency_ttl_seconds):
+        """
+        Set the key if it isn't already set. This is atomic, so only one handler can ever set a key.
+
+        Example:
+            if idempotency_store.check_and_set(u_FarmStateStore.idempotency_key(job.JobId, "timeouts")):
+                # modify the job
+
+        Args:
+            key: string: The key for the action, see idempotency_key().
+            value: string: Info to store with the key, e.g. the error message. Handy when debugging.
+            ttl_seconds: int: How long until the key expires and the action can be performed again.
+        Returns:
+            bool: True if the key was set now, so the action should be performed.
+        """
+        self.maybe_purge_expired_keys()
+        now = time.time()
+        expires_at = now + ttl_seconds
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self.connection.execute("DELETE FROM idempotency_keys WHERE key = ? AND expires_at <= ?", (key, now))
+            key_set = self.connection.execute("INSERT OR IGNORE INTO idempotency_keys "
+                                              "(key, value, expires_at, expiry_bucket) VALUES (?, ?, ?, ?)",
+                                              (key, value, expires_at, int(expires_at // self.bucket_seconds))
+                                              ).rowcount == 1
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+        return key_set
+
+    def get(self, key):
+        """
+        Returns the value stored with a key, or None if it isn't set or has expired.
+        """
+        row = self.connection.execute("SELECT value FROM idempotency_keys WHERE key = ? AND expires_at > ?",
+                                      (key, time.time())
+                                      ).fetchone()
+        return row[0] if row else None
+
+    def delete(self, key):
+        """
+        Delete a key, so the action can be performed again.
+        """
+        self.connection.execute("DELETE FROM idempotency_keys WHERE key = ?", (key,))
+
+    def purge_expired_keys(self):
+        """
+        Delete the keys in the hour buckets that have fully expired. Keys that have expired in the current bucket are
+        left until the next purge, but they're already ignored by check_and_set() and get().
+
+        Returns:
+            (int, float): The number of keys deleted and how long it took in seconds.
+        """
+        start_time = time.time()
+        purged_count = self.connection.execute("DELETE FROM idempotency_keys WHERE expiry_bucket < ?",
+                                               (int(start_time // self.bucket_seconds),)
+                                               ).rowcount
+        purge_seconds = time.time() - start_time
+        print("# Purged {} expired idempotency keys in {:.3f} seconds.".format(purged_count, purge_seconds))
+        return purged_count, purge_seconds
+
+    def maybe_purge_expired_keys(self):
+        """
+        Purge the expired keys if no sandbox on this machine has done it in the last purge interval.
+
+        Returns:
+            (int, float): The number of keys deleted and how long it took in seconds, or None if it wasn't time yet.
+        """
+        now = time.time()
+        if now < self.next_purge_check:
+            return None
+        self.next_purge_check = now + self.purge_interval_seconds
+        # Claim the purge in a transaction, so only one sandbox does it.
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.connection.execute("SELECT value FROM store_info WHERE name = 'idempotency_last_purge'"
+                                          ).fetchone()
+            purge_due = row is None or row[0] <= now - self.purge_interval_seconds
+            if purge_due:
+                self.connection.execute("INSERT OR REPLACE INTO store_info (name, value) "
+                                        "VALUES ('idempotency_last_purge', ?)", (now,)
+                                        )
+            else:
+                # Check again when the interval is up since the last purge.
+                self.next_purge_check = row[0] + self.purge_interval_seconds
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+        if purge_due:
+            return self.purge_expired_keys()
+        return None
+
+
+class SharedIdempotencyStore:
+    """
+    The farm wide version of the IdempotencyStore, with the same check_and_set(), get() and delete(). Use it for
+    actions that must only happen once per job across every machine, e.g. the error emails, or the job changes the
+    OnJobError events make, as those events run on whichever worker reported the error.
+
+    Each key is a marker file in the "keys" folder, so setting a key still costs a file create on NFS, like the old temp
+    txt files did, and checking one costs a read. Nothing else is written per key. The expired keys are deleted by the
+    pulse's house cleaning (see u_TaskTimeAggregation), rather than by the error handlers.
+    """
+
+    def __init__(self, state_dir=None, purge_interval_seconds=3600):
+        self.state_dir = state_dir or default_shared_state_dir
+        self.keys_dir = os.path.join(self.state_dir, "keys")
+        self.purge_interval_seconds = purge_interval_seconds
+        # Don't try to claim the purge until this time, so we aren't checking it on every call.
+        self.next_purge_check = 0
+        make_dirs(self.keys_dir)
+
+    def key_path(self, key):
+        return os.path.join(self.keys_dir, marker_file_name(key))
+
+    def claim(self, key, value="", ttl_seconds=default_idempotency_ttl_seconds):
+        """
+        Create the key's marker, replacing it if it has expired.
+
+        Returns:
+            bool: True if the key was set now.
+        """
+        path = self.key_path(key)
+        # A second go, in case the marker expired or was deleted as we looked at it.
+        for attempt in range(2):
+            if create_marker(path, time.time() + ttl_seconds, value):
+                return True
+            marker = read_marker(path)
+            if marker is not None:
+                if marker[0] > time.time():
+                    return False
+                remove_expired_marker(path)
+        return False
+
+    def check_and_set(self, key, value="", ttl_seconds=default_idempotency_ttl_seconds):
+        """
+        Set the key if it isn't already set. This is atomic across the farm, so only one handler can ever set a key.
+
+        Example:
+            if shared_idempotency_store.check_and_set(u_FarmStateStore.idempotency_key(job.JobId, "timeouts")):
+                # modify the job
+
+        Args:
+            key: string: The key for the action, see idempotency_key().
+            value: string: Info to store with the key, e.g. the error message. Handy when debugging.
+            ttl_seconds: int: How long until the key expires and the action can be performed again.
+        Returns:
+            bool: True if the key was set now, so the action should be performed.
+        """
+        return self.claim(key, value, ttl_seconds)
+
+    def get(self, key):
+        """
+        Returns the value stored with a key, or None if it isn't set or has expired.
+        """
+        marker = read_marker(self.key_path(key))
+        if marker is None or marker[0] <= time.time():
+            return None
+        return marker[1]
+
+    def delete(self, key):
+        """
+        Delete a key, so the action can be performed again.
+        """
+        try:
+            os.remove(self.key_path(key))
+        except OSError as error:
+            if error.errno != errno.ENOENT:
+                raise
+
+    def purge_expired_keys(self):
+        """
+        Delete the expired keys. This reads every key, so it's only run from the pulse's house cleaning, see
+        maybe_purge_expired_keys().
+
+        Returns:
+            (int, float): The number of keys deleted and how long it took in seconds.
+        """
+        start_time = time.time()
+        purged_count = 0
+        for file_name in os.listdir(self.keys_dir):
+            # Skip the markers other machines are removing.
+            if ".expired." in file_name:
+                continue
+            path = os.path.join(self.keys_dir, file_name)
+            marker = read_marker(path)
+            if marker is not None and marker[0] <= start_time:
+                remove_expired_marker(path)
+                purged_count += 1
+        purge_seconds = time.time() - start_time
+        print("# Purged {} expired shared idempotency keys in {:.3f} seconds.".format(purged_count, purge_seconds))
+        return purged_count, purge_seconds
+
+    def maybe_purge_expired_keys(self):
+        """
+        Purge the expired keys if no machine on the farm has done it in the last purge interval.
+
+        Returns:
+            (int, float): The number of keys deleted and how long it took in seconds, or None if it wasn't time yet.
+        """
+        now = time.time()
+        if now < self.next_purge_check:
+            return None
+        self.next_purge_check = now + self.purge_interval_seconds
+        if self.claim("shared_idempotency_last_purge", value=socket.gethostname(),
+                      ttl_seconds=self.purge_interval_seconds):
+            return self.purge_expired_keys()
+        return None
+
+
+class TaskTimeStore:
+    """
+    Running totals of the completed task render times of each job: the sum, count, min and max. This lets the render
+    planner read one row per job (or per batch) instead of getting every task of every job from the repository.
+
+    The totals are updated incrementally by the u_TaskTimeAggregation event, which only re-reads the tasks of jobs
+    whose completed task count has changed since they were last recorded.
+    """
+
+    def __init__(self, connection=None, state_dir=None):
+        self.connection = connection or connect(state_dir=state_dir)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS task_times ("
+                                "job_id TEXT PRIMARY KEY, "
+                                "batch_name TEXT NOT NULL, "
+                                "job_name TEXT NOT NULL, "
+                                "plugin TEXT NOT NULL, "
+                                "job_group TEXT NOT NULL, "
+                                "pool TEXT NOT NULL DEFAULT '', "
+                                # The completed tasks when the job was last recorded, to know if it needs updating.
+                                "completed_tasks INTEGER NOT NULL, "
+                                # The completed tasks with a render time, the totals below are for these.
+                                "timed_tasks INTEGER NOT NULL, "
+                                "timed_frames INTEGER NOT NULL DEFAULT 0, "
+                                "render_seconds REAL NOT NULL, "
+                                "min_render_seconds REAL, "
+                                "max_render_seconds REAL, "
+                                "finished INTEGER NOT NULL DEFAULT 0, "
+                                "updated_at REAL NOT NULL)"
+                                )
+        # Databases made before the pool and frames were recorded need the columns adding.
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(task_times)")]
+        if "pool" not in columns:
+            self.connection.execute("ALTER TABLE task_times ADD COLUMN pool TEXT NOT NULL DEFAULT ''")
+        if "timed_frames" not in columns:
+            self.connection.execute("ALTER TABLE task_times ADD COLUMN timed_frames INTEGER NOT NULL DEFAULT 0")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS task_times_batch ON task_times (batch_name)")
+
+    def get_completed_tasks(self):
+        """
+        Returns:
+            dict: {job ID: (completed tasks when it was last recorded, when it was recorded)} for the jobs that
+            haven't finished.
+        """
+        return dict((job_id, (completed_tasks, updated_at)) for job_id, completed_tasks, updated_at in
+                    self.connection.execute("SELECT job_id, completed_tasks, updated_at FROM task_times "
+                                            "WHERE finished = 0"))
+
+    def record_job(self, job_id, batch_name, job_name, plugin, job_group, completed_tasks, render_times,
+                   finished=False, pool="", timed_frames=0):
+        """
+        Record the totals of a job's completed task render times, replacing what was recorded before.
+
+        Args:
+            completed_tasks: int: The job's completed task count.
+            render_times: list: The render time in seconds of each completed task. Tasks with no render time should
+            be left out.
+            finished: bool: True if the job has left the farm, so it no longer needs updating.
+            pool: string: The job's pool, which is its show.
+            timed_frames: int: The frames in the tasks with a render time.
+        """
+        self.connection.execute("INSERT OR REPLACE INTO task_times (job_id, batch_name, job_name, plugin, job_group, "
+                                "pool, completed_tasks, timed_tasks, timed_frames, render_seconds, "
+                                "min_render_seconds, max_render_seconds, finished, updated_at) "
+                                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                (job_id, batch_name or "", job_name, plugin, job_group, pool or "", completed_tasks,
+                                 len(render_times), timed_frames, sum(render_times),
+                                 min(render_times) if render_times else None,
+                                 max(render_times) if render_times else None, int(finished), time.time())
+                                )
+
+    def mark_finished(self, job_ids):
+        """
+        Stop updating jobs that have left the farm, their totals are kept.
+        """
+        self.connection.executemany("UPDATE task_times SET finished = 1 WHERE job_id = ?",
+                                    [(job_id,) for job_id in job_ids]
+                                    )
+
+    def get_jobs(self, job_ids=None):
+        """
+        Returns:
+            dict: {job ID: {"completed_tasks", "timed_tasks", "render_seconds", "min_render_seconds",
+            "max_render_seconds", ...}} for the given jobs, or all of them.
+        """
+        rows = self.connection.execute("SELECT * FROM task_times")
+        columns = [column[0] for column in rows.description]
+        job_rows = dict((row[0], dict(zip(columns, row))) for row in rows)
+        if job_ids is None:
+            return job_rows
+        return dict((job_id, job_rows[job_id]) for job_id in job_ids if job_id in job_rows)
+
+    def get_batches(self):
+        """
+        Returns:
+            dict: {batch name: {"jobs", "completed_tasks", "timed_tasks", "render_seconds", "min_render_seconds",
+            "max_render_seconds"}}, summed over the jobs in each batch.
+        """
+        return dict((batch_name, {"jobs": jobs,
+                                  "completed_tasks": completed_tasks,
+                                  "timed_tasks": timed_tasks,
+                                  "render_seconds": render_seconds,
+                                  "min_render_seconds": min_render_seconds,
+                                  "max_render_seconds": max_render_seconds
+                                  })
+                    for batch_name, jobs, completed_tasks, timed_tasks, render_seconds, min_render_seconds,
+                    max_render_seconds in self.connection.execute(
+                        "SELECT batch_name, COUNT(*), SUM(completed_tasks), SUM(timed_tasks), SUM(render_seconds), "
+                        "MIN(min_render_seconds), MAX(max_render_seconds) FROM task_times "
+                        "WHERE batch_name != '' GROUP BY batch_name"
+                    ))
+
+    def purge_finished_jobs(self, older_than_seconds=default_idempotency_ttl_seconds):
+        """
+        Delete finished jobs that haven't been updated for a while, so the table doesn't grow forever.
+
+        Returns:
+            int: The number of jobs deleted.
+        """
+        return self.connection.execute("DELETE FROM task_times WHERE finished = 1 AND updated_at <= ?",
+                                       (time.time() - older_than_seconds,)
+                                       ).rowcount
+
+
+class TaskDurationSketchStore:
+    """
+    The u_TaskDurationSketch quantile sketches of task render times, as JSON keyed by what they're of, e.g.
+    "batch|Arnold|abc_010_lighting_v003". Only the u_TaskTimeAggregation event on the pulse writes them.
+    """
+
+    def __init__(self, connection=None, state_dir=None):
+        self.connection = connection or connect(state_dir=state_dir)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS task_duration_sketches ("
+                                "sketch_key TEXT PRIMARY KEY, "
+                                "sketch TEXT NOT NULL, "
+                                "updated_at REAL NOT NULL)"
+                                )
+
+    def get_sketches(self, sketch_keys=None):
+        """
+        Returns:
+            dict: {sketch key: sketch JSON} for the given keys that exist, or all of them.
+        """
+        if sketch_keys is None:
+            return dict(self.connection.execute("SELECT sketch_key, sketch FROM task_duration_sketches"))
+        sketches = {}
+        for sketch_key in sketch_keys:
+            row = self.connection.execute("SELECT sketch FROM task_duration_sketches WHERE sketch_key = ?",
+                                          (sketch_key,)
+                                          ).fetchone()
+            if row is not None:
+                sketches[sketch_key] = row[0]
+        return sketches
+
+    def set_sketches(self, sketches):
+        """
+        Args:
+            sketches: dict: {sketch key: sketch JSON} to save, replacing what was there.
+        """
+        now = time.time()
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self.connection.executemany("INSERT OR REPLACE INTO task_duration_sketches "
+                                        "(sketch_key, sketch, updated_at) VALUES (?, ?, ?)",
+                                        [(sketch_key, sketch, now) for sketch_key, sketch in sketches.items()]
+                                        )
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def delete_sketches(self, sketch_keys):
+        self.connection.executemany("DELETE FROM task_duration_sketches WHERE sketch_key = ?",
+                                    [(sketch_key,) for sketch_key in sketch_keys]
+                                    )
+
+    def purge_sketches(self, older_than_seconds=default_idempotency_ttl_seconds):
+        """
+        Delete the sketches that haven't been added to for a while, e.g. of batches that have finished.
+
+        Returns:
+            int: The number of sketches deleted.
+        """
+        return self.connection.execute("DELETE FROM task_duration_sketches WHERE updated_at <= ?",
+                                       (time.time() - older_than_seconds,)
+                                       ).rowcount
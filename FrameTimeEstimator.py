@@ -0,0 +1,286 @@
+#! /usr/bin/python
+"""
+
+Frame Time Estimator:
+
+Estimates the average frame render time of a job that has no completed frames yet, from the frame times of
+similar jobs that have already rendered. Used by the render planner (ExportCGToCSV) instead of a fixed guess per plugin.
+
+The model is trained from the job totals in the u_FarmStateStore TaskTimeStore and saved as a JSON file, so estimating
+is a few dictionary lookups. Jobs are grouped at several levels, from most to least specific:
+    plugin / show (pool) / group / batch name pattern
+    plugin / show / group
+    plugin / show
+    plugin / group
+    plugin
+An estimate comes from the most specific level with at least min_jobs jobs. If there isn't one, the old fixed guesses
+are used. Each estimate has the median frame time of the jobs in its group, an interval from their 10th to 90th
+percentiles, and whether it's low confidence (few jobs, a broad level, or the fixed guess).
+
+The batch name pattern is the batch name with its numbers replaced, so "abc_010_lighting_v003" and
+"abc_020_lighting_v007" share the pattern "abc_#_lighting_v#".
+
+Example:
+    estimator = FrameTimeEstimator.load()
+    estimate = estimator.estimate("Arnold", show="abc", group="251gb", batch_name="abc_010_lighting_v003")
+    print(estimate.minutes, estimate.low, estimate.high, estimate.low_confidence)
+
+"""
+
+import json
+import os
+import re
+import time
+from collections import namedtuple
+
+# Where the model is saved, next to the local state databases.
+default_model_path = os.environ.get("U_FRAME_TIME_MODEL",
+                                    os.path.join(os.sep, "var", "tmp", "deadline_farm_state", "frame_time_model.json")
+                                    )
+
+# The fields of a job each level groups by, from most to least specific.
+levels = [
+    ("plugin", "show", "group", "batch_pattern"),
+    ("plugin", "show", "group"),
+    ("plugin", "show"),
+    ("plugin", "group"),
+    ("plugin",),
+]
+
+# Estimates from these levels, or with fewer jobs than this, are flagged as low confidence.
+broad_level_start = 3
+confident_job_count = 10
+
+FrameTimeEstimate = namedtuple("FrameTimeEstimate", ["minutes", "low", "high", "jobs", "level", "low_confidence"])
+
+
+def batch_pattern(batch_name):
+    """
+    Returns the batch name with its numbers replaced by "#", e.g. "abc_#_lighting_v#".
+    """
+    return re.sub(r"\d+", "#", (batch_name or "").lower())
+
+
+def default_frame_minutes(plugin, group=""):
+    """
+    The fixed guesses we used before there was a model, in minutes per frame.
+    """
+    if plugin == "Houdini":
+        if group == "sims":
+            return 120
+        return 5
+    if plugin in ["Arnold", "Mantra"]:
+        return 20
+    if plugin == "MayaCmd":
+        return 5
+    return 0
+
+
+def percentile(sorted_values, fraction):
+    """
+    Returns the value at a fraction (0 to 1) of a sorted list, interpolating between the nearest two values.
+    """
+    position = fraction * (len(sorted_values) - 1)
+    lower_index = int(position)
+    upper_index = min(lower_index + 1, len(sorted_values) - 1)
+    return sorted_values[lower_index] + (sorted_values[upper_index] - sorted_values[lower_index]) * (
+            position - lower_index)
+
+
+def group_key(level_fields, job_fields):
+    return "|".join([str(len(level_fields))] + [job_fields.get(field) or "" for field in level_fields])
+
+
+def record_frame_minutes(record):
+    """
+    Returns the average frame render time in minutes of a TaskTimeStore job row. Rows recorded before the frames were
+    counted only have their tasks, which were a frame each for most jobs.
+    """
+    return record["render_seconds"] / float(record.get("timed_frames") or record["timed_tasks"]) / 60.0
+
+
+def job_fields_from_record(record):
+    """
+    Returns the fields the levels group by, from a TaskTimeStore job row.
+    """
+    return {"plugin": record["plugin"],
+            "show": record.get("pool", ""),
+            "group": record["job_group"],
+            "batch_pattern": batch_pattern(record["batch_name"])
+            }
+
+
+class FrameTimeEstimator:
+
+    def __init__(self, groups=None, min_jobs=3, trained_at=0):
+        """
+        Args:
+            groups: dict: {group key: {"jobs": int, "minutes": median, "low": p10, "high": p90}}, from train().
+            min_jobs: int: The fewest jobs a group needs to be used for an estimate.
+            trained_at: float: When the model was trained.
+        """
+        self.groups = groups or {}
+        self.min_jobs = min_jobs
+        self.trained_at = trained_at
+
+    @classmethod
+    def train(cls, records, min_jobs=3):
+        """
+        Train a model from job totals.
+
+        Args:
+            records: list: TaskTimeStore job rows, i.e. dicts with "plugin", "pool", "job_group", "batch_name",
+            "timed_tasks", "timed_frames" and "render_seconds". Jobs without any timed tasks are skipped.
+            min_jobs: int: The fewest jobs a group needs to be used for an estimate.
+        Returns:
+            FrameTimeEstimator
+        """
+        # {group key: [the average frame minutes of each job]}
+        group_minutes = {}
+        for record in records:
+            if not record["timed_tasks"]:
+                continue
+            job_minutes = record_frame_minutes(record)
+            job_fields = job_fields_from_record(record)
+            for level_fields in levels:
+                group_minutes.setdefault(group_key(level_fields, job_fields), []).append(job_minutes)
+
+        groups = {}
+        for key, minutes in group_minutes.items():
+            if len(minutes) < min_jobs:
+                continue
+            minutes.sort()
+            groups[key] = {"jobs": len(minutes),
+                           "minutes": percentile(minutes, 0.5),
+                           "low": percentile(minutes, 0.1),
+                           "high": percentile(minutes, 0.9)
+                           }
+        return cls(groups, min_jobs=min_jobs, trained_at=time.time())
+
+    def estimate(self, plugin, show="", group="", batch_name=""):
+        """
+        Estimate the average frame render time of a job.
+
+        Returns:
+            FrameTimeEstimate: The minutes per frame, the interval, how many jobs it's from, the level index used
+            (None for the fixed guess) and whether it's low confidence.
+        """
+        job_fields = {"plugin": plugin, "show": show, "group": group, "batch_pattern": batch_pattern(batch_name)}
+        for level_index, level_fields in enumerate(levels):
+            model_group = self.groups.get(group_key(level_fields, job_fields))
+            if model_group is not None:
+                low_confidence = level_index >= broad_level_start or model_group["jobs"] < confident_job_count
+                return FrameTimeEstimate(model_group["minutes"],
+                                         model_group["low"],
+                                         model_group["high"],
+                                         model_group["jobs"],
+                                         level_index,
+                                         low_confidence
+                                         )
+        minutes = default_frame_minutes(plugin, group)
+        return FrameTimeEstimate(minutes, minutes, minutes, 0, None, True)
+
+    def estimate_task(self, plugin, frames_per_task=1, show="", group="", batch_name=""):
+        """
+        Estimate the average task render time of a job, i.e. its frame time x its frames per task.
+
+        Returns:
+            FrameTimeEstimate: Like estimate(), with the minutes and the interval per task.
+        """
+        estimate = self.estimate(plugin, show=show, group=group, batch_name=batch_name)
+        return estimate._replace(minutes=estimate.minutes * frames_per_task,
+                                 low=estimate.low * frames_per_task,
+                                 high=estimate.high * frames_per_task
+                                 )
+
+    def save(self, model_path=None):
+        model_path = model_path or default_model_path
+        model_dir = os.path.dirname(model_path)
+        if not os.path.isdir(model_dir):
+            os.makedirs(model_dir)
+        # Write to a temp file then rename it, so a reader never sees half a model.
+        temp_path = "{}.{}.tmp".format(model_path, os.getpid())
+        with open(temp_path, "w") as model_file:
+            json.dump({"trained_at": self.trained_at, "min_jobs": self.min_jobs, "groups": self.groups}, model_file)
+        os.rename(temp_path, model_path)
+
+    @classmethod
+    def load(cls, model_path=None):
+        """
+        Load the saved model. If there isn't one yet, the estimator only gives the fixed guesses.
+        """
+        model_path = model_path or default_model_path
+        if not os.path.isfile(model_path):
+            return cls()
+        with open(model_path) as model_file:
+            model = json.load(model_file)
+        return cls(model["groups"], min_jobs=model["min_jobs"], trained_at=model["trained_at"])
+
+
+def model_age_seconds(model_path=None):
+    """
+    Returns how long ago the saved model was written, or None if there isn't one.
+    """
+    model_path = model_path or default_model_path
+    if not os.path.isfile(model_path):
+        return None
+    return time.time() - os.path.getmtime(model_path)
+
+
+def backtest(records, train_fraction=0.8, min_jobs=3):
+    """
+    Score the estimator against what jobs actually rendered at. The model is trained on the older jobs and tested on
+    the newer ones, like it would be used, and compared with the fixed guesses.
+
+    Args:
+        records: list: TaskTimeStore job rows, with "updated_at" to order them by.
+        train_fraction: float: The fraction of the jobs to train on.
+        min_jobs: int: The fewest jobs a group needs to be used for an estimate.
+    Returns:
+        dict: The median absolute percentage error of the model and the fixed guesses, how often the actual frame
+        time was inside the model's interval, how many estimates were low confidence, and the time per estimate.
+    """
+    records = sorted((record for record in records if record["timed_tasks"]), key=lambda record: record["updated_at"])
+    split_index = int(len(records) * train_fraction)
+    train_records, test_records = records[:split_index], records[split_index:]
+    estimator = FrameTimeEstimator.train(train_records, min_jobs=min_jobs)
+
+    model_errors = []
+    default_errors = []
+    inside_interval = 0
+    low_confidence = 0
+    start_time = time.time()
+    for record in test_records:
+        actual_minutes = record_frame_minutes(record)
+        if not actual_minutes:
+            continue
+        job_fields = job_fields_from_record(record)
+        estimate = estimator.estimate(job_fields["plugin"], job_fields["show"], job_fields["group"],
+                                      record["batch_name"])
+        model_errors.append(abs(estimate.minutes - actual_minutes) / actual_minutes)
+        default_minutes = default_frame_minutes(job_fields["plugin"], job_fields["group"])
+        default_errors.append(abs(default_minutes - actual_minutes) / actual_minutes)
+        if estimate.low <= actual_minutes <= estimate.high:
+            inside_interval += 1
+        if estimate.low_confidence:
+            low_confidence += 1
+    estimate_seconds = (time.time() - start_time) / max(len(test_records), 1)
+
+    results = {"train_jobs": len(train_records),
+               "test_jobs": len(model_errors),
+               "model_median_error": percentile(sorted(model_errors), 0.5) if model_errors else None,
+               "default_median_error": percentile(sorted(default_errors), 0.5) if default_errors else None,
+               "interval_coverage": inside_interval / float(len(model_errors)) if model_errors else None,
+               "low_confidence_estimates": low_confidence,
+               "seconds_per_estimate": estimate_seconds
+               }
+    if model_errors:
+        print("# Backtest on {} jobs: median error {:.0%} with the model vs {:.0%} with the fixed guesses, {:.0%} inside "
+              "the interval, {} low confidence, {:.6f} seconds per estimate.".format(results["test_jobs"],
+                                                                                    results["model_median_error"],
+                                                                                    results["default_median_error"],
+                                                                                    results["interval_coverage"],
+                                                                                    low_confidence,
+                                                                                    estimate_seconds
+                                                                                    ))
+    return results
@@ -0,0 +1,334 @@
+#! /usr/bin/python
+"""
+
+Job Patch:
+
+Collects the changes we want to make to a job and applies them with a single save, suspending the job only for the
+changes that need it. bulk_patch_jobs() brings a list of jobs to a desired state from a bounded pool of threads, only
+writing the jobs that differ from it.
+Used by u_DeadlineToolbox.modify_job(), the OnJobError events, the crons and the TaskTimeAggregation event.
+
+The repository calls go through RepositoryUtils, which can be swapped for a fake, so a patch can be stepped through
+outside of Deadline.
+
+Example:
+    JobPatch(job).set_field("JobPriority", 10).append_comment("Timed out").apply()
+
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from Deadline.Scripting import *
+    from scripts.General.u_FarmStateStore import u_FarmStateStore
+except ImportError:
+    # Outside of Deadline, e.g. when trying it out on fake jobs.
+    RepositoryUtils = None
+    import FarmStateStore as u_FarmStateStore
+
+
+class JobPatch:
+    """
+    Collects the changes we want to make to a job, then applies them all with a single save.
+
+    Values that are already set on the job are skipped, so asking for a change the job already has costs nothing.
+    Only changes that alter how the tasks are laid out or picked up (frame range / frames per task and concurrent
+    tasks) need the job to be suspended first. Everything else (priority, group, comments, failure detection etc.)
+    is saved on the live job, so in-flight tasks keep rendering.
+
+    Example:
+        patch = JobPatch(job)
+        patch.set_field("JobPriority", 10).set_field("JobGroup", "251gb")
+        patch.apply()
+    """
+
+    # Job fields that need the job suspending before they can be changed safely.
+    suspend_required_fields = ["JobConcurrentTasks"]
+
+    def __init__(self, job):
+        self.job = job
+        self.field_changes = {}
+        self.plugin_info_changes = {}
+        self.extra_info_changes = {}
+        self.frames_per_task = None
+        self.machine_limit = None
+
+    def set_field(self, field_name, value):
+        """
+        Queue a change to a job property, e.g. "JobPriority". Skipped if the job already has that value.
+        """
+        if getattr(self.job, field_name) != value:
+            self.field_changes[field_name] = value
+        return self
+
+    def append_comment(self, comment):
+        """
+        Queue a comment to be appended to the job comment. Skipped if the job comment already contains it, so
+        repeated errors don't keep growing the comment.
+        """
+        existing_job_comment = self.field_changes.get("JobComment", self.job.JobComment)
+        if comment not in existing_job_comment:
+            self.field_changes["JobComment"] = "{} -- {}".format(existing_job_comment, comment)
+        return self
+
+    def set_plugin_info(self, key, value):
+        """
+        Queue a change to a job plugin info key, e.g. "ContinueOnError". Skipped if it's already set to that value.
+        """
+        if self.job.GetJobPluginInfoKeyValue(key) != value:
+            self.plugin_info_changes[key] = value
+        return self
+
+    def set_extra_info_key_value(self, key, value):
+        """
+        Queue a change to a job extra info key, e.g. "AdaptiveTaskTimeoutSeconds". Skipped if it's already set to that
+        value.
+        """
+        if self.job.GetJobExtraInfoKeyValue(key) != value:
+            self.extra_info_changes[key] = value
+        return self
+
+    def set_frames_per_task(self, frames_per_task):
+        """
+        Queue a change to the frames per task. This re-creates the job's tasks, so it needs a suspend.
+        """
+        if self.job.JobFramesPerTask != frames_per_task:
+            self.frames_per_task = frames_per_task
+        return self
+
+    def set_machine_limit(self, machine_limit):
+        """
+        Queue a change to the machine limit. This is set after the save, as it doesn't need the job saving.
+        """
+        if self.job.JobMachineLimit != machine_limit:
+            self.machine_limit = machine_limit
+        return self
+
+    @property
+    def suspend_required(self):
+        if self.frames_per_task is not None:
+            return True
+        return any(field_name in self.field_changes for field_name in self.suspend_required_fields)
+
+    @property
+    def changes(self):
+        """
+        Returns:
+            dict: The changes the patch makes, as the {job field: value} bulk_patch_jobs() takes, e.g.
+            {"JobPriority": 10, "JobExtraInfoKeyValues": {"AdaptiveTaskTimeoutSeconds": "3600"}}.
+        """
+        changes = dict(self.field_changes)
+        if self.plugin_info_changes:
+            changes["JobPluginInfoKeyValues"] = dict(self.plugin_info_changes)
+        if self.extra_info_changes:
+            changes["JobExtraInfoKeyValues"] = dict(self.extra_info_changes)
+        if self.frames_per_task is not None:
+            changes["JobFramesPerTask"] = self.frames_per_task
+        if self.machine_limit is not None:
+            changes["JobMachineLimit"] = self.machine_limit
+        return changes
+
+    @property
+    def has_changes(self):
+        return bool(self.field_changes or self.plugin_info_changes or self.extra_info_changes
+                    or self.frames_per_task is not None or self.machine_limit is not None)
+
+    def apply(self):
+        """
+        Apply all the queued changes to the job, suspending it only if one of the changes needs it.
+
+        Returns:
+            bool: True if anything was changed on the job.
+        """
+        if not self.has_changes:
+            print("# The job '{}' already has the requested values, nothing to change.".format(self.job.JobId))
+            return False
+
+        # Only suspend if we need to, and never resume a job that was already suspended before we got to it.
+        suspended_by_patch = False
+        if self.suspend_required and self.job.JobStatus != "Suspended":
+            print("# Suspending the job as the frame range or concurrent tasks are being changed.")
+            RepositoryUtils.SuspendJob(self.job)
+            suspended_by_patch = True
+
+        for field_name, value in self.field_changes.items():
+            print("# Setting {} to: {}".format(field_name, value))
+            setattr(self.job, field_name, value)
+
+        for key, value in self.plugin_info_changes.items():
+            print("# Setting the plugin info key {} to: {}".format(key, value))
+            self.job.SetJobPluginInfoKeyValue(key, value)
+
+        for key, value in self.extra_info_changes.items():
+            print("# Setting the extra info key {} to: {}".format(key, value))
+            self.job.SetJobExtraInfoKeyValue(key, value)
+
+        if self.frames_per_task is not None:
+            print("# Setting frames per task to: {}".format(self.frames_per_task))
+            RepositoryUtils.SetJobFrameRange(self.job, self.job.JobFrames, self.frames_per_task)
+
+        # Save the job once with all the changes above.
+        if self.field_changes or self.plugin_info_changes or self.extra_info_changes:
+            RepositoryUtils.SaveJob(self.job)
+
+        # This is after the save job as with the changes above we are using a cached version of the job to make
+        # changes to, then saving it. Doing it after the save updates the machine limit in the monitor live, as it
+        # doesnt need to be saved.
+        if self.machine_limit is not None:
+            print("# Setting machine limit to: {}".format(self.machine_limit))
+            RepositoryUtils.SetMachineLimitMaximum(self.job.JobId, self.machine_limit)
+
+        if suspended_by_patch:
+            RepositoryUtils.ResumeJob(self.job)
+
+        return True
+
+
+class BulkPatchReport:
+    """
+    What bulk_patch_jobs() did, and how long it took.
+    """
+
+    def __init__(self):
+        self.jobs_checked = 0
+        # Jobs the desired state didn't apply to, or that already had it.
+        self.jobs_skipped = 0
+        self.jobs_written = 0
+        # {job ID: the fields that were changed, see JobPatch.changes} for the jobs that were written.
+        self.written_fields = {}
+        # Jobs we didn't write as someone else held the lease on them.
+        self.jobs_leased = 0
+        self.jobs_failed = 0
+        self.seconds = 0
+
+    def __str__(self):
+        return "Wrote {} of {} jobs in {:.3f} seconds. Skipped {} already up to date, {} leased, {} failed.".format(
+            self.jobs_written,
+            self.jobs_checked,
+            self.seconds,
+            self.jobs_skipped,
+            self.jobs_leased,
+            self.jobs_failed
+        )
+
+
+def build_job_patch(job, fields):
+    """
+    Returns a JobPatch of the fields for the job, see bulk_patch_jobs().
+    """
+    patch = JobPatch(job)
+    for field_name, value in fields.items():
+        if field_name == "JobMachineLimit":
+            patch.set_machine_limit(value)
+        elif field_name == "JobFramesPerTask":
+            patch.set_frames_per_task(value)
+        elif field_name == "JobExtraInfoKeyValues":
+            for key, key_value in value.items():
+                patch.set_extra_info_key_value(key, key_value)
+        elif field_name == "JobPluginInfoKeyValues":
+            for key, key_value in value.items():
+                patch.set_plugin_info(key, key_value)
+        else:
+            patch.set_field(field_name, value)
+    return patch
+
+
+def bulk_patch_jobs(jobs, desired_state, lease_store=None, max_workers=8, lease_seconds=120, refetch=True):
+    """
+    Bring a list of jobs to a desired state, only writing the jobs that differ from it.
+
+    desired_state is called for each job and returns the {job field: value} the job should have, or None to leave the
+    job alone. Use "JobMachineLimit" for the machine limit, it's set with SetMachineLimitMaximum like JobPatch does,
+    "JobFramesPerTask" for the frames per task, which is set with SetJobFrameRange and suspends the job while it is,
+    and "JobExtraInfoKeyValues" / "JobPluginInfoKeyValues" for a {key: value} dict of job extra info / plugin info keys.
+    The fields are compared with the job first, so a job that already has them costs no repository writes. The jobs
+    that differ are written by a bounded pool of threads, as each write is independent. desired_state is called from
+    those threads too, so it mustn't use anything tied to the calling thread, e.g. a SQLite connection.
+
+    The jobs passed in are usually a snapshot, e.g. from GetJobsInState, and SaveJob writes the whole job. So each job
+    that differs is fetched again once its lease is held, and desired_state is checked against that, so the save
+    doesn't put back anything another event or a wrangler changed since the snapshot was taken.
+
+    Example:
+        bulk_patch_jobs(jobs, lambda job: {"JobGroup": "251gb"} if job.JobPlugin == "Arnold" else None)
+
+    Args:
+        jobs: list: The jobs to check.
+        desired_state: function: Returns the fields to set on a job, or None.
+        lease_store: u_FarmStateStore.JobLeaseStore: Option to take the lease on each job before writing it. Jobs
+        someone else holds the lease on are left alone, rather than waiting on them.
+        max_workers: int: The most jobs to write at the same time.
+        lease_seconds: int: How long the leases last if they aren't renewed. They're renewed while a job is written.
+        refetch: bool: Fetch each job again just before writing it. Only turn this off for jobs that were just fetched.
+    Returns:
+        report: BulkPatchReport
+    """
+    start_time = time.time()
+    report = BulkPatchReport()
+    futures = []
+
+    def patch_job(patch):
+        """
+        Returns the changes that were written, or None if the job didn't need writing after all.
+        """
+        if refetch:
+            job = RepositoryUtils.GetJob(patch.job.JobId, True)
+            # It's been deleted since the snapshot.
+            if job is None:
+                return None
+            fields = desired_state(job)
+            if not fields:
+                return None
+            patch = build_job_patch(job, fields)
+        changes = patch.changes
+        return changes if patch.apply() else None
+
+    def write_job(patch):
+        """
+        Returns:
+            (string, dict): "written", "skipped" or "leased", and the changes that were written.
+        """
+        if lease_store is None:
+            changes = patch_job(patch)
+            return ("written" if changes else "skipped"), changes
+        # The lease is taken right before the job is fetched again, and held until it's written.
+        with u_FarmStateStore.job_lease(patch.job.JobId,
+                                        lease_seconds=lease_seconds,
+                                        wait_seconds=0,
+                                        lease_store=lease_store
+                                        ) as lease_acquired:
+            if not lease_acquired:
+                return "leased", None
+            changes = patch_job(patch)
+            return ("written" if changes else "skipped"), changes
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for job in jobs:
+            report.jobs_checked += 1
+            fields = desired_state(job)
+            if not fields:
+                report.jobs_skipped += 1
+                continue
+            patch = build_job_patch(job, fields)
+            if not patch.has_changes:
+                report.jobs_skipped += 1
+                continue
+            futures.append((job.JobId, executor.submit(write_job, patch)))
+        for job_id, future in futures:
+            try:
+                result, changes = future.result()
+            except Exception as error:
+                print("# Failed to write a job: {}".format(error))
+                report.jobs_failed += 1
+                continue
+            if result == "written":
+                report.jobs_written += 1
+                report.written_fields[job_id] = changes
+            elif result == "leased":
+                report.jobs_leased += 1
+            else:
+                report.jobs_skipped += 1
+    report.seconds = time.time() - start_time
+    print("# {}".format(report))
+    return report
@@ -0,0 +1,141 @@
+#! /usr/bin/python
+"""
+
+Login Probe:
+
+Finds out who is logged in to a list of machines, by running "who" on them through Deadline.
+Used by CheckLoggedInUsers and RestartHolidayUsers.
+
+The enabled state of every machine comes from one bulk fetch (the u_DeadlineToolbox worker inventory), instead of a
+GetSlaveSettings call per machine. The enabled machines are then probed concurrently through a
+u_RemoteCommandExecutor, with a timeout per machine, so a dead host costs the timeout once rather than holding up every
+machine after it. The "who" output is parsed into LoginSessions, and the results are cached for a short TTL so the
+tools in the same process can reuse them. The TTL can be set with the U_LOGIN_PROBE_TTL_SECONDS environment variable.
+
+A machine that doesn't answer isn't the same as one no one is logged in to, so the machines the last probe couldn't
+reach are kept in last_failures for the tools to report.
+
+Example:
+    logged_in_machines = u_LoginProbe.login_probe.get_logged_in_machines(machines)
+    for machine, sessions in logged_in_machines.items():
+        ...
+    for machine, error in u_LoginProbe.login_probe.last_failures.items():
+        ...
+
+"""
+
+import os
+import re
+import time
+from collections import namedtuple
+from Deadline.Scripting import *
+from scripts.General.u_DeadlineToolbox import u_DeadlineToolbox
+from scripts.General.u_RemoteCommandExecutor import u_RemoteCommandExecutor
+
+# One line of "who" output, e.g. "jbloggs  :0           2024-03-01 09:12 (:0)".
+LoginSession = namedtuple("LoginSession", ["user", "terminal", "login_time", "host"])
+
+# Matches both the ISO ("2024-03-01 09:12") and the older ("Mar  1 09:12") time formats of "who".
+who_line_pattern = re.compile(r"^(?P<user>\S+)\s+(?P<terminal>\S+)\s+"
+                              r"(?P<login_time>\d{4}-\d{2}-\d{2} \d{2}:\d{2}|[A-Z][a-z]{2}\s+\d{1,2} \d{2}:\d{2})"
+                              r"(?:\s+\((?P<host>[^)]*)\))?")
+
+
+def parse_who_output(output):
+    """
+    Parse the output of "who" into a list of LoginSessions. Any other lines, e.g. the exit code line Deadline adds,
+    are ignored.
+
+    Args:
+        output: string: The output of "Execute who".
+    Returns:
+        sessions: list: LoginSession for each logged-in session. Empty if no one is logged in.
+    """
+    sessions = []
+    for line in str(output).splitlines():
+        match = who_line_pattern.match(line.strip())
+        if match:
+            sessions.append(LoginSession(match.group("user"),
+                                         match.group("terminal"),
+                                         match.group("login_time"),
+                                         match.group("host") or ""
+                                         ))
+    return sessions
+
+
+class LoginProbe:
+
+    def __init__(self, ttl_seconds=None, timeout_seconds=15, max_workers=32):
+        """
+        Args:
+            ttl_seconds: int: How long a machine's probe result is reused for.
+            timeout_seconds: int: How long to wait for each machine to answer.
+            max_workers: int: The most machines to probe at the same time.
+        """
+        self.ttl_seconds = ttl_seconds or int(os.environ.get("U_LOGIN_PROBE_TTL_SECONDS", 120))
+        # A dead host isn't retried, it just doesn't get a result this time.
+        self.executor = u_RemoteCommandExecutor.RemoteCommandExecutor(
+            max_workers=max_workers,
+            timeout_seconds=timeout_seconds,
+            retries=0,
+            send_function=lambda machine, command: SlaveUtils.SendRemoteCommandWithResults(machine, command)
+        )
+        # {machine: (time probed, list of LoginSessions)}
+        self.cached_sessions = {}
+        # {machine: the error}, for the machines the last probe couldn't reach.
+        self.last_failures = {}
+
+    def probe(self, machines, max_age_seconds=None):
+        """
+        Get the login sessions on a list of machines. Machines that are disabled or not on Deadline aren't probed.
+
+        Args:
+            machines: list: The machine names, e.g. from Shotgrid.
+            max_age_seconds: int: Option to override the TTL, e.g. 0 to always probe.
+        Returns:
+            dict: {machine: list of LoginSessions}. Machines that didn't answer in time are left out, and listed in
+            last_failures instead.
+        """
+        if max_age_seconds is None:
+            max_age_seconds = self.ttl_seconds
+        start_time = time.time()
+        inventory = u_DeadlineToolbox.worker_inventory
+        inventory.refresh_if_stale()
+        machine_sessions = {}
+        machines_to_probe = []
+        for machine in machines:
+            worker_settings = inventory.worker_settings.get(machine.lower())
+            # We only want to get the machines that aren't disabled for some reason in deadline
+            if worker_settings is None or not worker_settings.SlaveEnabled:
+                continue
+            cached = self.cached_sessions.get(machine)
+            if cached is not None and time.time() - cached[0] <= max_age_seconds:
+                machine_sessions[machine] = cached[1]
+            else:
+                machines_to_probe.append(machine)
+
+        report = self.executor.send(machines_to_probe, "Execute who")
+        self.last_failures = dict(report.failures)
+        for machine, output in report.results.items():
+            sessions = parse_who_output(output)
+            self.cached_sessions[machine] = (time.time(), sessions)
+            machine_sessions[machine] = sessions
+        print("# Probed {} machines and reused {} cached results in {:.3f} seconds, {} didn't answer.".format(
+            len(machines_to_probe),
+            len(machine_sessions) - len(report.results),
+            time.time() - start_time,
+            len(report.failures)
+        ))
+        return machine_sessions
+
+    def get_logged_in_machines(self, machines, max_age_seconds=None):
+        """
+        Returns:
+            dict: {machine: list of LoginSessions}, only for the machines someone is logged in to.
+        """
+        return dict((machine, sessions) for machine, sessions in self.probe(machines, max_age_seconds).items()
+                    if sessions)
+
+
+# The probe shared by everything in this process, so its cached results are reused.
+login_probe = LoginProbe()
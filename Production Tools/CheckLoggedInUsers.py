@@ -17,6 +17,7 @@ from Deadline.Scripting import *
 from System.Collections.Specialized import *
 from utilities import emailutils
 from scripts.General.u_DeadlineToolbox import u_DeadlineToolbox
+from scripts.General.u_LoginProbe import u_LoginProbe
 import csv
 
 # setup the union environment so we have access to our repositories, env vars are set, etc.
@@ -60,21 +61,23 @@ def __main__(*args):
     # Set up a list to put machines that are still logged in, in
     user_machines_logged_in = []
 
+    # Run "who" on all the enabled machines at once. Only the machines someone is logged in to are returned.
+    all_machines = [machine for info in user_machine_dict.values() for machine in info["Machines"]]
+    logged_in_machines = u_LoginProbe.login_probe.get_logged_in_machines(all_machines)
+    # The machines that didn't answer, we can't tell if anyone is logged in to them.
+    unreachable_machines = u_LoginProbe.login_probe.last_failures
+    human_readable_unreachable_list = ""
+
     for name, info in user_machine_dict.items():
         machines = info["Machines"]
         for machine in machines:
-            slave_settings = RepositoryUtils.GetSlaveSettings(machine, True)
-            slave_enabled = slave_settings.SlaveEnabled
-            # We only want to get the machines that aren't disabled for some reason in deadline
-            if slave_enabled:
-                logged_in = SlaveUtils.SendRemoteCommandWithResults(machine, "Execute who")
-                # Check if new line is in the output. This is because if there is no one logged in, the output is only
-                # one line stating that the script ran with exit code 0
-                if "\n" in logged_in:
-                    # Add that machine and user to the list of dictionaries
-                    user_machines_logged_in.append({'User': name, 'Machine Name': machine})
-                    # Format this as human readable for prod etc.
-                    human_readable_machine_list += "{} : {}\n".format(name, machine)
+            if machine in logged_in_machines:
+                # Add that machine and user to the list of dictionaries
+                user_machines_logged_in.append({'User': name, 'Machine Name': machine})
+                # Format this as human readable for prod etc.
+                human_readable_machine_list += "{} : {}\n".format(name, machine)
+            elif machine in unreachable_machines:
+                human_readable_unreachable_list += "{} : {}\n".format(name, machine)
 
     # --------------------------------Set up a log to keep track of these users over time.-----------------------------
     # Get London time as we set all of our automation using that at the moment
@@ -106,6 +109,9 @@ def __main__(*args):
                "available on the farm."
                "\n\nHere are the logged in users and their machines:"
                "\n{}".format(len(user_machines_logged_in), current_time, human_readable_machine_list)]
+    if human_readable_unreachable_list:
+        message[0] += ("\nThese machines were unreachable, so we couldn't check if anyone was logged in:"
+                       "\n{}".format(human_readable_unreachable_list))
     email_list = ["operations@unionvfx.com", "resource@unionvfx.com", "wrangler@unionvfx.com"]
     sender_address = "wrangler@unionvfx.com"
     # Send the email
@@ -5,6 +5,11 @@ This script gets all the CG jobs on the farm, gathers usable info from them and
 This helps the evening wrangler with scheduling heavy jobs.
 The logs are saved here: /Volumes/resources/pipeline/logs/deadline/render_planner_exports
 Depending on which site this is run at, it will get the CG jobs for that site
+The task render times come from the totals kept by the u_TaskTimeAggregation event, so this is cheap to run on demand.
+Jobs with no completed frames have their frame time estimated by the u_FrameTimeEstimator model.
+It also plans the overnight render with the u_RenderScheduleOptimizer and writes the plan next to the report. The plan
+is only applied to the jobs (priorities and machine limits) if the U_RENDER_PLAN_APPLY environment variable is "1".
+Priorities a wrangler raised by hand are never lowered, and those jobs are left without a machine limit.
 
 """
 
@@ -14,6 +19,11 @@ import os
 import copy
 import socket
 from scripts.General.u_DeadlineToolbox import u_DeadlineToolbox
+from scripts.General.u_FarmStateStore import u_FarmStateStore
+from scripts.General.u_FrameTimeEstimator import u_FrameTimeEstimator
+from scripts.General.u_JobPatch import u_JobPatch
+from scripts.General.u_RenderScheduleOptimizer import u_RenderScheduleOptimizer
+from scripts.General.u_RenderCapacity import u_RenderCapacity
 from Deadline.Scripting import *
 # setup the union environment so we have access to our repositories, env vars are set, etc.
 from scripts.General import u_environment_utils
@@ -25,8 +35,9 @@ from utilities import emailutils
 # Set up a class to put all the re-used data into
 # This then processes the data once it has been gathered
 class RenderPlannerJob:
-    def __init__(self, batch_name, job_name, user, show, job_plugin, job_group, no_of_frames, completed_frames,
-                 task_render_times_in_secs_list, job_priority_number):
+    def __init__(self, job_id, batch_name, job_name, user, show, job_plugin, job_group, no_of_frames, completed_frames,
+                 total_task_render_secs, job_priority_number, frame_time_estimate, hand_set_priority=False):
+        self.job_id = job_id
         self.batch_name = batch_name
         self.job_name = job_name
         self.user = user
@@ -36,25 +47,20 @@ class RenderPlannerJob:
         self.no_of_frames = float(no_of_frames)
         self.completed_frames = float(completed_frames)
         self.frames_remaining = self.no_of_frames - self.completed_frames
-        self.task_render_times_in_secs_list = task_render_times_in_secs_list
+        self.total_task_render_secs = total_task_render_secs
         self.percentage_complete_int = 0
         self.average_job_task_time_in_mins = 0
         self.total_job_render_mins = 0
         self.remaining_render_mins = 0
         self.total_est_job_render_mins = 0
-        self.avg_est_frame_render_time = 0
         self.job_priority_number = job_priority_number
+        # The priority was raised by a wrangler, so the render plan mustn't lower it.
+        self.hand_set_priority = hand_set_priority
 
-        # Set up averages for estimating frame render times once class is instantiated
-        if self.job_plugin == "Houdini":
-            if self.job_group == "sims":
-                self.avg_est_frame_render_time = 120
-            else:
-                self.avg_est_frame_render_time = 5
-        elif self.job_plugin in ["Arnold", "Mantra"]:
-            self.avg_est_frame_render_time = 20
-        elif self.job_plugin == "MayaCmd":
-            self.avg_est_frame_render_time = 5
+        # The estimated frame render time for if the job has no completed frames, from jobs like it that have
+        # rendered before. If there weren't enough of them, it's flagged as low confidence.
+        self.avg_est_frame_render_time = frame_time_estimate.minutes
+        self.low_confidence_estimate = frame_time_estimate.low_confidence
 
     def process_job_data(self):
 
@@ -62,7 +68,7 @@ class RenderPlannerJob:
         if self.completed_frames:
             self.percentage_complete_int = int((100 * (self.completed_frames / self.no_of_frames)))
             self.average_job_task_time_in_mins = int(
-                (sum(self.task_render_times_in_secs_list) / self.completed_frames) / 60)
+                (self.total_task_render_secs / self.completed_frames) / 60)
             self.total_job_render_mins = int(self.average_job_task_time_in_mins * self.no_of_frames)
             self.remaining_render_mins = int(self.frames_remaining * self.average_job_task_time_in_mins)
 
@@ -86,18 +92,11 @@ class RenderPlannerExporter:
         self.frame_estimates_used = False
         # ... and to total est render mins
         self.sum_total_est_render_mins = 0
-        # Set up daily budget based on day of the week
-        self.render_budget = 0
-        self.render_limit = 0
-        self.day_of_week = datetime.now().today().weekday()
-        # If it is friday, the budget is set using the render mins calculated for over the weekend, otherwise, use the
-        # weekday budget
-        if self.day_of_week == 4:
-            self.render_budget = 355020
-            self.render_limit = 250000
-        else:
-            self.render_budget = 75660
-            self.render_limit = 50000
+        # Set up the budget from the workers that will be on the farm until the next work day's morning. This covers
+        # weekends and bank holidays, and the machines that are disabled, see u_RenderCapacity.
+        self.capacity = u_RenderCapacity.get_capacity(site)
+        self.render_budget = self.capacity["render_budget"]
+        self.render_limit = self.capacity["render_limit"]
 
         # Set up a template dict to reference later on
         self.template_job_dict = {
@@ -110,7 +109,12 @@ class RenderPlannerExporter:
             "est_remaining_render_mins": 0,
             "percentage_complete_list": [],
             "avg_percentage_complete": None,
-            "frame_estimates_used": ""
+            "frame_estimates_used": "",
+            "low_confidence_estimate": False,
+            "job_priority_number": 0,
+            # {job ID: {"group", "priority", "hand_set_priority", "remaining_render_mins", "frames_remaining"}}, for
+            # planning the batch per group and splitting the planned machine limit between its jobs.
+            "jobs": {}
         }
         # Set up empty dicts we can put data into
         self.dict_of_unique_jobs = {}
@@ -126,6 +130,11 @@ class RenderPlannerExporter:
         cg_renderers = ["Mantra", "Arnold", "MayaCmd", "Houdini"]
         arnold_limit = "arnold license limit"
         all_active_pending_jobs = RepositoryUtils.GetJobsInState(job_states)
+        self.all_active_pending_jobs = all_active_pending_jobs
+        # The task render time totals kept by the u_TaskTimeAggregation event, so we don't need to get every task.
+        self.recorded_task_times = u_FarmStateStore.TaskTimeStore().get_jobs()
+        # The frame time model, retrained every day by the u_TaskTimeAggregation event.
+        self.frame_time_estimator = u_FrameTimeEstimator.FrameTimeEstimator.load()
 
         # For every found job, gather, process and put the data into the dict_of_unique_jobs
         for job in all_active_pending_jobs:
@@ -154,23 +163,27 @@ class RenderPlannerExporter:
 
     def gather_job_data(self, job):
 
-        # Get the job stats
-        job_task_collection = RepositoryUtils.GetJobTasks(job, True)
-        job_task_collection_tasks = job_task_collection.TaskCollectionTasks
-
         # Get frame details
         no_of_frames = job.JobTaskCount
+        # The live completed count, the recorded totals can be up to a house cleaning behind.
         completed_frames = job.JobCompletedTasks
-        task_render_times_in_secs_list = []
-        for task in job_task_collection_tasks:
-            if task.TaskStatus == "Completed":
-                task_render_time = task.TaskRenderTime
-                task_render_time_in_secs = int(task_render_time.TotalSeconds)
-                if task_render_time_in_secs != 0:
-                    task_render_times_in_secs_list.append(task_render_time_in_secs)
+        total_task_render_secs = 0
+        recorded_task_times = self.recorded_task_times.get(job.JobId)
+        if recorded_task_times is not None and recorded_task_times["timed_tasks"]:
+            # Use the average task time from the last house cleaning for all the completed frames.
+            average_task_secs = recorded_task_times["render_seconds"] / float(recorded_task_times["timed_tasks"])
+            total_task_render_secs = average_task_secs * completed_frames
+        elif completed_frames:
+            # The job hasn't been recorded yet (e.g. it was only just submitted, or the store isn't there off the
+            # pulse), so get its tasks. This is slow, so say when it happens.
+            print("# No recorded task times for '{}', getting its tasks instead.".format(job.JobId))
+            for task in RepositoryUtils.GetJobTasks(job, True).TaskCollectionTasks:
+                if task.TaskStatus == "Completed":
+                    total_task_render_secs += int(task.TaskRenderTime.TotalSeconds)
 
         # put all the gathered data into a variable to pass into the dict updater
         render_planner_job = RenderPlannerJob(
+            job_id=job.JobId,
             batch_name=job.JobBatchName,
             job_name=job.JobName,
             user=job.JobUserName,
@@ -179,11 +192,29 @@ class RenderPlannerExporter:
             job_group=job.JobGroup,
             no_of_frames=no_of_frames,
             completed_frames=completed_frames,
-            task_render_times_in_secs_list=task_render_times_in_secs_list,
-            job_priority_number=job.JobPriority
+            total_task_render_secs=total_task_render_secs,
+            job_priority_number=job.JobPriority,
+            hand_set_priority=self.is_hand_set_priority(job),
+            # The planner's frames are the job's tasks.
+            frame_time_estimate=self.frame_time_estimator.estimate_task(job.JobPlugin,
+                                                                        frames_per_task=job.JobFramesPerTask,
+                                                                        show=job.JobPool,
+                                                                        group=job.JobGroup,
+                                                                        batch_name=job.JobBatchName
+                                                                        )
         )
         return render_planner_job
 
+    @staticmethod
+    def is_hand_set_priority(job):
+        """
+        Returns True if the job's priority was raised by hand. Automation that raises priorities above the planned
+        range flags the job in JobExtraInfo9 (see the Farm Notification System), so anything else up there was a
+        wrangler.
+        """
+        return (job.JobPriority > u_RenderScheduleOptimizer.planned_priority_range[0]
+                and job.JobExtraInfo9 != "Automatic raised priority job")
+
     def update_dictionary(self, render_planner_job):
         # Check for the batch name in the dict
         # If it isn't, create a DEEPCOPY of the dict. this KEEPS data already in the dict instead of overwriting it
@@ -203,7 +234,8 @@ class RenderPlannerExporter:
 
         # Update the job data with all the data we've collected
         job_data["job_name"] = job_name
-        job_data["job_priority_number"] = render_planner_job.job_priority_number
+        # The batch's highest priority, not just its last job's.
+        job_data["job_priority_number"] = max(job_data["job_priority_number"], render_planner_job.job_priority_number)
         job_data["show"] = render_planner_job.show
         job_data["artist"] = render_planner_job.user
 
@@ -223,6 +255,9 @@ class RenderPlannerExporter:
             average_job_task_time_list = render_planner_job.avg_est_frame_render_time
             est_total_job_render_mins = render_planner_job.total_est_job_render_mins
             est_remaining_render_mins = render_planner_job.total_est_job_render_mins
+            # Flag the batch if any of its estimates weren't from enough similar jobs.
+            if render_planner_job.low_confidence_estimate:
+                job_data["low_confidence_estimate"] = True
         else:
             average_job_task_time_list = render_planner_job.average_job_task_time_in_mins
             est_total_job_render_mins = render_planner_job.total_job_render_mins
@@ -239,6 +274,12 @@ class RenderPlannerExporter:
         job_data["average_batch_task_time"] = int(average_batch_task_time_in_mins)
         job_data["est_total_job_render_mins"] += est_total_job_render_mins
         job_data["est_remaining_render_mins"] += est_remaining_render_mins
+        job_data["jobs"][render_planner_job.job_id] = {"group": render_planner_job.job_group,
+                                                       "priority": render_planner_job.job_priority_number,
+                                                       "hand_set_priority": render_planner_job.hand_set_priority,
+                                                       "remaining_render_mins": est_remaining_render_mins,
+                                                       "frames_remaining": render_planner_job.frames_remaining
+                                                       }
         job_data["frame_estimates_used"] = self.frame_estimates_used
 
         # Here we put job_data into the dict
@@ -258,7 +299,8 @@ class RenderPlannerExporter:
                 "est_total_job_render_mins": self.dict_of_unique_jobs[dict_job_name]["est_total_job_render_mins"],
                 "est_remaining_render_mins": self.dict_of_unique_jobs[dict_job_name]["est_remaining_render_mins"],
                 "percentage_complete": self.dict_of_unique_jobs[dict_job_name]["avg_percentage_complete"],
-                "frame_estimates_used": self.dict_of_unique_jobs[dict_job_name]["frame_estimates_used"]
+                "frame_estimates_used": self.dict_of_unique_jobs[dict_job_name]["frame_estimates_used"],
+                "low_confidence_estimate": self.dict_of_unique_jobs[dict_job_name]["low_confidence_estimate"]
             }
             self.prod_readable_dict[dict_job_name] = prod_job_data
             # Sum the total of the est_remaining_render_mins so we can flag if the threshold for render planning
@@ -288,7 +330,8 @@ class RenderPlannerExporter:
                             "est_total_job_render_mins",
                             "est_remaining_render_mins",
                             "percentage_complete",
-                            "frame_estimates_used"
+                            "frame_estimates_used",
+                            "low_confidence_estimate"
                             ]
             writer = csv.DictWriter(csv_file,
                                     column_names
@@ -300,6 +343,78 @@ class RenderPlannerExporter:
 
         print("# Created new report here: {}".format(current_csv_path))
 
+    def plan_render(self):
+        """
+        Plan which batches can finish by 09:00 and write the plan next to the report. If U_RENDER_PLAN_APPLY is "1",
+        set the planned priorities and machine limits on the jobs too.
+
+        A batch whose jobs are in different groups is planned as one batch per group, as each part can only use its
+        own group's machines.
+        """
+        batches = []
+        # {planned batch name: {job ID: the job's plan data}}
+        planned_batch_jobs = {}
+        for batch_name, job_data in self.dict_of_unique_jobs.items():
+            group_jobs = {}
+            for job_id, job_plan_data in job_data["jobs"].items():
+                group_jobs.setdefault(job_plan_data["group"], {})[job_id] = job_plan_data
+            for group, jobs in sorted(group_jobs.items()):
+                planned_batch_name = batch_name if len(group_jobs) == 1 else "{} ({})".format(batch_name, group)
+                planned_batch_jobs[planned_batch_name] = jobs
+                batches.append(u_RenderScheduleOptimizer.ScheduleBatch(
+                    planned_batch_name,
+                    group,
+                    sum(job_plan_data["remaining_render_mins"] for job_plan_data in jobs.values()),
+                    sum(job_plan_data["frames_remaining"] for job_plan_data in jobs.values()),
+                    job_data["average_batch_task_time"],
+                    max(job_plan_data["priority"] for job_plan_data in jobs.values()),
+                    priority_locked=any(job_plan_data["hand_set_priority"] for job_plan_data in jobs.values())
+                ))
+        # The machines in each group for the whole window, from the worker minutes they have overnight.
+        window_minutes = self.capacity["window_minutes"]
+        group_worker_minutes = self.capacity["group_worker_minutes"]
+        group_workers = {}
+        for group in set(batch.group for batch in batches):
+            # Jobs without a group can render on any machine.
+            if group in ["", "none"]:
+                worker_minutes = self.render_budget
+            else:
+                worker_minutes = group_worker_minutes.get(group, 0)
+            group_workers[group] = worker_minutes / window_minutes if window_minutes else 0
+        plan = u_RenderScheduleOptimizer.optimize(batches, group_workers, window_minutes)
+
+        if not os.path.isdir(self.csv_file_path):
+            os.makedirs(self.csv_file_path)
+        u_RenderScheduleOptimizer.write_plan_csv(plan, os.path.join(self.csv_file_path,
+                                                                    "{}_render_plan.csv".format(self.current_day)))
+
+        if os.environ.get("U_RENDER_PLAN_APPLY", "0") != "1":
+            return plan
+        # {job ID: the fields to set}
+        job_fields = {}
+        for planned_batch in plan:
+            jobs = planned_batch_jobs[planned_batch.name]
+            batch_remaining_render_mins = sum(job_plan_data["remaining_render_mins"]
+                                              for job_plan_data in jobs.values()) or 1
+            for job_id, job_plan_data in jobs.items():
+                if job_plan_data["hand_set_priority"]:
+                    # Leave the wrangler's jobs alone, unless the plan raises them.
+                    if planned_batch.planned_priority > job_plan_data["priority"]:
+                        job_fields[job_id] = {"JobPriority": planned_batch.planned_priority}
+                    continue
+                machine_limit = 0
+                if planned_batch.machine_limit:
+                    # Split the batch's machines between its jobs by how much they have left to render.
+                    machine_limit = max(1, int(round(planned_batch.machine_limit
+                                                     * job_plan_data["remaining_render_mins"]
+                                                     / float(batch_remaining_render_mins))))
+                job_fields[job_id] = {"JobPriority": planned_batch.planned_priority,
+                                      "JobMachineLimit": machine_limit
+                                      }
+        jobs = [job for job in self.all_active_pending_jobs if job.JobId in job_fields]
+        u_JobPatch.bulk_patch_jobs(jobs, lambda job: job_fields[job.JobId])
+        return plan
+
     def send_email(self):
         if self.cg_export_site == "na_ne":
             email_site_name = "MTL"
@@ -339,7 +454,8 @@ class RenderPlannerExporter:
                        "the longer a job will take."
                        "\n\nOur 'budget' of render minutes for this evening / weekend is {}."
                        "\n\nIf the 'frame_estimates_used' is True, do not fully rely on the "
-                       "'est_remaining_render_mins'.".format(self.current_time,
+                       "'est_remaining_render_mins'. If 'low_confidence_estimate' is also True, the estimate was "
+                       "made from very few similar jobs.".format(self.current_time,
                                                              self.current_log_file_path,
                                                              self.render_budget
                                                              )
@@ -360,6 +476,8 @@ class RenderPlannerExporter:
     def run(self):
         # Put that info into a CSV file
         self.create_log()
+        # Plan the overnight render (only written to a CSV, unless U_RENDER_PLAN_APPLY is set)
+        self.plan_render()
         # Email prod ONLY if the file is run on cron.
         # This means we can run it manually throughout the day but only email people once.
         hostname = socket.gethostname()
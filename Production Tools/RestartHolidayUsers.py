@@ -16,6 +16,7 @@ import datetime
 from Deadline.Scripting import *
 from System.Collections.Specialized import *
 from scripts.General.u_DeadlineToolbox import u_DeadlineToolbox
+from scripts.General.u_LoginProbe import u_LoginProbe
 
 
 def __main__(*args):
@@ -58,6 +59,9 @@ def restart_holiday_users(*args, test=False):
                        fields)
     # Set up a dict of users who are on holiday AND didn't log out to print out.
     users_who_didnt_log_out = {}
+    workers_to_restart = []
+    # {user name: [their computers]}
+    user_computers = {}
     for user in bookings:
         name = user["user.HumanUser.name"]
         # we now use tags instead of another field on shotgrid.
@@ -65,7 +69,7 @@ def restart_holiday_users(*args, test=False):
         # We want to not restart user who are have the tag "AutomationExemption_Logoff"
         tags = user["user.HumanUser.tags"]
         if not any(tag["name"] == "AutomationExemption_Logoff" for tag in tags):
-            computer_name = []
+            computer_name = user_computers.setdefault(name, [])
             for computer in user["user.HumanUser.sg_computers_1"]:
                 # Ignore windows and kvm machines as they cant be used on the farm
                 exclusion_list = ["kvm", "win"]
@@ -73,27 +77,36 @@ def restart_holiday_users(*args, test=False):
                 if not any(excluded_string in computer["name"] for excluded_string in exclusion_list):
                     # Add the name of that user to the computer name list
                     computer_name.append(computer["name"])
-                    for worker in computer_name:
-                        # Check if that computer is enabled on the farm
-                        slave_settings = RepositoryUtils.GetSlaveSettings(worker, True)
-                        slave_enabled = slave_settings.SlaveEnabled
-                        # We only want to get the machines that aren't disabled in deadline
-                        if slave_enabled:
-                            # Run "who" on it to determine if anyone is logged in.
-                            logged_in = SlaveUtils.SendRemoteCommandWithResults(worker, "Execute who")
-                            # Check if new line is in the output. This is because if there is no one logged in,
-                            # the output is only one line stating that the script "ran with exit code 0"
-                            if "\n" in logged_in:
-                                # If there is someone logged in, restart their machine and add them to the dict to be printed.
-                                users_who_didnt_log_out[name] = worker
-                                if not test:
-                                    u_DeadlineToolbox.restart_after_task_completion(worker=worker)
-                                else:
-                                    print("This is a test, not restarting the machine.")
+
+    # Run "who" on all the computers at once to determine if anyone is logged in. Computers that are disabled in
+    # deadline aren't checked.
+    logged_in_machines = u_LoginProbe.login_probe.get_logged_in_machines(
+        [worker for computer_name in user_computers.values() for worker in computer_name]
+    )
+    # The computers that didn't answer, we can't tell if anyone is logged in to them.
+    unreachable_machines = u_LoginProbe.login_probe.last_failures
+    users_with_unreachable_machines = {}
+    for name, computer_name in user_computers.items():
+        for worker in computer_name:
+            if worker in unreachable_machines:
+                users_with_unreachable_machines[name] = worker
+            if worker in logged_in_machines:
+                # If there is someone logged in, restart their machine and add them to the dict to be printed.
+                users_who_didnt_log_out[name] = worker
+                workers_to_restart.append(worker)
 
     if users_who_didnt_log_out:
+        # Restart them all at once, so an unreachable machine doesn't hold up the rest.
+        if not test:
+            u_DeadlineToolbox.restart_after_task_completion(worker=workers_to_restart)
+        else:
+            print("This is a test, not restarting the machines.")
         print("Restarted these artist's machines: "
               "\n{}".format(users_who_didnt_log_out)
               )
     else:
         print("No users to restart.")
+    if users_with_unreachable_machines:
+        print("These artist's machines were unreachable, so they weren't checked: "
+              "\n{}".format(users_with_unreachable_machines)
+              )
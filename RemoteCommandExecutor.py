@@ -0,0 +1,160 @@
+#! /usr/bin/python
+"""
+
+Remote Command Executor:
+
+Sends a Deadline remote command (e.g. "LaunchSlave" or "OnLastTaskComplete RestartMachine") to many workers at once.
+For use in deadline scripting, by any cron or event that targets a list of workers.
+
+SlaveUtils.SendRemoteCommand blocks until the worker answers, so sending to each worker in turn takes the sum of all
+their response times, and one unreachable workstation stalls the whole cron. Here the commands are sent from a bounded
+pool of threads, each attempt has a timeout, and attempts that fail with an error are retried with a backoff. The time
+taken is roughly that of the slowest worker, and the workers that never answered are listed in the report.
+
+A timed out attempt may still reach the worker after we've stopped waiting for it, so timeouts aren't retried unless
+the command is safe to run twice (retry_on_timeout=True), e.g. "LaunchSlave". Retrying a timed out
+"OnLastTaskComplete RestartMachine" could restart a machine twice.
+
+Example:
+    report = RemoteCommandExecutor().send(worker_names, "LaunchSlave")
+    if report.failures:
+        ...
+
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from Deadline.Scripting import *
+except ImportError:
+    # Outside of Deadline, e.g. when trying it out with a fake send function.
+    SlaveUtils = None
+
+
+class RemoteCommandReport:
+    """
+    What RemoteCommandExecutor.send() did, and how long it took.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        # {worker name: the result of the command}
+        self.results = {}
+        # {worker name: the error of its last attempt}
+        self.failures = {}
+        self.attempts = 0
+        self.seconds = 0
+
+    def __str__(self):
+        summary = "Sent '{}' to {} of {} workers in {:.3f} seconds ({} attempts).".format(
+            self.command,
+            len(self.results),
+            len(self.results) + len(self.failures),
+            self.seconds,
+            self.attempts
+        )
+        for worker_name, error in sorted(self.failures.items()):
+            summary += "\n#   Failed on '{}': {}".format(worker_name, error)
+        return summary
+
+
+class RemoteCommandExecutor:
+
+    def __init__(self, max_workers=16, timeout_seconds=30, retries=2, backoff_seconds=2, send_function=None):
+        """
+        Args:
+            max_workers: int: The most workers to send the command to at the same time.
+            timeout_seconds: int: How long to wait for a worker to answer each attempt.
+            retries: int: How many more times to try a worker after its first attempt fails with an error.
+            backoff_seconds: int: How long to wait before the first retry, this doubles for each retry after.
+            send_function: function: Option to send the commands with something other than
+            SlaveUtils.SendRemoteCommand, e.g. SlaveUtils.SendRemoteCommandWithResults.
+        """
+        self.max_workers = max_workers
+        self.timeout_seconds = timeout_seconds
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.send_function = send_function
+        # The attempts are counted from several threads.
+        self.lock = threading.Lock()
+
+    def attempt(self, worker_name, command):
+        """
+        Send the command once, giving up on it after the timeout.
+
+        SendRemoteCommand can't be cancelled, so each attempt runs on its own daemon thread and is left behind if it
+        times out. That way a hung worker can't keep the cron from finishing.
+
+        Returns:
+            The result of the command.
+        Raises:
+            Exception: The error from the command, or a TimeoutError.
+        """
+        send_function = self.send_function or SlaveUtils.SendRemoteCommand
+        outcome = {}
+
+        def run():
+            try:
+                outcome["result"] = send_function(worker_name, command)
+            except Exception as error:
+                outcome["error"] = error
+
+        thread = threading.Thread(target=run, name="remote-command-{}".format(worker_name))
+        thread.daemon = True
+        thread.start()
+        thread.join(self.timeout_seconds)
+        if thread.is_alive():
+            raise TimeoutError("No answer after {} seconds.".format(self.timeout_seconds))
+        if "error" in outcome:
+            raise outcome["error"]
+        return outcome.get("result")
+
+    def send_with_retries(self, worker_name, command, report, retry_on_timeout=False):
+        backoff_seconds = self.backoff_seconds
+        for attempt_number in range(self.retries + 1):
+            with self.lock:
+                report.attempts += 1
+            try:
+                return True, self.attempt(worker_name, command)
+            except TimeoutError as error:
+                # The command may still be running on the worker, so only send it again if that's safe.
+                last_error = error
+                if not retry_on_timeout:
+                    break
+            except Exception as error:
+                last_error = error
+            if attempt_number < self.retries:
+                time.sleep(backoff_seconds)
+                backoff_seconds *= 2
+        return False, last_error
+
+    def send(self, worker_names, command, retry_on_timeout=False):
+        """
+        Send a remote command to a list of workers.
+
+        Args:
+            worker_names: list: The workers to send the command to.
+            command: string: The remote command, e.g. "LaunchSlave".
+            retry_on_timeout: bool: Also retry the workers that didn't answer in time. Only for commands that are safe
+            to run twice on a worker.
+        Returns:
+            report: RemoteCommandReport
+        """
+        start_time = time.time()
+        report = RemoteCommandReport(command)
+        worker_names = list(worker_names)
+        if worker_names:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(worker_names))) as executor:
+                outcomes = executor.map(lambda worker_name: self.send_with_retries(worker_name, command, report,
+                                                                                   retry_on_timeout),
+                                        worker_names)
+                for worker_name, (succeeded, value) in zip(worker_names, outcomes):
+                    if succeeded:
+                        report.results[worker_name] = value
+                    else:
+                        report.failures[worker_name] = value
+        report.seconds = time.time() - start_time
+        print("# {}".format(report))
+        return report
@@ -0,0 +1,202 @@
+#! /usr/bin/python
+"""
+
+Render Capacity:
+
+Works out the render minutes a site's farm really has overnight, instead of a fixed budget for weekdays and Fridays.
+Used by the render planner (ExportCGToCSV) for its render budget, and for the machines the u_RenderScheduleOptimizer
+plans with.
+
+The capacity is built from one bulk snapshot of the workers (the u_DeadlineToolbox worker inventory) and the cron
+schedule:
+    - Render nodes render from now until 09:00 on the next work day.
+    - Workstations render from when the evening cron adds them to the farm until the morning cron clears their pools.
+    - Disabled workers don't count, except for the ones the evening cron enables (see u_FarmStateReconciler), and the
+      ones the evening cron disables don't count either.
+    - Weekends and bank holidays are skipped over, so Friday evening runs until Monday (or Tuesday) morning.
+
+The result is worker minutes per group. It's cached in the local u_FarmStateStore for an hour, so running the render
+planner again during the evening doesn't rebuild it.
+
+Example:
+    capacity = get_capacity("eu_w")
+    print(capacity["render_budget"], capacity["group_worker_minutes"]["251gb"])
+
+"""
+
+import json
+import time
+from datetime import datetime, timedelta
+from Deadline.Scripting import *
+from scripts.General.u_DeadlineToolbox import u_DeadlineToolbox
+from scripts.General.u_FarmStateStore import u_FarmStateStore
+from scripts.General.Crons import u_FarmStateReconciler
+from workalendar.europe import UnitedKingdom
+from workalendar.america import Quebec
+
+# When each site's crons add the workstations to the farm and take them off it again, as (hour, minute) local time.
+# farm_state_window is the u_FarmStateReconciler window the workstations are added in, for the worker states it sets.
+site_schedules = {
+    "eu_w": {"calendar": UnitedKingdom,
+             "workstations_join": (19, 0),
+             "workstations_leave": (8, 30),
+             "farm_state_window": "1900"
+             },
+    "na_ne": {"calendar": Quebec,
+              "workstations_join": (18, 0),
+              "workstations_leave": (7, 30),
+              "farm_state_window": None
+              },
+}
+# The overnight render ends at this time on the next work day.
+morning_time = (9, 0)
+# The fraction of the budget we flag as a heavy night, as the old limits were (50,000 of 75,660 minutes).
+render_limit_fraction = 0.66
+# How long the capacity is reused for.
+capacity_cache_seconds = 3600
+
+
+def next_work_day_time(start, hour_minute, calendar):
+    """
+    Returns the first time after start that's at hour_minute on a working day of the calendar.
+    """
+    next_time = start.replace(hour=hour_minute[0], minute=hour_minute[1], second=0, microsecond=0)
+    if next_time <= start:
+        next_time += timedelta(days=1)
+    while not calendar.is_working_day(next_time.date()):
+        next_time += timedelta(days=1)
+    return next_time
+
+
+def previous_work_day_time(start, hour_minute, calendar):
+    """
+    Returns the last time at or before start that's at hour_minute on a working day of the calendar.
+    """
+    previous_time = start.replace(hour=hour_minute[0], minute=hour_minute[1], second=0, microsecond=0)
+    if previous_time > start:
+        previous_time -= timedelta(days=1)
+    while not calendar.is_working_day(previous_time.date()):
+        previous_time -= timedelta(days=1)
+    return previous_time
+
+
+def workstation_window(now, schedule, calendar):
+    """
+    Returns:
+        (datetime, datetime): When the workstations are on the farm from and until, for the current or next night.
+    """
+    previous_join = previous_work_day_time(now, schedule["workstations_join"], calendar)
+    previous_leave = next_work_day_time(previous_join, schedule["workstations_leave"], calendar)
+    # If they've already been added to the farm, they render from now.
+    if previous_leave > now:
+        return now, previous_leave
+    next_join = next_work_day_time(now, schedule["workstations_join"], calendar)
+    return next_join, next_work_day_time(next_join, schedule["workstations_leave"], calendar)
+
+
+def overnight_worker_states(site):
+    """
+    Returns:
+        dict: {worker name: True or False} for the workers the evening cron enables or disables.
+    """
+    window = site_schedules[site]["farm_state_window"]
+    window_state = u_FarmStateReconciler.farm_state_windows.get(site, {}).get(window, {})
+    worker_states = {}
+    for user_group, worker_state in window_state.get("user_group_workers_enabled", {}).items():
+        for user_name in RepositoryUtils.GetUserGroup(user_group):
+            for worker_name in u_DeadlineToolbox.worker_inventory.get_workers_for_user(user_name):
+                worker_states[worker_name] = worker_state
+    return worker_states
+
+
+def calculate_capacity(site, now=None):
+    """
+    Work out a site's overnight worker minutes per group.
+
+    Args:
+        site: string: "eu_w" or "na_ne".
+        now: datetime: Option to calculate it from a different time.
+    Returns:
+        dict: "group_worker_minutes": {group: worker minutes}, "window_minutes": minutes until the morning,
+        "workers": the workers counted, "render_budget": the total worker minutes, "render_limit": the minutes we flag
+        as a heavy night.
+    """
+    start_time = time.time()
+    now = now or datetime.now()
+    schedule = site_schedules[site]
+    calendar = schedule["calendar"]()
+    morning = next_work_day_time(now, morning_time, calendar)
+    workstations_join, workstations_leave = workstation_window(now, schedule, calendar)
+    render_node_minutes = (morning - now).total_seconds() / 60.0
+    workstation_minutes = max(0.0, (workstations_leave - workstations_join).total_seconds() / 60.0)
+
+    inventory = u_DeadlineToolbox.worker_inventory
+    render_nodes = set(inventory.get_workers_in_group(site + "_render_nodes"))
+    workstations = set(inventory.get_workers_in_group(site + "_workstations"))
+    overnight_states = overnight_worker_states(site)
+    group_worker_minutes = {}
+    total_worker_minutes = 0
+    worker_count = 0
+    for worker_name in render_nodes | workstations:
+        worker_settings = inventory.worker_settings.get(worker_name)
+        if worker_settings is None:
+            continue
+        if not overnight_states.get(worker_name, worker_settings.SlaveEnabled):
+            continue
+        worker_minutes = render_node_minutes if worker_name in render_nodes else workstation_minutes
+        worker_count += 1
+        total_worker_minutes += worker_minutes
+        for group_name in inventory.get_groups_for_worker(worker_name):
+            group_worker_minutes[group_name] = group_worker_minutes.get(group_name, 0) + worker_minutes
+
+    capacity = {"site": site,
+                "group_worker_minutes": group_worker_minutes,
+                "window_minutes": render_node_minutes,
+                "workers": worker_count,
+                "render_budget": int(total_worker_minutes),
+                "render_limit": int(total_worker_minutes * render_limit_fraction)
+                }
+    print("# Calculated {} render minutes from {} {} workers until {} in {:.3f} seconds.".format(
+        capacity["render_budget"],
+        worker_count,
+        site,
+        morning.strftime("%a %H:%M"),
+        time.time() - start_time
+    ))
+    return capacity
+
+
+def combine_capacities(capacities):
+    """
+    Add the capacities of several sites together, e.g. for the render planner's "all" site.
+    """
+    combined = {"site": "all", "group_worker_minutes": {}, "window_minutes": 0, "workers": 0, "render_budget": 0,
+                "render_limit": 0}
+    for capacity in capacities:
+        for group_name, worker_minutes in capacity["group_worker_minutes"].items():
+            combined["group_worker_minutes"][group_name] = combined["group_worker_minutes"].get(group_name, 0) \
+                                                           + worker_minutes
+        combined["window_minutes"] = max(combined["window_minutes"], capacity["window_minutes"])
+        for key in ["workers", "render_budget", "render_limit"]:
+            combined[key] += capacity[key]
+    return combined
+
+
+def get_capacity(site, idempotency_store=None):
+    """
+    Returns the site's capacity, see calculate_capacity(). It's cached for an hour in the local u_FarmStateStore.
+
+    Args:
+        site: string: "eu_w", "na_ne" or "all".
+        idempotency_store: u_FarmStateStore.IdempotencyStore: Option to use a different store.
+    """
+    if site == "all":
+        return combine_capacities([get_capacity(each_site, idempotency_store) for each_site in site_schedules])
+    idempotency_store = idempotency_store or u_FarmStateStore.IdempotencyStore()
+    cache_key = "render_capacity:{}".format(site)
+    cached_capacity = idempotency_store.get(cache_key)
+    if cached_capacity is not None:
+        return json.loads(cached_capacity)
+    capacity = calculate_capacity(site)
+    idempotency_store.check_and_set(cache_key, json.dumps(capacity), ttl_seconds=capacity_cache_seconds)
+    return capacity
@@ -0,0 +1,231 @@
+#! /usr/bin/python
+"""
+
+Render Schedule Optimizer:
+
+Plans the overnight render so as many CG batches as possible finish by 09:00, instead of the wrangler re-prioritising
+jobs by hand against the render budget. Used by the render planner (ExportCGToCSV).
+
+Each batch needs its remaining render minutes spread over the machines of its group before its deadline (09:00 by
+default), i.e. it needs remaining minutes / minutes until the deadline machines running the whole night. A batch can't
+use more machines than it has frames left, and can't finish if a single frame takes longer than the time left.
+The batches that fit are chosen per group by the fewest machines needed per unit of priority first, which finishes the
+most (and the most important) batches for the machines available. This is a greedy plan, so it takes milliseconds even
+for thousands of batches.
+
+The plan gives each batch:
+    - an order: the planned batches first, with the tightest deadlines first.
+    - a priority: planned batches get 50 down to 26 in that order, the rest are capped at 25. A batch with a priority
+      a wrangler raised by hand (priority_locked) is never lowered, it keeps its priority if that's higher.
+    - a machine limit: the machines a planned batch needs, with some headroom. The rest have no limit, so they can use
+      whatever machines are left over.
+
+Example:
+    batches = [ScheduleBatch("abc_010_lighting", "251gb", remaining_minutes=6000, frames_remaining=100,
+                             frame_minutes=60, priority=40)]
+    plan = optimize(batches, {"251gb": 80}, overnight_window_minutes())
+    write_plan_csv(plan, "/tmp/render_plan.csv")
+
+"""
+
+import csv
+import math
+import random
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+# What the plan needs to know about a batch. deadline_minutes is None to use the overnight window. priority_locked is
+# True if the priority was set by hand, so the plan mustn't lower it.
+ScheduleBatch = namedtuple("ScheduleBatch", ["name", "group", "remaining_minutes", "frames_remaining",
+                                             "frame_minutes", "priority", "deadline_minutes", "priority_locked"])
+ScheduleBatch.__new__.__defaults__ = (None, False)
+
+# The plan for one batch.
+PlannedBatch = namedtuple("PlannedBatch", ["name", "group", "order", "finishes_in_time", "machines_needed",
+                                           "current_priority", "planned_priority", "machine_limit",
+                                           "remaining_minutes"])
+
+# The priorities given to the planned batches, and the most the rest are left with. Above 50 is flagged by the Farm
+# Notification System, so we stay at or below it.
+planned_priority_range = (50, 26)
+unplanned_priority_cap = 25
+
+
+def planned_priority(batch, priority):
+    """
+    Returns the priority to give a batch, which is never lower than its own if that was set by hand.
+    """
+    if batch.priority_locked:
+        return max(priority, batch.priority)
+    return priority
+
+
+def overnight_window_minutes(now=None, morning_hour=9):
+    """
+    Returns the minutes from now until 09:00 on the next work day, e.g. Monday morning from a Friday evening.
+    """
+    now = now or datetime.now()
+    morning = now.replace(hour=morning_hour, minute=0, second=0, microsecond=0)
+    if morning <= now:
+        morning += timedelta(days=1)
+    # Skip Saturday (5) and Sunday (6).
+    while morning.weekday() >= 5:
+        morning += timedelta(days=1)
+    return (morning - now).total_seconds() / 60.0
+
+
+def machines_needed(batch, window_minutes):
+    """
+    Returns the machines the batch needs for the whole window to finish by its deadline, or None if it can't finish in
+    time however many machines it gets.
+    """
+    deadline_minutes = batch.deadline_minutes if batch.deadline_minutes is not None else window_minutes
+    if batch.remaining_minutes <= 0:
+        return 0
+    if deadline_minutes <= 0 or batch.frame_minutes > deadline_minutes:
+        return None
+    needed = batch.remaining_minutes / float(deadline_minutes)
+    # It can't use more machines than it has frames left.
+    if needed > batch.frames_remaining:
+        return None
+    return needed
+
+
+def optimize(batches, group_workers, window_minutes, machine_limit_headroom=1.1):
+    """
+    Plan which batches can finish in time with the machines in each group, and their order, priority and machine
+    limit.
+
+    Args:
+        batches: list: ScheduleBatch for each batch.
+        group_workers: dict: {group name: the machines available in it overnight}
+        window_minutes: float: The minutes until the default deadline, see overnight_window_minutes().
+        machine_limit_headroom: float: How many more machines than needed to give a planned batch, for frames that
+        take longer than the average.
+    Returns:
+        plan: list: PlannedBatch for each batch, in the planned order.
+    """
+    start_time = time.time()
+    batches_by_group = {}
+    for batch in batches:
+        batches_by_group.setdefault(batch.group, []).append(batch)
+
+    planned = []
+    unplanned = []
+    for group, group_batches in batches_by_group.items():
+        free_machines = group_workers.get(group, 0)
+        candidates = []
+        for batch in group_batches:
+            needed = machines_needed(batch, window_minutes)
+            if needed is None:
+                unplanned.append((batch, None))
+            else:
+                candidates.append((batch, needed))
+        # Fewest machines per unit of priority first, so the most and the most important batches fit.
+        candidates.sort(key=lambda candidate: (candidate[1] / max(candidate[0].priority, 1), candidate[0].name))
+        for batch, needed in candidates:
+            if needed <= free_machines:
+                free_machines -= needed
+                planned.append((batch, needed))
+            else:
+                unplanned.append((batch, needed))
+
+    # Tightest deadlines first, then the most machines needed, as those are the easiest to miss.
+    planned.sort(key=lambda planned_batch: (planned_batch[0].deadline_minutes if planned_batch[0].deadline_minutes
+                                            is not None else window_minutes, -planned_batch[1], planned_batch[0].name))
+    unplanned.sort(key=lambda unplanned_batch: (-unplanned_batch[0].priority, unplanned_batch[0].name))
+
+    plan = []
+    highest_priority, lowest_priority = planned_priority_range
+    for order, (batch, needed) in enumerate(planned):
+        plan.append(PlannedBatch(batch.name, batch.group, order, True, needed, batch.priority,
+                                 planned_priority(batch, max(highest_priority - order, lowest_priority)),
+                                 int(math.ceil(needed * machine_limit_headroom)),
+                                 batch.remaining_minutes
+                                 ))
+    for order, (batch, needed) in enumerate(unplanned, len(planned)):
+        plan.append(PlannedBatch(batch.name, batch.group, order, False, needed, batch.priority,
+                                 planned_priority(batch, min(batch.priority, unplanned_priority_cap)), 0,
+                                 batch.remaining_minutes))
+    print("# Planned {} of {} batches to finish in time in {:.3f} seconds.".format(len(planned),
+                                                                                  len(plan),
+                                                                                  time.time() - start_time
+                                                                                  ))
+    return plan
+
+
+def write_plan_csv(plan, csv_path):
+    """
+    Write the plan to a CSV, e.g. for a dry-run.
+    """
+    with open(csv_path, "w") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(PlannedBatch._fields)
+        for planned_batch in plan:
+            writer.writerow(planned_batch)
+    print("# Wrote the render plan here: {}".format(csv_path))
+
+
+def priority_order_baseline(batches, group_workers, window_minutes):
+    """
+    What re-prioritising by hand roughly does: give the machines to the highest priority batches first.
+
+    Returns:
+        int: How many batches finish in time.
+    """
+    free_machines = dict(group_workers)
+    finished = 0
+    for batch in sorted(batches, key=lambda batch: -batch.priority):
+        needed = machines_needed(batch, window_minutes)
+        if needed is not None and needed <= free_machines.get(batch.group, 0):
+            free_machines[batch.group] -= needed
+            finished += 1
+    return finished
+
+
+def synthetic_queue(batch_count=1000, seed=0):
+    """
+    Returns a made-up queue of batches and group sizes, shaped like a busy night on the farm.
+    """
+    random_generator = random.Random(seed)
+    groups = {"251gb": 120, "128up": 200, "split_machines": 300}
+    batches = []
+    for number in range(batch_count):
+        frames_remaining = random_generator.randint(10, 400)
+        frame_minutes = random_generator.lognormvariate(math.log(20), 0.8)
+        batches.append(ScheduleBatch("batch_{:04d}".format(number),
+                                     random_generator.choice(list(groups)),
+                                     frames_remaining * frame_minutes,
+                                     frames_remaining,
+                                     frame_minutes,
+                                     random_generator.choice([10, 20, 30, 40, 50]),
+                                     None
+                                     ))
+    return batches, groups
+
+
+def benchmark(batch_count=1000):
+    """
+    Compare the optimizer with giving machines out by priority, on a synthetic queue.
+
+    Returns:
+        dict: The batches finished in time by each, and how long the optimizer took.
+    """
+    batches, groups = synthetic_queue(batch_count)
+    window_minutes = 14 * 60
+    start_time = time.time()
+    plan = optimize(batches, groups, window_minutes)
+    optimizer_seconds = time.time() - start_time
+    results = {"batches": batch_count,
+               "optimizer_finished": sum(1 for planned_batch in plan if planned_batch.finishes_in_time),
+               "priority_order_finished": priority_order_baseline(batches, groups, window_minutes),
+               "optimizer_seconds": optimizer_seconds
+               }
+    print("# {batches} batches: {optimizer_finished} finish in time with the optimizer, {priority_order_finished} "
+          "giving machines out by priority. The optimizer took {optimizer_seconds:.3f} seconds.".format(**results))
+    return results
+
+
+if __name__ == "__main__":
+    benchmark()
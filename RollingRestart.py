@@ -0,0 +1,194 @@
+#! /usr/bin/python
+"""
+
+Rolling Restart:
+
+Restarts a list of workers a few at a time, waiting for each batch to come back before the next is sent the restart.
+Used by the u_RenderNodeRestart cron, through CronLibrary.restart_render_nodes().
+
+The workers are restarted with a u_RemoteCommandExecutor and their states are polled with one GetSlaveInfos call per
+poll. Both can be swapped for fakes, so the restart can be stepped through outside of Deadline.
+
+Example:
+    report = RollingRestart(max_down=5).run(worker_names)
+    if report.timed_out:
+        ...
+
+"""
+
+import time
+
+try:
+    from Deadline.Scripting import *
+    from scripts.General.u_FarmStateStore import u_FarmStateStore
+    from scripts.General.u_RemoteCommandExecutor import u_RemoteCommandExecutor
+except ImportError:
+    # Outside of Deadline, e.g. when trying it out with fake send and state functions.
+    RepositoryUtils = None
+
+
+def get_repository_worker_states(worker_names):
+    """
+    Returns:
+        dict: {worker name: its state, e.g. "Idle"}, from one repository call.
+    """
+    return dict((info.SlaveName, info.SlaveState) for info in RepositoryUtils.GetSlaveInfos(worker_names, True))
+
+
+class RollingRestartReport:
+    """
+    What RollingRestart.run() did, and how long it took.
+    """
+
+    def __init__(self):
+        self.restarted = []
+        # Workers we skipped as they were restarted recently.
+        self.skipped_recent = []
+        # Workers the restart couldn't be sent to.
+        self.failed = []
+        # Workers that were sent the restart but didn't come back in time. Their restart is still pending on them.
+        self.timed_out = []
+        # Workers we didn't get to before the rolling restart ran out of time.
+        self.not_restarted = []
+        self.seconds = 0
+
+    def __str__(self):
+        return ("Restarted {} workers in {:.0f} seconds. Skipped {} restarted recently, {} failed to send, "
+                "{} didn't come back in time, {} not reached.").format(len(self.restarted),
+                                                                       self.seconds,
+                                                                       len(self.skipped_recent),
+                                                                       len(self.failed),
+                                                                       len(self.timed_out),
+                                                                       len(self.not_restarted)
+                                                                       )
+
+
+class RollingRestart:
+    """
+    Restarts a list of workers a few at a time, instead of sending the restart to them all at once and having the
+    whole site reboot together (NFS, license checkouts and job startup all spiking at the same time).
+
+    At most max_down workers are restarting at once. A worker counts as restarting from when it's sent
+    "OnLastTaskComplete RestartMachine" until it has gone down and come back up in any other state (it may go straight
+    to rendering), then the next worker is sent the restart. Workers that were restarted recently are skipped. A
+    restart is only recorded once the worker is back, in the farm wide u_FarmStateStore.SharedIdempotencyStore, so a
+    restart that never happened isn't skipped next time, and every pulse sees the same restarts.
+
+    A worker that hasn't come back within restart_timeout_seconds is reported as timed out, but it still has the restart
+    pending, e.g. it's still on a long task, so it keeps its slot until it's seen back, and it's recorded then. This
+    keeps the max_down limit true, at the cost of fewer workers being restarted if several are stuck on long tasks.
+    If the total timeout runs out with workers left, a warning lists them.
+
+    This runs until the workers are all back, which can take hours, so it's run as its own cron (u_RenderNodeRestart).
+
+    Example:
+        RollingRestart(max_down=5).run(worker_names)
+    """
+
+    # States that mean the worker has gone down for the restart.
+    down_states = ["Offline", "Stalled", "Unknown"]
+
+    def __init__(self,
+                 max_down=None,
+                 poll_seconds=30,
+                 restart_timeout_seconds=3 * 3600,
+                 total_timeout_seconds=6 * 3600,
+                 recent_restart_hours=20,
+                 idempotency_store=None,
+                 remote_command_executor=None,
+                 get_worker_states=None
+                 ):
+        """
+        Args:
+            max_down: int: The most workers restarting at once. Defaults to a tenth of the workers.
+            poll_seconds: int: How often to check the state of the restarting workers.
+            restart_timeout_seconds: int: How long to wait for a worker to come back before giving up on it. This
+            includes waiting for its last task to finish.
+            total_timeout_seconds: int: How long to keep going before leaving the rest for the next night.
+            recent_restart_hours: int: Skip workers restarted within this many hours.
+            idempotency_store: u_FarmStateStore.SharedIdempotencyStore: Option to use a different store.
+            remote_command_executor: u_RemoteCommandExecutor.RemoteCommandExecutor: Option to send the restarts with
+            a different executor, e.g. the toolbox's, or one with a fake send function.
+            get_worker_states: function: Option to get the worker states with something other than
+            get_repository_worker_states().
+        """
+        self.max_down = max_down
+        self.poll_seconds = poll_seconds
+        self.restart_timeout_seconds = restart_timeout_seconds
+        self.total_timeout_seconds = total_timeout_seconds
+        self.recent_restart_hours = recent_restart_hours
+        self.idempotency_store = idempotency_store or u_FarmStateStore.SharedIdempotencyStore()
+        self.remote_command_executor = remote_command_executor or u_RemoteCommandExecutor.RemoteCommandExecutor()
+        self.get_worker_states = get_worker_states or get_repository_worker_states
+
+    @staticmethod
+    def restart_key(worker_name):
+        return "rolling_restart:{}".format(worker_name)
+
+    def run(self, worker_names):
+        """
+        Restart the workers, a batch at a time.
+
+        Returns:
+            report: RollingRestartReport
+        """
+        start_time = time.time()
+        report = RollingRestartReport()
+        pending = []
+        for worker_name in worker_names:
+            if self.idempotency_store.get(self.restart_key(worker_name)) is None:
+                pending.append(worker_name)
+            else:
+                report.skipped_recent.append(worker_name)
+        max_down = self.max_down or max(1, len(worker_names) // 10)
+        # {worker name: [time the restart was sent, whether we've seen it go down]}
+        restarting = {}
+
+        # The timed out workers only need waiting on while they're holding up the pending ones.
+        while pending or len(restarting) > len(report.timed_out):
+            if time.time() - start_time > self.total_timeout_seconds:
+                break
+            # Release the next workers into the free slots.
+            batch, pending = pending[:max_down - len(restarting)], pending[max_down - len(restarting):]
+            if batch:
+                send_report = self.remote_command_executor.send(batch, "OnLastTaskComplete RestartMachine")
+                report.failed.extend(send_report.failures)
+                for worker_name in send_report.results:
+                    restarting[worker_name] = [time.time(), False]
+            if not restarting:
+                continue
+            time.sleep(self.poll_seconds)
+            worker_states = self.get_worker_states(list(restarting))
+            for worker_name, (sent_time, gone_down) in list(restarting.items()):
+                worker_state = worker_states.get(worker_name, "Unknown")
+                if worker_state in self.down_states:
+                    restarting[worker_name][1] = True
+                elif gone_down:
+                    # Back up, whether it's Idle or has already picked up a task.
+                    print("# '{}' is back after its restart ({}).".format(worker_name, worker_state))
+                    self.idempotency_store.check_and_set(self.restart_key(worker_name),
+                                                         ttl_seconds=self.recent_restart_hours * 3600
+                                                         )
+                    report.restarted.append(worker_name)
+                    if worker_name in report.timed_out:
+                        report.timed_out.remove(worker_name)
+                    del restarting[worker_name]
+                    continue
+                if worker_name not in report.timed_out and time.time() - sent_time > self.restart_timeout_seconds:
+                    print("# WARNING: '{}' hasn't come back {:.1f} hours after it was sent the restart. It still has "
+                          "the restart pending, so it keeps its slot.".format(worker_name,
+                                                                               (time.time() - sent_time) / 3600.0))
+                    report.timed_out.append(worker_name)
+
+        report.timed_out.extend(worker_name for worker_name in restarting if worker_name not in report.timed_out)
+        report.not_restarted.extend(pending)
+        report.seconds = time.time() - start_time
+        print("# {}".format(report))
+        if report.not_restarted:
+            print("# WARNING: Ran out of time after {:.1f} hours with {} workers not restarted, as {} were still "
+                  "restarting: {}".format(report.seconds / 3600.0,
+                                          len(report.not_restarted),
+                                          ", ".join(sorted(restarting)) or "none",
+                                          ", ".join(report.not_restarted)
+                                          ))
+        return report
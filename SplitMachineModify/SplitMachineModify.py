@@ -42,8 +42,7 @@ class SplitModifySetup:
         """
 
         # Disable the Splits.
-        for worker in self.split_workers_to_modify:
-            u_DeadlineToolbox.modify_worker(worker, set_worker_state=False)
+        u_DeadlineToolbox.modify_workers(self.split_workers_to_modify, set_worker_state=False)
 
         # This removes workers to the DENY list, effectively enabling their ability to render nuke jobs.
         for limit_group in self.limit_group_to_modify:
@@ -61,8 +60,7 @@ class SplitModifySetup:
         # Requeue any tasks on the non-split workers to free them up for houdini/maya
         u_DeadlineToolbox.requeue_tasks_on_workers(re_queue_worker_list=self.non_split_workers_to_modify)
 
-        for worker in self.split_workers_to_modify:
-            u_DeadlineToolbox.modify_worker(worker, set_worker_state=True)
+        u_DeadlineToolbox.modify_workers(self.split_workers_to_modify, set_worker_state=True)
 
 
 def disable_splits():
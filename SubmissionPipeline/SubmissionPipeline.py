@@ -0,0 +1,576 @@
+#!/usr/bin/python
+
+"""
+All the rules we run on a job when it is submitted to the farm, run one after the other in a declared order against an
+in-memory draft of the job.
+
+Before this each rule lived in its own OnJobSubmitted event plugin (u_OnJobSubmission, u_ForceGroup, u_ForcePools,
+u_ForcePriority, u_ForceMachineLimit, u_PriorityUser, u_ShotgridPriority, u_SiteLicenseLimitSetting,
+u_TimeoutErrorHandling and u_SplitMachineHandling), and each one saved the job on its own. u_OnJobSubmission alone
+could save the same job up to seven times. Now the rules only change the draft, then the pipeline saves the job once and
+sets the machine limit once at the end. The time each rule takes is recorded and printed, so we can see which ones are
+slow during big PDG / Hermes submission waves.
+
+The old event plugins have been removed, but the rules still read their settings from the old plugin's config in the
+Deadline UI, e.g. the PDG priority is still set in u_ForcePriority. So the u_ForcePriority, u_ForceMachineLimit and
+u_PriorityUser .param files stay in the repository's events folder, with the plugins disabled. The pipeline is run by
+u_SubmissionPipelineTriggers.py.
+"""
+
+import os
+import time
+from datetime import datetime
+from Deadline.Scripting import *
+from System.Collections.Specialized import *
+from scripts.General.u_DeadlineToolbox import u_DeadlineToolbox
+from scripts.General.u_SplitMachineModify import u_SplitMachineModify
+
+
+class SubmissionDraft:
+    """
+    An in-memory draft of a submitted job. Rules make their changes through this, so we know what has changed and can
+    save the job once at the end. Values the job already has are skipped.
+    """
+
+    def __init__(self, job, config_overrides=None):
+        self.job = job
+        self.changed = []
+        self.machine_limit = None
+        # Event plugin configs are fetched once per draft and shared between rules. An event plugin running a rule on
+        # its own can pass itself in here, as it has the same GetConfigEntry functions.
+        self.configs = dict(config_overrides or {})
+
+    def set(self, field_name, value):
+        """
+        Change a job property, e.g. "JobGroup".
+        """
+        if getattr(self.job, field_name) != value:
+            setattr(self.job, field_name, value)
+            self.changed.append(field_name)
+
+    def set_priority(self, prio=0):
+        """
+        The draft version of u_DeadlineToolbox.set_prio. This also adds the flag needed for the Farm Notification System
+        to avoid spamming producers emails.
+        """
+        if prio:
+            self.set("JobPriority", prio)
+            if prio > 50:
+                self.set("JobExtraInfo9", "Automatic raised priority job")
+
+    def set_extra_info(self, key, value):
+        if self.job.GetJobExtraInfoKeyValue(key) != value:
+            self.job.SetJobExtraInfoKeyValue(key, value)
+            self.changed.append("ExtraInfo: {}".format(key))
+
+    def set_environment(self, key, value):
+        if self.job.GetJobEnvironmentKeyValue(key) != value:
+            self.job.SetJobEnvironmentKeyValue(key, value)
+            self.changed.append("Environment: {}".format(key))
+
+    def set_limit_groups(self, limit_list):
+        if u_DeadlineToolbox.get_job_limits_as_list(self.job) != list(limit_list):
+            self.job.SetJobLimitGroups(limit_list)
+            self.changed.append("JobLimitGroups")
+
+    def set_machine_limit(self, machine_limit):
+        """
+        The machine limit is set once after the save, the last rule to set it wins.
+        """
+        self.machine_limit = machine_limit
+
+    def get_config(self, event_plugin_name):
+        """
+        Returns the Deadline UI config for an event plugin, e.g. "u_ForcePriority".
+        """
+        if event_plugin_name not in self.configs:
+            self.configs[event_plugin_name] = RepositoryUtils.GetEventPluginConfig(event_plugin_name)
+        return self.configs[event_plugin_name]
+
+    def commit(self):
+        """
+        Save the job once with every change the rules made, then set the machine limit.
+
+        Returns:
+            int: The number of repository writes made.
+        """
+        writes = 0
+        if self.changed:
+            print("# Saving the job with these changes: {}".format(", ".join(self.changed)))
+            RepositoryUtils.SaveJob(self.job)
+            writes += 1
+        # This is after the save as the machine limit doesn't need the job saving.
+        if self.machine_limit is not None and self.machine_limit != self.job.JobMachineLimit:
+            RepositoryUtils.SetMachineLimitMaximum(self.job.JobId, self.machine_limit)
+            writes += 1
+        return writes
+
+
+# ------------------------------------------------- Submission rules ---------------------------------------------------
+# Each rule takes the SubmissionDraft and changes it. The rules must not save the job themselves.
+
+def environment_setup_rule(draft):
+    """
+    From u_OnJobSubmission. Set a job's extra info based on current environment variables, without overriding any info
+    that's already there. Then add environment variables so jobs can bootstrap sgtk and be identified on the farm.
+    """
+    job = draft.job
+    extra_info_keys = job.GetJobExtraInfoKeys()
+
+    # Job extra info key, env var to set it from and whether we can fall back to the job's environment.
+    extra_info_env_vars = [("project_name", "U_PROJECT", True),
+                           ("package_name", "U_PACKAGE_NAME", True),
+                           ("app_major_python_version", "U_APP_MAJOR_PYTHON_VERSION", True),
+                           ("task_id", "U_TASK_ID", False)
+                           ]
+    for key, env_var, use_job_environment in extra_info_env_vars:
+        if key not in extra_info_keys:
+            print("{} is not in extra info keys. Setting from env var {}={}".format(key, env_var, os.getenv(env_var)))
+            value = os.environ.get(env_var, "")
+            if not value and use_job_environment:
+                value = job.GetJobEnvironmentKeyValue(env_var)
+            draft.set_extra_info(key, value)
+
+    # force set `U_PROJECT_ID` as an environment variable
+    # allows all jobs submitted from a project have the ability to bootstrap sgtk
+    if not job.GetJobEnvironmentKeyValue("U_PROJECT_ID"):
+        print("Setting up Project ID Environment Variable to: {}".format(os.getenv("U_PROJECT_ID")))
+        draft.set_environment("U_PROJECT_ID", os.environ.get("U_PROJECT_ID", ""))
+
+    # add an environment variable for the job ID so it's easy to identify when a process is running on the farm
+    # and that job it's running for
+    draft.set_environment("DEADLINE_JOB_ID", job.JobId)
+
+    # disables auto task timeout on slapcomp jobs as they vary in frame times
+    slapcomp_names = ["slapcomp", "slap"]
+    if job.JobPlugin == "Nuke":
+        if any(naming_scheme in job.JobName for naming_scheme in slapcomp_names):
+            draft.set("JobEnableAutoTimeout", False)
+
+
+def force_pools_rule(draft):
+    """
+    From u_ForcePools. If the pool is none, assign it from the department, scene file or the backup pool.
+    """
+    job = draft.job
+    # Get name of the department that usually correspond to the project name
+    department = str(job.JobDepartment)
+    if job.JobPool == "none":
+        # Get name of all pools
+        all_pools = u_DeadlineToolbox.command_channel.execute("GetPoolNames")
+        if department != "" and department in all_pools:
+            draft.set("JobPool", department)
+        # If pool department field is empty try to get from Scene file for Houdini and Mantra
+        elif job.JobPlugin == "Houdini" or job.JobPlugin == "Mantra":
+            scene_file = job.GetJobPluginInfoKeyValue("SceneFile")
+            project = scene_file.split("/")[3]
+            draft.set("JobPool", project)
+            print("The pool has been changed to", project)
+        # If still no luck assign to backup pool
+        else:
+            draft.set("JobPool", "backup_pool")
+    if job.JobPlugin == "Houdini" and "mtl" not in job.JobSubmitMachine:
+        draft.set("JobSecondaryPool", "houdini")
+
+    # Set qt jobs to qt secondary pool so we can set qt jobs to go to machines that are too poor to render
+    # regular Nuke jobs. This means we can leave the primary pool as the project.
+    qt_list = ["QT", "RenderMovFile", "Movie"]
+    if any(qt_string in job.JobName for qt_string in qt_list):
+        draft.set("JobSecondaryPool", "qt")
+
+
+def force_machine_limit_rule(draft):
+    """
+    From u_ForceMachineLimit. Assign machine limits from the Deadline UI based on the job plugin type, and make sure
+    houdini jobs have the houdini license limit.
+    """
+    job = draft.job
+    config = draft.get_config("u_ForceMachineLimit")
+    # List of Plugins we currently use the the most
+    plugin_list = ['Nuke', 'MayaCmd', 'Arnold', 'Mantra', 'Houdini']
+    if job.JobPlugin in plugin_list:
+        # Get the value of the Limit from the UI - the name of the Limit field is set in the param file
+        limit_value = int(config.GetConfigEntry("Limit_{}".format(job.JobPlugin)))
+        # only alter the machine limit if the limit value from the ui isnt 0
+        if limit_value:
+            prio_users = RepositoryUtils.GetUserGroup("u_PriorityUsers")
+            # check if the user is not in the u_priorityuser group, we don't want to limit these users
+            if job.JobUserName not in prio_users:
+                # We don't want to limit client sends
+                if "[Client]" not in job.JobBatchName:
+                    draft.set_machine_limit(limit_value)
+            # For prio users, if we're setting a global machine limit set the value for those jobs to be 2 x the
+            # limit of other jobs
+            else:
+                draft.set_machine_limit(limit_value * 2)
+
+    # Make sure houdini jobs have license assigned
+    if job.JobPlugin == "Houdini":
+        draft.set_limit_groups(["houdini"])
+
+
+def site_license_limit_rule(draft):
+    """
+    From u_SiteLicenseLimitSetting. Add the site limit, and the site based license limits, to the job.
+    """
+    job = draft.job
+    # We check that the submit machine contains "mtl". I'm using this instead of a Deadline group as jobs can be
+    # submitted by machines which don't exist on Deadline, which breaks this.
+    if "mtl" in job.JobSubmitMachine:
+        site = "na_ne"
+    # We don't want to alter hermes limits at all.
+    elif job.JobPool != "hermes":
+        site = "eu_w"
+    else:
+        return
+
+    # We're only setting site based limits for these plugins at the moment.
+    # todo: add "houdini" and "arnold license limit", when they have licenses in mtl.
+    site_based_limits = ["nuke render license limit"]
+    # Get the limits the job was submitted with, then set the site limit.
+    submitted_limit_list = u_DeadlineToolbox.get_job_limits_as_list(job)
+    submitted_limit_list.append(site)
+    # Then add the site name to the beginning of the site based limit, e.g. "nuke render license limit" to
+    # "na_ne_nuke render license limit"
+    new_limit_list = []
+    for limit in submitted_limit_list:
+        if limit in site_based_limits:
+            new_limit_list.append(site + "_" + limit)
+        else:
+            new_limit_list.append(limit)
+    # Once we've processed them remove duplicates that can occasionally occur
+    new_limit_list = list(dict.fromkeys(new_limit_list))
+    draft.set_limit_groups(new_limit_list)
+    print("Set the {} site limits for this job: {}".format(site, new_limit_list))
+
+
+def force_group_rule(draft):
+    """
+    From u_ForceGroup. Find the type of job, and set it to the right group.
+    """
+    job = draft.job
+    # This dict contains CG plugins / limits and the groups we want to put them into.
+    default_cg_group_dict = {
+        "MayaCmd": "split_machines",
+        "Arnold": "251gb",
+        "Mantra": "251gb",
+        "arnold license limit": "251gb"
+    }
+    # For PDG and CommandLine jobs they can use many renderers, so we instead discern the plugin they're using from the
+    # limits on the job. Then set the group based on that limit.
+    pdg_plugin_group_dict = {
+        "houdini": "split_machines",
+        "arnold license limit": "128up"
+    }
+    qt_list = ["QT", "RenderMovFile", "Movie"]
+    job_limit_list = u_DeadlineToolbox.get_job_limits_as_list(job)
+    # Get London time as we are currently only rendering CG in London.
+    london_time = u_DeadlineToolbox.LondonDatetime()
+    ldn_office_hours = london_time.get_day_of_week() < 5 and 19 > london_time.get_hour_of_day() > 8
+
+    if any(qt_string in job.JobName for qt_string in qt_list):
+        # Set qt jobs to qt group and secondary pool so we can set qt jobs to go to machines that are too poor to
+        # render regular Nuke jobs without them rendering normal Nuke jobs.
+        draft.set("JobGroup", "qt")
+        draft.set("JobSecondaryPool", "qt")
+    elif job.JobPlugin in default_cg_group_dict or (job.JobPlugin == "CommandLine"
+                                                    and "arnold license limit" in job_limit_list):
+        # If we are in LDN office hours, set up groups for CG jobs using the default dict above.
+        if ldn_office_hours:
+            if job.JobPlugin in default_cg_group_dict:
+                draft.set("JobGroup", default_cg_group_dict[job.JobPlugin])
+            else:
+                draft.set("JobGroup", "251gb")
+    elif job.JobPlugin == "PDGDeadline":
+        for limit in job_limit_list:
+            if limit in pdg_plugin_group_dict:
+                draft.set("JobGroup", pdg_plugin_group_dict[limit])
+                break
+    elif job.JobPlugin == "Houdini":
+        # if the task count is 1 and the frames per task are more than 1 - in most scenarios it's a simulation
+        if job.JobTaskCount == 1 and job.JobFramesPerTask > 1:
+            # assign the group sim to the job so that it can get the best machines for that
+            draft.set("JobGroup", "sims")
+            # Set them to only allow 1 error on them so we avoid repeated renders of heavy erroring sims
+            draft.set("JobOverrideTaskFailureDetection", True)
+            draft.set("JobFailureDetectionTaskErrors", 1)
+        # if its not a simulation, put it in the split_machines group for maximum houdini license efficiency
+        elif "mtl" not in job.JobSubmitMachine:
+            draft.set("JobGroup", "split_machines")
+    elif job.JobPlugin != "CommandLine":
+        # Client submission nuke jobs tend to get stuck on Union machines, therefore as a temporary fix it would be
+        # useful to make sure they only go on render nodes for now.
+        if job.JobPlugin == "Nuke" and "[Client]" in job.JobBatchName:
+            draft.set("JobGroup", "render_nodes")
+        # temp fix for cg aov publishes failing on workstations. It may be beneficial to leave python jobs to be on
+        # the render nodes, as we can more confidently know that they will have the correct python compatibility.
+        if job.JobPlugin == "Python":
+            draft.set("JobGroup", "render_nodes")
+
+
+def force_priority_rule(draft):
+    """
+    From u_ForcePriority. Sets the priority of different types of jobs on submission.
+    """
+    job = draft.job
+    config = draft.get_config("u_ForcePriority")
+    local_day_of_week = datetime.now().today().weekday()
+    local_hour_of_day = datetime.now().hour
+    prio_users = RepositoryUtils.GetUserGroup("u_PriorityUsers")
+    # Low priority CG is determined from the job's pool.
+    low_prio_cg = ["rnd", "cg_assets"]
+    # CG renderers are determined from the jobs plugin.
+    cg_renderers = ["Arnold", "Mantra"]
+    # This is a list of strings to catch in the job name to determine if it is a QT maker job.
+    qt_publish_list = ["CG AOV Publish",
+                       "[QT2 Copy]",
+                       "[QT2]",
+                       "Publish"
+                       ]
+
+    # We set PDG prio from the UI, so we can change it easily if needed.
+    if job.JobPlugin == "PDGDeadline":
+        draft.set_priority(int(config.GetConfigEntry('Priority PDG')))
+
+    # Client sends
+    if "[Client]" in job.JobBatchName:
+        draft.set_priority(95)
+
+    # rsmb renders
+    if "rsmb_render" in job.JobLimitGroups:
+        draft.set_priority(95)
+
+    # for Nuke jobs we can use the normal site datetime. As we only render Nuke locally, so we only want to
+    # raise prio out of the local office hours.
+    if local_day_of_week < 5 and local_hour_of_day > 18:
+        if job.JobPlugin == "Nuke":
+            draft.set_priority(95)
+
+    # CG renders. Exclude prio users from default CG prio.
+    # NB: jobs that are 5 frames or less are handled by the CG tests section below.
+    if job.JobPlugin in cg_renderers and job.JobUserName not in prio_users:
+        if job.JobTaskCount > 5:
+            if job.JobPool in low_prio_cg:
+                draft.set_priority(20)
+            else:
+                draft.set_priority(40)
+
+    # we don't want to alter hermes job prios.
+    if job.JobPlugin == "CommandLine" and job.JobPool != "hermes":
+        # Set matchmove jobs to high prio to get them picked up asap.
+        if job.JobPool == "mm":
+            draft.set_priority(95)
+        # For single frame jobs they're likely tests or other quick things, so prio them high.
+        elif job.JobTaskCount == 1:
+            draft.set_priority(95)
+        # For low priority CG we want to lower it beyond normal CG prio.
+        elif job.JobPool in low_prio_cg:
+            draft.set_priority(20)
+        # Other commandline jobs are likely CG (u_render), set it to cg prio (40)
+        else:
+            draft.set_priority(40)
+        # Set QT / Publish jobs to 95 prio, so they're picked up ASAP.
+        if any(qt_job in job.JobName for qt_job in qt_publish_list):
+            draft.set_priority(95)
+
+    # Force Element Lib Render jobs to a lower prio than normal comps as they are usually massive frame
+    # ranges and can block up the farm.
+    if "Element Lib Render" in job.JobBatchName:
+        draft.set_priority(40)
+
+    # todo: -------------------Temp MM site limit applying - Will be fixed when mm on config2----------------------
+    if "mm" in job.JobPool:
+        limit_list = u_DeadlineToolbox.get_job_limits_as_list(job)
+        if "mtl" in job.JobSubmitMachine:
+            limit_list.append("na_ne")
+        else:
+            limit_list.append("eu_w")
+        draft.set_limit_groups(list(dict.fromkeys(limit_list)))
+
+    # Auto prioritise CG renders under 5 frames, as these are usually tests.
+    # Stagger the prio to help the single frames through first etc..
+    cg_test_plugin_list = ["Houdini", "Arnold", "Mantra", "MayaCmd"]
+    if u_DeadlineToolbox.is_job_u_render(job) or job.JobPlugin in cg_test_plugin_list:
+        cg_test_prios = {1: 95, 2: 90, 3: 85, 4: 80, 5: 75}
+        if job.JobTaskCount in cg_test_prios:
+            draft.set_priority(cg_test_prios[job.JobTaskCount])
+            print("Setting priority to {} as the job has {} task(s). "
+                  "This helps test renders get through quicker.".format(job.JobPriority, job.JobTaskCount))
+
+
+def priority_user_rule(draft):
+    """
+    From u_PriorityUser. Force the priority and machine limit if the user is in the u_PriorityUsers user group.
+    """
+    job = draft.job
+    config = draft.get_config("u_PriorityUser")
+    # Add the user set in the UI to the u_PriorityUsers group
+    manual_user = config.GetConfigEntry("User")
+    RepositoryUtils.AddUsersToUserGroups([manual_user], ["u_PriorityUsers"])
+    # if user in the priority Group
+    if "u_PriorityUsers" in RepositoryUtils.GetUserGroupsForUser(job.JobUserName):
+        # Set Priority Value from UI or default 95
+        draft.set("JobPriority", config.GetIntegerConfigEntryWithDefault("Priority", 95))
+        # Only set the machine limit if it isnt 0 in the UI
+        machine_limit = int(config.GetConfigEntry("Machine Limit"))
+        if machine_limit:
+            draft.set_machine_limit(machine_limit)
+
+
+def shotgrid_priority_rule(draft):
+    """
+    From u_ShotgridPriority. Set the priority from Shotgrid, or from the PDG monitor job for spawned PDG jobs.
+    """
+    job = draft.job
+    # grab the task_id from the job
+    sg_task_id = job.GetJobExtraInfoKeyValue("task_id")
+    # if job does not have a shotgrid task_id, skip (e.g. hermes jobs)
+    if sg_task_id:
+        # NB: u_SetShotgridPrio is outside of this repo and saves the job itself.
+        from scripts.General.u_ShotgridUtils import u_SetShotgridPrio
+        u_SetShotgridPrio.set_shotgrid_prio(job)
+    # This checks the prio of the pdg monitor job and sets it to that. This is needed as the spawned jobs don't have
+    # SG Task IDs, so don't get the prio set from SG.
+    elif job.JobPlugin == "PDGDeadline":
+        # Get the default pdg prio from the u_ForcePriority.param
+        default_pdg_prio = draft.get_config("u_ForcePriority").GetIntegerConfigEntry("Priority PDG")
+        # Check if the pdg job submitted is the default pdg prio set from the deadline UI.
+        if job.JobPriority == default_pdg_prio:
+            for farm_job in RepositoryUtils.GetJobsInState("Active"):
+                if farm_job.JobBatchName == job.JobBatchName:
+                    draft.set("JobPriority", farm_job.JobPriority)
+                    break
+
+
+def timeouts_rule(draft):
+    """
+    From u_TimeoutErrorHandling.set_timeouts.
+    1. Set [Client] Nuke jobs to have a max task time of 3 minutes. This is because they can get stuck and never
+    should take longer than 3 minutes. When it reaches 3 minutes, it will error and requeue.
+    2. Set regular Nuke jobs to have a max task time of 15 minutes. Upon which it will error and change frames per
+    task and concurrent tasks to 1 as well as limit it to max 4 machines in the timeout_error_handling function.
+    Only set these during work hours, as outside of work hours they should have priority and be unrestricted
+    3. Set CG jobs to have a max task time out 3 hours. When that timeout occurs, it will be picked up in the
+    timeout_error_handling function and handled in there.
+    Once tasks have completed, u_TaskTimeAggregation replaces these timeouts with ones from the job's task times.
+    4. Set Houdini (not sims) and Maya jobs to have a timeout of 10 minutes, then set concurrent tasks to 1
+    """
+    job = draft.job
+    config = draft.get_config("u_TimeoutErrorHandling")
+    cg_renderers = ["Arnold", "Mantra"]
+    ass_ifd_gens = ["Houdini", "MayaCmd"]
+    limit_groups = u_DeadlineToolbox.get_job_limits_as_list(job)
+
+    # Set a default max time, 0 = infinity
+    timeout_in_mins = 0
+    # Check if a manual timeout value hasn't already been set and it's not a test job.
+    if job.JobTaskTimeoutSeconds == 0 and "render_testing" not in job.JobPool:
+        # Only set the timeouts for nuke and ifd/ass gens during work hours
+        if u_DeadlineToolbox.office_hours():
+            # Set Nuke timeouts to the default value in the Deadline UI, unless its a Client job
+            if job.JobPlugin == "Nuke":
+                if "[Client]" in job.JobBatchName:
+                    timeout_in_mins = 3
+                else:
+                    timeout_in_mins = int(config.GetConfigEntry("Nuke Timeout"))
+            # Set Houdini/Maya timeouts to the UI value, unless it's a sim / test (single task).
+            elif job.JobPlugin in ass_ifd_gens and job.JobTaskCount != 1:
+                timeout_in_mins = int(config.GetConfigEntry("Maya and Houdini Timeout"))
+
+        # CG timeouts are not office hours dependent.
+        if job.JobPlugin in cg_renderers or "arnold license limit" in limit_groups:
+            # only change the timeout for tasks that aren't tests (single task count)
+            if job.JobTaskCount == 1:
+                timeout_in_mins = 0
+            else:
+                timeout_in_mins = int(config.GetConfigEntry("Arnold and Mantra Timeout"))
+
+        # Set PDG monitor tasks to time themselves out at 1 hour
+        if job.JobPlugin == "PDGDeadline" and "pdg_mq" in limit_groups:
+            timeout_in_mins = 60
+    # Set the timeout.
+    draft.set("JobTaskTimeoutSeconds", timeout_in_mins * 60)
+    draft.set("JobOnTaskTimeout", "Error")
+
+    # Set up a minimum task time for a render to be considered successful. This stops false "completed" renders.
+    # Exclude cmd and PDG jobs as these can have all sorts of different times for different reasons. e.g. a
+    # small copy job script that runs as part of a batch
+    excluded_plugin_list = ["CommandLine", "PDGDeadline"]
+    if job.JobMinRenderTimeSeconds == 0 and job.JobPlugin not in excluded_plugin_list:
+        draft.set("JobMinRenderTimeSeconds", 2)
+
+
+def split_machine_rule(draft):
+    """
+    From u_SplitMachineHandling. This runs u_SplitMachineModify.reset_splits() if a "split_machines" job is submitted
+    to the farm and the split workers are disabled. This needs to run after the group has been set.
+    """
+    split_machine_group = "split_machines"
+    if draft.job.JobGroup != split_machine_group:
+        return
+    # Get the nuke limit to check if the Big Red Button is active. This is the DENY list
+    current_nuke_limit_group = RepositoryUtils.GetLimitGroup("eu_w_nuke render license limit", True)
+    # Check to see if one of the epic machines is already in the Nuke limit, if so we dont want to adjust it until
+    # we reset the "big red button" - which stops all CG and allows nuke jobs to render on the epic machines.
+    if "render42" in current_nuke_limit_group.LimitGroupListedSlaves:
+        # If render27-01 is disabled, run the script to enable the splits and remove them from the nuke limit
+        worker_info = RepositoryUtils.GetSlaveSettings("render27-01", True)
+        if not worker_info.SlaveEnabled:
+            u_SplitMachineModify.reset_splits()
+
+
+# The order the rules run in. Groups need setting before the split machine rule, and limits before the priority rules.
+submission_rules = [
+    ("environment_setup", environment_setup_rule),
+    ("force_pools", force_pools_rule),
+    ("force_machine_limit", force_machine_limit_rule),
+    ("site_license_limit", site_license_limit_rule),
+    ("force_group", force_group_rule),
+    ("force_priority", force_priority_rule),
+    ("priority_user", priority_user_rule),
+    ("shotgrid_priority", shotgrid_priority_rule),
+    ("timeouts", timeouts_rule),
+    ("split_machine", split_machine_rule),
+]
+
+
+class SubmissionPipeline:
+    """
+    Runs the submission rules in order against a draft of the job, then saves the job once.
+    """
+
+    def __init__(self, rule_names=None):
+        """
+        Args:
+            rule_names: list: Option to only run some of the rules, e.g. ["force_group"]. They still run in the order
+            declared in submission_rules.
+        """
+        self.rules = [(rule_name, rule) for rule_name, rule in submission_rules
+                      if rule_names is None or rule_name in rule_names]
+        self.rule_timings = []
+
+    def run(self, job, config_overrides=None):
+        """
+        Args:
+            job: The Deadline job object that's been submitted.
+            config_overrides: dict: Event plugin name to config object, e.g. {"u_ForcePriority": self}.
+        Returns:
+            draft: SubmissionDraft: The draft, with what changed.
+        """
+        draft = SubmissionDraft(job, config_overrides=config_overrides)
+        self.rule_timings = []
+        for rule_name, rule in self.rules:
+            start_time = time.time()
+            rule(draft)
+            self.rule_timings.append((rule_name, (time.time() - start_time) * 1000))
+
+        start_time = time.time()
+        writes = draft.commit()
+        self.rule_timings.append(("commit", (time.time() - start_time) * 1000))
+
+        print("# Submission pipeline made {} repository write(s) for job '{}'. Rule timings: {}".format(
+            writes,
+            job.JobId,
+            ", ".join("{} {:.1f}ms".format(rule_name, ms) for rule_name, ms in self.rule_timings)
+        ))
+        return draft
@@ -0,0 +1,200 @@
+#! /usr/bin/python
+"""
+
+Task Duration Sketch:
+
+Streaming quantile sketches of render times per frame, per job, batch and plugin / show, used to set each job's task
+timeout from how long its tasks actually take instead of a fixed timeout per plugin (see u_TaskTimeAggregation).
+Each task's render time is divided by its frames, so the sketches still hold when a job is re-chunked, and the
+timeout is scaled back up by the job's frames per task.
+
+A sketch is a histogram with logarithmic buckets, so any quantile it gives is within relative_accuracy (2%) of the real
+one, however many tasks it's seen, and it only keeps a few hundred counts at most. Sketches of the same accuracy can be
+added together or subtracted, so when a job's tasks are re-read, the difference from its last sketch is added to its
+batch and plugin / show sketches. Each task is only counted once, and nothing has to re-read the tasks of old jobs.
+
+The timeout is timeout_multiple (3) times the p95 task time (the p95 frame time x frames per task) of the most specific
+sketch with at least min_tasks tasks:
+the job's own once its early tasks have completed, then its batch, then its plugin and show. It's kept between a
+floor and a ceiling, so stuck tasks are caught well before the old 3 hour CG timeout, but heavy shots are still given
+hours. The multiple, floor and ceiling can be set with the U_ADAPTIVE_TIMEOUT_MULTIPLE, U_ADAPTIVE_TIMEOUT_FLOOR_MINUTES
+and U_ADAPTIVE_TIMEOUT_CEILING_MINUTES environment variables.
+
+Example:
+    sketch = TaskDurationSketch()
+    for render_seconds in [610, 655, 702, 1580]:
+        sketch.add(render_seconds)
+    print(sketch.quantile(0.95), adaptive_timeout_minutes([sketch], frames_per_task=2, min_tasks=3))
+
+"""
+
+import json
+import math
+import os
+
+default_relative_accuracy = 0.02
+timeout_multiple = float(os.environ.get("U_ADAPTIVE_TIMEOUT_MULTIPLE", 3))
+timeout_floor_minutes = int(os.environ.get("U_ADAPTIVE_TIMEOUT_FLOOR_MINUTES", 10))
+timeout_ceiling_minutes = int(os.environ.get("U_ADAPTIVE_TIMEOUT_CEILING_MINUTES", 12 * 60))
+# The fewest completed tasks a sketch needs before its p95 is trusted.
+default_min_tasks = 5
+
+
+class TaskDurationSketch:
+
+    def __init__(self, relative_accuracy=default_relative_accuracy, counts=None, zero_count=0):
+        """
+        Args:
+            relative_accuracy: float: How far (as a fraction) a quantile can be from the real one.
+            counts: dict: {bucket index: tasks}.
+            zero_count: int: The tasks with no render time.
+        """
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.counts = counts or {}
+        self.zero_count = zero_count
+
+    @property
+    def count(self):
+        return self.zero_count + sum(self.counts.values())
+
+    def add(self, seconds, count=1):
+        if seconds <= 0:
+            self.zero_count += count
+            return
+        bucket_index = int(math.ceil(math.log(seconds) / self.log_gamma))
+        self.counts[bucket_index] = self.counts.get(bucket_index, 0) + count
+
+    def merge(self, other, sign=1):
+        """
+        Add another sketch's counts to this one, or subtract them with sign=-1. Empty buckets are dropped.
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Can't merge sketches with different accuracies.")
+        for bucket_index, count in other.counts.items():
+            new_count = self.counts.get(bucket_index, 0) + sign * count
+            if new_count > 0:
+                self.counts[bucket_index] = new_count
+            else:
+                self.counts.pop(bucket_index, None)
+        self.zero_count = max(0, self.zero_count + sign * other.zero_count)
+        return self
+
+    def difference(self, other):
+        """
+        Returns a new sketch of what's in this sketch but not the other, e.g. a job's newly completed tasks.
+        """
+        return TaskDurationSketch(self.relative_accuracy, dict(self.counts), self.zero_count).merge(other, sign=-1)
+
+    def quantile(self, fraction):
+        """
+        Returns the render seconds at a fraction (0 to 1) of the tasks, or None if the sketch is empty.
+        """
+        total = self.count
+        if not total:
+            return None
+        rank = fraction * (total - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for bucket_index in sorted(self.counts):
+            seen += self.counts[bucket_index]
+            if rank < seen:
+                # The middle of the bucket, so it's within the relative accuracy of anything in it.
+                return 2 * self.gamma ** bucket_index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.counts) / (self.gamma + 1)
+
+    def to_json(self):
+        return json.dumps({"relative_accuracy": self.relative_accuracy,
+                           "zero_count": self.zero_count,
+                           "counts": self.counts
+                           })
+
+    @classmethod
+    def from_json(cls, sketch_json):
+        if not sketch_json:
+            return cls()
+        sketch = json.loads(sketch_json)
+        return cls(sketch["relative_accuracy"],
+                   dict((int(bucket_index), count) for bucket_index, count in sketch["counts"].items()),
+                   sketch["zero_count"]
+                   )
+
+    @classmethod
+    def from_render_times(cls, render_times, relative_accuracy=default_relative_accuracy):
+        sketch = cls(relative_accuracy)
+        for seconds in render_times:
+            sketch.add(seconds)
+        return sketch
+
+
+def job_sketch_key(job_id):
+    return "job_frame|{}".format(job_id)
+
+
+def sketch_keys(job_id, plugin, show, batch_name):
+    """
+    Returns the keys of the sketches a job's frame times are counted in, from most to least specific: the job, its
+    batch and its plugin and show.
+    """
+    return [job_sketch_key(job_id),
+            "batch_frame|{}|{}".format(plugin, batch_name or ""),
+            "show_frame|{}|{}".format(plugin, show or "")
+            ]
+
+
+def frame_times(task_render_times):
+    """
+    Returns the render seconds per frame of each task.
+
+    Args:
+        task_render_times: list: (render seconds, frames) for each task.
+    """
+    return [render_seconds / float(max(frames, 1)) for render_seconds, frames in task_render_times]
+
+
+def record_job_sketch(sketch_store, job_id, plugin, show, batch_name, task_render_times):
+    """
+    Replace a job's sketch with one of the frame times of all its completed tasks, and add the new tasks to its batch
+    and plugin / show sketches.
+
+    Args:
+        sketch_store: u_FarmStateStore.TaskDurationSketchStore
+        task_render_times: list: (render seconds, frames) for each of the job's completed tasks.
+    """
+    keys = sketch_keys(job_id, plugin, show, batch_name)
+    stored_sketches = sketch_store.get_sketches(keys)
+    job_sketch = TaskDurationSketch.from_render_times(frame_times(task_render_times))
+    new_tasks = job_sketch.difference(TaskDurationSketch.from_json(stored_sketches.get(keys[0])))
+    updated_sketches = {keys[0]: job_sketch.to_json()}
+    if new_tasks.count:
+        for key in keys[1:]:
+            updated_sketches[key] = TaskDurationSketch.from_json(stored_sketches.get(key)).merge(new_tasks).to_json()
+    sketch_store.set_sketches(updated_sketches)
+
+
+def adaptive_timeout_minutes(sketches, frames_per_task=1, min_tasks=default_min_tasks, multiple=None,
+                             floor_minutes=None, ceiling_minutes=None):
+    """
+    Work out a task timeout from the p95 frame time of the first sketch with enough tasks.
+
+    Args:
+        sketches: list: TaskDurationSketch of frame times, from most to least specific. None for any that don't exist.
+        frames_per_task: int: The job's frames per task.
+        min_tasks: int: The fewest tasks a sketch needs to be used.
+        multiple: float: The multiple of the p95 to give a task.
+        floor_minutes: int: The shortest timeout to set.
+        ceiling_minutes: int: The longest timeout to set.
+    Returns:
+        (int, int): The timeout in minutes and the index of the sketch it's from, or None if none have enough tasks.
+    """
+    multiple = multiple or timeout_multiple
+    floor_minutes = floor_minutes or timeout_floor_minutes
+    ceiling_minutes = ceiling_minutes or timeout_ceiling_minutes
+    for level_index, sketch in enumerate(sketches):
+        if sketch is None or sketch.count < min_tasks:
+            continue
+        timeout_minutes = int(math.ceil(multiple * sketch.quantile(0.95) * max(frames_per_task, 1) / 60.0))
+        return min(max(timeout_minutes, floor_minutes), ceiling_minutes), level_index
+    return None
@@ -0,0 +1,9 @@
+"""
+The modules are deployed to the Deadline repository as scripts/General/u_<name>.py, here they're imported by their own
+names. Only the modules that can run outside of Deadline are tested.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,182 @@
+"""
+Fake Deadline jobs and repository calls, so the modules that modify jobs can be stepped through outside of Deadline.
+
+The events import Deadline and the other modules through scripts.General, so import_event() puts fake Deadline modules
+and the local modules under those names first.
+"""
+
+import copy
+import importlib.util
+import os
+import sys
+import threading
+import types
+
+repository_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeJob:
+    """
+    A job with the fields and the plugin info / extra info key values the modules use.
+    """
+
+    def __init__(self, job_id="job", **fields):
+        self.JobId = job_id
+        self.JobName = "abc_010_lighting_v001"
+        self.JobBatchName = "abc_010_lighting_v001"
+        self.JobStatus = "Active"
+        self.JobPlugin = "Arnold"
+        self.JobPool = "abc"
+        self.JobGroup = "251gb"
+        self.JobLimitGroups = []
+        self.JobPriority = 50
+        self.JobComment = ""
+        self.JobFrames = "1-100"
+        self.JobFramesPerTask = 1
+        self.JobConcurrentTasks = 1
+        self.JobMachineLimit = 0
+        self.JobTaskTimeoutSeconds = 0
+        self.JobTaskCount = 100
+        self.JobCompletedTasks = 0
+        self.JobRenderingTasks = 0
+        self.JobExtraInfo8 = ""
+        self.plugin_info = {}
+        self.extra_info = {}
+        for field_name, value in fields.items():
+            setattr(self, field_name, value)
+
+    def GetJobPluginInfoKeyValue(self, key):
+        return self.plugin_info.get(key, "")
+
+    def SetJobPluginInfoKeyValue(self, key, value):
+        self.plugin_info[key] = value
+
+    def GetJobExtraInfoKeyValue(self, key):
+        return self.extra_info.get(key, "")
+
+    def SetJobExtraInfoKeyValue(self, key, value):
+        self.extra_info[key] = value
+
+
+class FakeRepositoryUtils:
+    """
+    Keeps the saved jobs and records the calls made to it. GetJob returns a copy, like fetching the job again.
+    """
+
+    def __init__(self, jobs=()):
+        # {job ID: the saved job}
+        self.jobs = dict((job.JobId, job) for job in jobs)
+        # [(call name, job ID)]
+        self.calls = []
+        self.lock = threading.Lock()
+        # {event name: {config entry: value}}
+        self.event_configs = {}
+
+    def record(self, call_name, job_id):
+        with self.lock:
+            self.calls.append((call_name, job_id))
+
+    def call_names(self, job_id="job"):
+        return [call_name for call_name, called_job_id in self.calls if called_job_id == job_id]
+
+    def GetJob(self, job_id, invalidate):
+        self.record("GetJob", job_id)
+        job = self.jobs.get(job_id)
+        return copy.deepcopy(job) if job is not None else None
+
+    def SaveJob(self, job):
+        self.record("SaveJob", job.JobId)
+        self.jobs[job.JobId] = copy.deepcopy(job)
+
+    def SuspendJob(self, job):
+        self.record("SuspendJob", job.JobId)
+        job.JobStatus = "Suspended"
+
+    def ResumeJob(self, job):
+        self.record("ResumeJob", job.JobId)
+        job.JobStatus = "Active"
+
+    def SetJobFrameRange(self, job, frames, frames_per_task):
+        self.record("SetJobFrameRange", job.JobId)
+        job.JobFramesPerTask = frames_per_task
+        if job.JobId in self.jobs:
+            self.jobs[job.JobId].JobFramesPerTask = frames_per_task
+
+    def GetEventPluginConfig(self, event_name):
+        return FakeConfig(self.event_configs.get(event_name, {}))
+
+    def SetMachineLimitMaximum(self, job_id, machine_limit):
+        self.record("SetMachineLimitMaximum", job_id)
+        if job_id in self.jobs:
+            self.jobs[job_id].JobMachineLimit = machine_limit
+
+
+class FakeConfig:
+
+    def __init__(self, entries):
+        self.entries = entries
+
+    def GetConfigEntryWithDefault(self, entry, default):
+        return self.entries.get(entry, default)
+
+
+class FakeCallback:
+    """
+    An event callback, which the listeners add their methods to with +=.
+    """
+
+    def __iadd__(self, method):
+        return self
+
+
+class FakeDeadlineEventListener:
+
+    def __init__(self):
+        pass
+
+    OnHouseCleaningCallback = FakeCallback()
+
+
+class FakeWorkerInventory:
+
+    def __init__(self, workers_by_group=None):
+        # {group name: set of worker names}
+        self.workers_by_group = workers_by_group or {}
+
+    def refresh_if_stale(self):
+        pass
+
+    def get_workers_in_group(self, group_name):
+        return self.workers_by_group.get(group_name, set())
+
+
+def install_module(monkeypatch, name, **attributes):
+    module = types.ModuleType(name)
+    for attribute_name, value in attributes.items():
+        setattr(module, attribute_name, value)
+    monkeypatch.setitem(sys.modules, name, module)
+    return module
+
+
+def import_event(monkeypatch, event_name, repository, **general_modules):
+    """
+    Import one of the events from the Events folder, with the fake repository as its RepositoryUtils.
+
+    Args:
+        monkeypatch: The pytest monkeypatch fixture, which removes the fake modules again after the test.
+        event_name: string: The event's file name, without the extension.
+        repository: FakeRepositoryUtils
+        general_modules: {name: module}: The modules the event imports from scripts.General, without the "u_".
+    """
+    install_module(monkeypatch, "Deadline")
+    install_module(monkeypatch, "Deadline.Scripting", RepositoryUtils=repository)
+    install_module(monkeypatch, "Deadline.Events", DeadlineEventListener=FakeDeadlineEventListener)
+    install_module(monkeypatch, "scripts")
+    install_module(monkeypatch, "scripts.General")
+    for name, module in general_modules.items():
+        install_module(monkeypatch, "scripts.General.u_{}".format(name), **{"u_{}".format(name): module})
+    spec = importlib.util.spec_from_file_location(event_name, os.path.join(repository_dir, "Events",
+                                                                           "{}.py".format(event_name)))
+    event = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(event)
+    return event
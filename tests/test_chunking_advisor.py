@@ -0,0 +1,61 @@
+import pytest
+
+import ChunkingAdvisor
+
+
+class Job:
+
+    def __init__(self, **fields):
+        self.JobPlugin = "Nuke"
+        self.JobGroup = "2d"
+        self.JobPool = "abc"
+        self.JobTaskCount = 100
+        self.JobFramesPerTask = 1
+        self.JobConcurrentTasks = 1
+        self.JobRenderingTasks = 0
+        self.JobCompletedTasks = 0
+        self.JobTaskTimeoutSeconds = 0
+        self.__dict__.update(fields)
+
+
+def record(frames_per_task, overhead_seconds=60, frame_seconds=10, tasks=10, pool="abc"):
+    return {"plugin": "Nuke",
+            "pool": pool,
+            "timed_tasks": tasks,
+            "timed_frames": tasks * frames_per_task,
+            "render_seconds": tasks * (overhead_seconds + frames_per_task * frame_seconds)
+            }
+
+
+def test_fit_recovers_overhead_and_frame_time():
+    job_points = [(frames, 60 + 10 * frames) for frames in [1, 2, 4, 5, 10]]
+    overhead_seconds, frame_seconds = ChunkingAdvisor.fit_task_costs(job_points)
+    assert overhead_seconds == pytest.approx(60)
+    assert frame_seconds == pytest.approx(10)
+
+
+def test_fit_needs_enough_jobs_and_different_chunks():
+    assert ChunkingAdvisor.fit_task_costs([(1, 70)] * 10) is None
+    assert ChunkingAdvisor.fit_task_costs([(1, 70), (2, 80)]) is None
+
+
+def test_model_falls_back_to_the_plugin():
+    model = ChunkingAdvisor.ChunkingModel.train([record(frames, pool="xyz") for frames in [1, 2, 4, 5, 10]])
+    assert model.get_task_costs("Nuke", "xyz") == pytest.approx((60, 10))
+    assert model.get_task_costs("Nuke", "abc") == pytest.approx((60, 10))
+    assert model.get_task_costs("Houdini", "abc") is None
+
+
+def test_frames_per_task_keeps_overhead_small_and_a_task_per_slot():
+    # 60 seconds of overhead and 10 a frame needs 54 frames a task to keep the overhead under 10%.
+    assert ChunkingAdvisor.best_frames_per_task(1000, 60, 10, slots=1) == 54
+    # But not if that leaves slots without a task.
+    assert ChunkingAdvisor.best_frames_per_task(1000, 60, 10, slots=100) == 10
+
+
+def test_advise_leaves_started_and_unknown_jobs_alone():
+    model = ChunkingAdvisor.ChunkingModel.train([record(frames) for frames in [1, 2, 4, 5, 10]])
+    assert ChunkingAdvisor.advise_frames_per_task(Job(), model, machines=10) == 10
+    assert ChunkingAdvisor.advise_frames_per_task(Job(JobCompletedTasks=1), model, machines=10) is None
+    assert ChunkingAdvisor.advise_frames_per_task(Job(JobPlugin="Arnold"), model, machines=10) is None
+    assert ChunkingAdvisor.advise_frames_per_task(Job(JobGroup="sims"), model, machines=10) is None
@@ -0,0 +1,50 @@
+import threading
+
+import pytest
+
+import CommandChannel
+
+
+def channel_for(worker_names):
+    repository = CommandChannel.FakeRepository(worker_names, call_seconds=0)
+    return CommandChannel.CommandChannel(backend=CommandChannel.RepositoryBackend(repository)), repository
+
+
+def test_batch_fetches_once_and_only_saves_changed_workers():
+    channel, repository = channel_for(["render01", "render02", "render03"])
+    repository.worker_settings["render02"].SlaveEnabled = False
+    for worker_name in ["render01", "render02", "missing"]:
+        channel.submit("SetSlaveSetting", worker_name, "SlaveEnabled", False)
+    pool_index = channel.submit("GetPoolNames")
+    results = channel.flush()
+    assert results[:2] == ["", ""]
+    assert results[2].startswith("Error")
+    assert results[pool_index] == ["none"]
+    assert repository.calls == {"GetSlaveSettingsList": 1, "SaveSlaveSettings": 1, "GetPoolNames": 1}
+    assert [settings.SlaveEnabled for settings in repository.worker_settings.values()] == [False, False, True]
+
+
+def test_unsupported_command_runs_nothing():
+    channel, repository = channel_for(["render01"])
+    channel.submit("SetSlaveSetting", "render01", "SlaveEnabled", False)
+    channel.submit("DeleteSlave", "render01")
+    with pytest.raises(ValueError):
+        channel.flush()
+    assert repository.calls == {}
+
+
+def test_each_thread_flushes_its_own_commands():
+    channel, repository = channel_for(["render01", "render02"])
+    channel.submit("SetSlaveSetting", "render01", "SlaveEnabled", False)
+    thread_results = []
+    thread = threading.Thread(target=lambda: thread_results.append(channel.flush()))
+    thread.start()
+    thread.join()
+    assert thread_results == [[]]
+    assert channel.flush() == [""]
+
+
+def test_benchmark_batch_makes_fewer_calls():
+    results = CommandChannel.benchmark(worker_count=10, call_seconds=0)
+    assert results["per_command_calls"] == 20
+    assert results["channel_calls"] == 6
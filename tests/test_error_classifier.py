@@ -0,0 +1,23 @@
+import ErrorClassifier
+
+
+class ErrorReport:
+
+    def __init__(self, message):
+        self.ReportMessage = message
+
+
+def test_classifies_known_errors():
+    message = "Error: IOError: [Errno 17] File exists: '/tmp/x'\nsomething: Stale file handle"
+    assert ErrorClassifier.classify(ErrorReport(message)) == {"file_exists", "stale_file_handle"}
+
+
+def test_unknown_message_has_no_classes():
+    assert ErrorClassifier.classify_message("Everything is fine") == frozenset()
+
+
+def test_three_hour_timeout_is_nested_in_task_timeout():
+    timeout = "The Worker did not complete the task before the Regular Task Timeout limit"
+    assert ErrorClassifier.classify_message(timeout + " of 00d 00h 20m 00s") == {"task_timeout"}
+    assert ErrorClassifier.classify_message(timeout + " of 00d 03h 00m 00s") == {"task_timeout",
+                                                                                   "task_timeout_3_hours"}
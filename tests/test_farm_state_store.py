@@ -0,0 +1,168 @@
+import os
+import threading
+import time
+
+import FarmStateStore
+
+
+def lease_store_for(tmp_path, margin_seconds=0.01):
+    # The leases in these tests only last a fraction of a second, so the margin is too.
+    return FarmStateStore.JobLeaseStore(state_dir=str(tmp_path), margin_seconds=margin_seconds)
+
+
+def test_lease_is_exclusive_until_released(tmp_path):
+    lease_store = lease_store_for(tmp_path)
+    assert lease_store.try_acquire("job", "owner_a")
+    # The owner can take it again, no one else can.
+    assert lease_store.try_acquire("job", "owner_a")
+    assert not lease_store.try_acquire("job", "owner_b")
+    lease_store.release("job", "owner_a")
+    assert lease_store.try_acquire("job", "owner_b")
+
+
+def test_expired_lease_can_be_taken(tmp_path):
+    lease_store = lease_store_for(tmp_path)
+    assert lease_store.try_acquire("job", "owner_a", lease_seconds=0.05)
+    time.sleep(0.1)
+    assert not lease_store.renew("job", "owner_a")
+    assert lease_store.try_acquire("job", "owner_b")
+    # Renewing or releasing a lease someone else has taken does nothing.
+    assert not lease_store.renew("job", "owner_a")
+    lease_store.release("job", "owner_a")
+    assert lease_store.get_held_lease("job", "owner_b") is not None
+    assert not lease_store.try_acquire("job", "owner_a")
+
+
+def test_lease_has_one_holder_at_a_time(tmp_path):
+    lease_store = lease_store_for(tmp_path)
+    holders = []
+    most_holders = []
+
+    def take_turns(owner):
+        for attempt in range(50):
+            if lease_store.try_acquire("job", owner):
+                holders.append(owner)
+                most_holders.append(len(holders))
+                time.sleep(0.001)
+                holders.remove(owner)
+                lease_store.release("job", owner)
+
+    threads = [threading.Thread(target=take_turns, args=("owner_{}".format(number),)) for number in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert most_holders and max(most_holders) == 1
+    assert os.listdir(lease_store.leases_dir) == []
+
+
+def test_lease_renewed_while_being_broken_is_put_back(tmp_path):
+    lease_store = lease_store_for(tmp_path)
+    lease_store.try_acquire("job", "owner_a", lease_seconds=0.05)
+    time.sleep(0.1)
+    # The owner renews it after someone has seen it as expired, but before they've broken it.
+    expires_at = time.time() + 60
+    os.utime(lease_store.owner_path("job", "owner_a"), (expires_at, expires_at))
+    lease_store.break_expired_lease("job")
+    assert lease_store.get_held_lease("job", "owner_a") is not None
+    assert not lease_store.try_acquire("job", "owner_b")
+
+
+def test_broken_lease_takes_its_owner_file_with_it(tmp_path):
+    lease_store = lease_store_for(tmp_path)
+    lease_store.try_acquire("job", "owner_a", lease_seconds=0.05)
+    time.sleep(0.1)
+    assert lease_store.try_acquire("job", "owner_b")
+    lease_store.release("job", "owner_b")
+    assert os.listdir(lease_store.leases_dir) == []
+
+
+def test_lease_in_its_last_margin_is_left_to_expire(tmp_path):
+    lease_store = lease_store_for(tmp_path, margin_seconds=1)
+    lease_store.try_acquire("job", "owner_a", lease_seconds=0.2)
+    assert not lease_store.renew("job", "owner_a")
+    lease_store.release("job", "owner_a")
+    assert not lease_store.try_acquire("job", "owner_b")
+    time.sleep(0.25)
+    assert lease_store.try_acquire("job", "owner_b")
+
+
+def test_job_lease_is_renewed_while_held(tmp_path):
+    lease_store = lease_store_for(tmp_path)
+    with FarmStateStore.job_lease("job", lease_seconds=0.3, lease_store=lease_store) as lease_acquired:
+        assert lease_acquired
+        # Longer than the lease, it's only still held as it's renewed.
+        time.sleep(0.5)
+        assert not lease_store.try_acquire("job", "someone_else")
+    assert lease_store.try_acquire("job", "someone_else")
+
+
+def test_job_lease_gives_up_on_held_job(tmp_path):
+    lease_store = lease_store_for(tmp_path)
+    lease_store.try_acquire("job", "someone_else")
+    with FarmStateStore.job_lease("job", wait_seconds=0.1, lease_store=lease_store) as lease_acquired:
+        assert not lease_acquired
+
+
+def test_coalescer_handles_first_error_per_window_across_machines(tmp_path):
+    # Two machines, each with its own local database, sharing the same NFS folder.
+    shared_dir = str(tmp_path / "shared")
+    coalescers = [FarmStateStore.ErrorCoalescer(state_dir=str(tmp_path / machine), window_seconds=60,
+                                                shared_state_dir=shared_dir)
+                  for machine in ["worker_a", "worker_b"]]
+    assert coalescers[0].should_handle("u_OnJobErrors", "job", "sigsegv")
+    assert not coalescers[1].should_handle("u_OnJobErrors", "job", "sigsegv")
+    assert not coalescers[0].should_handle("u_OnJobErrors", "job", "sigsegv")
+    # Other error classes have their own windows.
+    assert coalescers[1].should_handle("u_OnJobErrors", "job", "no_licenses")
+    assert coalescers[0].get_counters("u_OnJobErrors")[("u_OnJobErrors", "sigsegv")] == {"handled": 1,
+                                                                                        "suppressed": 1}
+
+
+def test_open_window_is_suppressed_without_the_shared_marker(tmp_path, monkeypatch):
+    coalescer = FarmStateStore.ErrorCoalescer(state_dir=str(tmp_path / "local"), window_seconds=60,
+                                              shared_state_dir=str(tmp_path / "shared"))
+    assert coalescer.should_handle("u_OnJobErrors", "job", "sigsegv")
+
+    def check_and_set(*args, **kwargs):
+        raise AssertionError("The shared marker was checked during an open window.")
+
+    monkeypatch.setattr(coalescer.shared_windows, "check_and_set", check_and_set)
+    assert not coalescer.should_handle("u_OnJobErrors", "job", "sigsegv")
+
+
+def test_released_window_is_handled_again(tmp_path):
+    coalescer = FarmStateStore.ErrorCoalescer(state_dir=str(tmp_path / "local"), window_seconds=60,
+                                              shared_state_dir=str(tmp_path / "shared"))
+    assert coalescer.should_handle("u_TimeoutErrorHandling", "job", "task_timeout")
+    coalescer.release_window("u_TimeoutErrorHandling", "job", ["task_timeout"])
+    assert coalescer.should_handle("u_TimeoutErrorHandling", "job", "task_timeout")
+
+
+def test_shared_idempotency_keys_expire(tmp_path):
+    store = FarmStateStore.SharedIdempotencyStore(state_dir=str(tmp_path))
+    assert store.check_and_set("key", value="first", ttl_seconds=0.05)
+    assert not store.check_and_set("key", value="second")
+    assert store.get("key") == "first"
+    time.sleep(0.1)
+    assert store.get("key") is None
+    assert store.check_and_set("key", value="third")
+    store.delete("key")
+    assert store.get("key") is None
+
+
+def test_purge_only_deletes_expired_keys(tmp_path):
+    store = FarmStateStore.SharedIdempotencyStore(state_dir=str(tmp_path))
+    store.check_and_set("expired", ttl_seconds=0.05)
+    store.check_and_set("current")
+    time.sleep(0.1)
+    assert store.purge_expired_keys()[0] == 1
+    assert sorted(os.listdir(store.keys_dir)) == ["current"]
+
+
+def test_local_idempotency_keys_expire(tmp_path):
+    store = FarmStateStore.IdempotencyStore(state_dir=str(tmp_path))
+    assert store.check_and_set("key", ttl_seconds=0.05)
+    assert not store.check_and_set("key")
+    time.sleep(0.1)
+    assert store.check_and_set("key")
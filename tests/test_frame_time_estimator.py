@@ -0,0 +1,53 @@
+import FrameTimeEstimator
+
+
+def record(minutes, plugin="Arnold", pool="abc", group="251gb", batch_name="abc_010_lighting_v001"):
+    return {"plugin": plugin,
+            "pool": pool,
+            "job_group": group,
+            "batch_name": batch_name,
+            "timed_tasks": 10,
+            "render_seconds": 10 * minutes * 60
+            }
+
+
+def test_batch_pattern_replaces_numbers():
+    assert FrameTimeEstimator.batch_pattern("ABC_010_lighting_v003") == "abc_#_lighting_v#"
+
+
+def test_estimate_uses_most_specific_group_with_enough_jobs():
+    records = [record(minutes) for minutes in [10, 20, 30]] + [record(60, pool="xyz") for _ in range(3)]
+    estimator = FrameTimeEstimator.FrameTimeEstimator.train(records)
+    estimate = estimator.estimate("Arnold", show="abc", group="251gb", batch_name="abc_020_lighting_v002")
+    assert estimate.minutes == 20
+    assert estimate.level == 0
+    assert estimate.jobs == 3
+    # Fewer jobs than confident_job_count.
+    assert estimate.low_confidence
+    # Another show only matches the plugin / group level.
+    other_show = estimator.estimate("Arnold", show="new", group="251gb")
+    assert other_show.level == 3
+    assert other_show.minutes == 45
+
+
+def test_estimate_falls_back_to_fixed_guess(tmp_path):
+    estimator = FrameTimeEstimator.FrameTimeEstimator.load(str(tmp_path / "missing.json"))
+    estimate = estimator.estimate("Houdini", group="sims")
+    assert estimate.minutes == 120
+    assert estimate.level is None
+    assert estimate.low_confidence
+
+
+def test_save_and_load(tmp_path):
+    model_path = str(tmp_path / "model" / "frame_time_model.json")
+    FrameTimeEstimator.FrameTimeEstimator.train([record(15)] * 3).save(model_path)
+    assert FrameTimeEstimator.FrameTimeEstimator.load(model_path).estimate("Arnold", show="abc").minutes == 15
+
+
+def test_model_is_per_frame_and_scaled_per_task():
+    # Each job rendered 10 tasks of 5 frames, 10 minutes a frame.
+    records = [dict(record(50), timed_frames=50) for _ in range(3)]
+    estimator = FrameTimeEstimator.FrameTimeEstimator.train(records)
+    assert estimator.estimate("Arnold", show="abc").minutes == 10
+    task_estimate = estimator.estimate_task("Arnold", frames_per_task=2, show="abc")
+    assert (task_estimate.minutes, task_estimate.low, task_estimate.high) == (20, 20, 20)
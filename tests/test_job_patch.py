@@ -0,0 +1,84 @@
+import pytest
+
+import FarmStateStore
+import JobPatch
+from fake_deadline import FakeJob, FakeRepositoryUtils
+
+
+@pytest.fixture
+def repository(monkeypatch):
+    repository = FakeRepositoryUtils()
+    monkeypatch.setattr(JobPatch, "RepositoryUtils", repository)
+    return repository
+
+
+def test_changes_are_saved_once_without_a_suspend(repository):
+    job = FakeJob()
+    patch = JobPatch.JobPatch(job)
+    patch.set_field("JobPriority", 10).set_field("JobGroup", "64gb").set_plugin_info("ContinueOnError", "True")
+    patch.set_extra_info_key_value("AdaptiveTaskTimeoutSeconds", "3600").set_machine_limit(5)
+    assert patch.changes == {"JobPriority": 10,
+                             "JobGroup": "64gb",
+                             "JobPluginInfoKeyValues": {"ContinueOnError": "True"},
+                             "JobExtraInfoKeyValues": {"AdaptiveTaskTimeoutSeconds": "3600"},
+                             "JobMachineLimit": 5
+                             }
+    assert patch.apply()
+    assert repository.call_names() == ["SaveJob", "SetMachineLimitMaximum"]
+    assert job.JobPriority == 10 and job.JobGroup == "64gb"
+
+
+def test_values_the_job_already_has_are_skipped(repository):
+    patch = JobPatch.JobPatch(FakeJob(JobPriority=10, JobMachineLimit=5))
+    patch.set_field("JobPriority", 10).set_machine_limit(5).set_frames_per_task(1)
+    assert not patch.has_changes
+    assert not patch.apply()
+    assert repository.calls == []
+
+
+@pytest.mark.parametrize("change", [lambda patch: patch.set_frames_per_task(5),
+                                    lambda patch: patch.set_field("JobConcurrentTasks", 2)])
+def test_frames_per_task_and_concurrent_tasks_suspend_and_resume(repository, change):
+    job = FakeJob()
+    change(JobPatch.JobPatch(job)).apply()
+    call_names = repository.call_names()
+    assert call_names[0] == "SuspendJob" and call_names[-1] == "ResumeJob"
+    assert job.JobStatus == "Active"
+
+
+def test_a_suspended_job_is_not_resumed(repository):
+    job = FakeJob(JobStatus="Suspended")
+    JobPatch.JobPatch(job).set_frames_per_task(5).set_field("JobPriority", 10).apply()
+    assert repository.call_names() == ["SetJobFrameRange", "SaveJob"]
+    assert job.JobStatus == "Suspended"
+
+
+def test_append_comment_is_idempotent(repository):
+    job = FakeJob(JobComment="Submitted")
+    JobPatch.JobPatch(job).append_comment("Timed out").append_comment("Timed out").apply()
+    assert job.JobComment == "Submitted -- Timed out"
+    assert not JobPatch.JobPatch(job).append_comment("Timed out").apply()
+    assert repository.call_names() == ["SaveJob"]
+
+
+def test_bulk_patch_records_only_the_fields_it_changed(repository):
+    repository.jobs.update((job.JobId, job) for job in [FakeJob("job_a"), FakeJob("job_b", JobPriority=10)])
+    report = JobPatch.bulk_patch_jobs(list(repository.jobs.values()),
+                                      lambda job: {"JobPriority": 10, "JobGroup": "64gb"})
+    assert report.jobs_written == 2
+    assert report.written_fields == {"job_a": {"JobPriority": 10, "JobGroup": "64gb"}, "job_b": {"JobGroup": "64gb"}}
+
+
+def test_bulk_patch_takes_the_lease_before_fetching_the_job(repository, tmp_path):
+    lease_store = FarmStateStore.JobLeaseStore(state_dir=str(tmp_path))
+    repository.jobs.update((job.JobId, job) for job in [FakeJob("job_a"), FakeJob("job_b")])
+    lease_store.try_acquire("job_b", "someone_else")
+    report = JobPatch.bulk_patch_jobs(list(repository.jobs.values()),
+                                      lambda job: {"JobPriority": 10},
+                                      lease_store=lease_store
+                                      )
+    assert (report.jobs_written, report.jobs_leased) == (1, 1)
+    # The leased job is left alone, without being fetched again.
+    assert repository.call_names("job_b") == []
+    # The written job's lease was released.
+    assert lease_store.try_acquire("job_a", "someone_else")
@@ -0,0 +1,56 @@
+import threading
+import time
+
+import RemoteCommandExecutor
+
+
+class FakeSend:
+    """
+    A send function that records its calls, and fails or hangs on the workers it's told to.
+    """
+
+    def __init__(self, failing_attempts=None, hanging_workers=()):
+        # {worker name: how many attempts fail before one succeeds}
+        self.failing_attempts = dict(failing_attempts or {})
+        self.hanging_workers = hanging_workers
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, worker_name, command):
+        with self.lock:
+            self.calls.append(worker_name)
+        if worker_name in self.hanging_workers:
+            time.sleep(0.3)
+        if self.failing_attempts.get(worker_name, 0):
+            self.failing_attempts[worker_name] -= 1
+            raise RuntimeError("{} refused the connection".format(worker_name))
+        return "{} ran {}".format(worker_name, command)
+
+
+def executor(send_function, retries=2):
+    return RemoteCommandExecutor.RemoteCommandExecutor(timeout_seconds=0.1, retries=retries, backoff_seconds=0,
+                                                       send_function=send_function)
+
+
+def test_errors_are_retried():
+    send = FakeSend(failing_attempts={"render02": 1, "render03": 5})
+    report = executor(send).send(["render01", "render02", "render03"], "LaunchSlave")
+    assert sorted(report.results) == ["render01", "render02"]
+    assert list(report.failures) == ["render03"]
+    assert send.calls.count("render02") == 2
+    assert send.calls.count("render03") == 3
+    assert report.attempts == 6
+
+
+def test_timeouts_are_not_resent_by_default():
+    send = FakeSend(hanging_workers=["render01"])
+    report = executor(send).send(["render01"], "OnLastTaskComplete RestartMachine")
+    assert isinstance(report.failures["render01"], TimeoutError)
+    assert send.calls == ["render01"]
+
+
+def test_timeouts_are_resent_when_safe():
+    send = FakeSend(hanging_workers=["render01"])
+    report = executor(send).send(["render01"], "LaunchSlave", retry_on_timeout=True)
+    assert "render01" in report.failures
+    assert send.calls == ["render01"] * 3
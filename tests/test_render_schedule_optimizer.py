@@ -0,0 +1,46 @@
+from datetime import datetime
+
+import RenderScheduleOptimizer
+from RenderScheduleOptimizer import ScheduleBatch
+
+
+def test_overnight_window_skips_the_weekend():
+    # A Friday at 19:00 runs until Monday at 09:00.
+    friday_evening = datetime(2024, 3, 1, 19, 0)
+    assert RenderScheduleOptimizer.overnight_window_minutes(friday_evening) == (2 * 24 + 14) * 60
+
+
+def test_machines_needed():
+    batch = ScheduleBatch("a", "251gb", remaining_minutes=600, frames_remaining=10, frame_minutes=60, priority=40)
+    assert RenderScheduleOptimizer.machines_needed(batch, 300) == 2
+    # A frame longer than the window can't finish, nor can more machines than frames.
+    assert RenderScheduleOptimizer.machines_needed(batch._replace(frame_minutes=400), 300) is None
+    assert RenderScheduleOptimizer.machines_needed(batch._replace(frames_remaining=1), 300) is None
+
+
+def test_plan_fits_the_group_and_caps_the_rest():
+    batches = [ScheduleBatch("small", "251gb", 600, 10, 60, 40),
+               ScheduleBatch("big", "251gb", 6000, 100, 60, 40),
+               ScheduleBatch("impossible", "251gb", 600, 1, 600, 50)]
+    plan = dict((planned_batch.name, planned_batch)
+                for planned_batch in RenderScheduleOptimizer.optimize(batches, {"251gb": 5}, 300))
+    assert plan["small"].finishes_in_time
+    assert plan["small"].planned_priority == 50
+    assert plan["small"].machine_limit == 3
+    assert not plan["big"].finishes_in_time
+    assert plan["big"].planned_priority == RenderScheduleOptimizer.unplanned_priority_cap
+    assert plan["impossible"].machines_needed is None
+
+
+def test_plan_never_lowers_a_hand_set_priority():
+    batches = [ScheduleBatch("rush", "251gb", 600, 10, 60, 90, priority_locked=True),
+               ScheduleBatch("stuck", "251gb", 60000, 10, 60, 80, priority_locked=True)]
+    plan = dict((planned_batch.name, planned_batch)
+                for planned_batch in RenderScheduleOptimizer.optimize(batches, {"251gb": 5}, 300))
+    assert plan["rush"].planned_priority == 90
+    assert plan["stuck"].planned_priority == 80
+
+
+def test_optimizer_beats_priority_order_on_synthetic_queue():
+    results = RenderScheduleOptimizer.benchmark(batch_count=200)
+    assert results["optimizer_finished"] >= results["priority_order_finished"]
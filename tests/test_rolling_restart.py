@@ -0,0 +1,88 @@
+import FarmStateStore
+import RemoteCommandExecutor
+import RollingRestart
+
+
+class FakeFarm:
+    """
+    Workers that, once sent the restart, finish their last task, go offline, then come back and pick up a task.
+    """
+
+    def __init__(self, worker_names, states_after_restart=("Rendering", "Offline", "Rendering"), slow_workers=None):
+        self.states = dict((worker_name, "Rendering") for worker_name in worker_names)
+        self.states_after_restart = states_after_restart
+        # {worker name: the states it goes through instead}
+        self.slow_workers = slow_workers or {}
+        # {worker name: the states it has left to go through}
+        self.restarting = {}
+        self.most_down = 0
+
+    def send(self, worker_name, command):
+        assert command == "OnLastTaskComplete RestartMachine"
+        self.restarting[worker_name] = list(self.slow_workers.get(worker_name, self.states_after_restart))
+
+    def get_worker_states(self, worker_names):
+        for worker_name, states in self.restarting.items():
+            if states:
+                self.states[worker_name] = states.pop(0)
+        self.most_down = max(self.most_down, sum(1 for states in self.restarting.values() if states))
+        return dict((worker_name, self.states[worker_name]) for worker_name in worker_names)
+
+
+def rolling_restart(farm, store, **kwargs):
+    executor = RemoteCommandExecutor.RemoteCommandExecutor(backoff_seconds=0, send_function=farm.send)
+    return RollingRestart.RollingRestart(poll_seconds=0, idempotency_store=store, remote_command_executor=executor,
+                                         get_worker_states=farm.get_worker_states, **kwargs)
+
+
+def test_restarts_a_few_at_a_time_and_records_when_back(tmp_path):
+    worker_names = ["render01", "render02", "render03", "render04"]
+    farm = FakeFarm(worker_names)
+    store = FarmStateStore.SharedIdempotencyStore(state_dir=str(tmp_path))
+    report = rolling_restart(farm, store, max_down=2).run(worker_names)
+    # They came back rendering rather than Idle, which still counts.
+    assert sorted(report.restarted) == worker_names
+    assert farm.most_down <= 2
+    for worker_name in worker_names:
+        assert store.get(RollingRestart.RollingRestart.restart_key(worker_name)) is not None
+
+
+def test_recently_restarted_workers_are_skipped(tmp_path):
+    farm = FakeFarm(["render01", "render02"])
+    store = FarmStateStore.SharedIdempotencyStore(state_dir=str(tmp_path))
+    store.check_and_set(RollingRestart.RollingRestart.restart_key("render01"))
+    report = rolling_restart(farm, store).run(["render01", "render02"])
+    assert report.skipped_recent == ["render01"]
+    assert report.restarted == ["render02"]
+    assert list(farm.restarting) == ["render02"]
+
+
+def test_worker_that_never_goes_down_times_out_unrecorded(tmp_path):
+    farm = FakeFarm(["render01"], states_after_restart=("Rendering",))
+    store = FarmStateStore.SharedIdempotencyStore(state_dir=str(tmp_path))
+    report = rolling_restart(farm, store, restart_timeout_seconds=0).run(["render01"])
+    assert report.timed_out == ["render01"]
+    assert report.restarted == []
+    # So it's tried again next time.
+    assert store.get(RollingRestart.RollingRestart.restart_key("render01")) is None
+
+
+def test_timed_out_worker_keeps_its_slot_until_it_is_back(tmp_path):
+    # render01 is on a long task, so it times out before it goes down.
+    farm = FakeFarm(["render01", "render02"],
+                    slow_workers={"render01": ("Rendering", "Rendering", "Rendering", "Offline", "Idle")})
+    store = FarmStateStore.SharedIdempotencyStore(state_dir=str(tmp_path))
+    report = rolling_restart(farm, store, max_down=1, restart_timeout_seconds=0).run(["render01", "render02"])
+    # render02 was only sent the restart once render01 was back.
+    assert farm.most_down == 1
+    assert report.restarted == ["render01"]
+    # render02 times out too, but with nothing left pending it isn't waited on.
+    assert report.timed_out == ["render02"]
+
+
+def test_running_out_of_time_warns_about_the_workers_left(tmp_path, capsys):
+    farm = FakeFarm(["render01", "render02"])
+    store = FarmStateStore.SharedIdempotencyStore(state_dir=str(tmp_path))
+    report = rolling_restart(farm, store, total_timeout_seconds=0).run(["render01", "render02"])
+    assert report.not_restarted == ["render01", "render02"]
+    assert "# WARNING: Ran out of time" in capsys.readouterr().out
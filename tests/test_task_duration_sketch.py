@@ -0,0 +1,65 @@
+import pytest
+
+import TaskDurationSketch
+
+
+class FakeSketchStore:
+    """
+    A TaskDurationSketchStore kept in a dict.
+    """
+
+    def __init__(self):
+        self.sketches = {}
+
+    def get_sketches(self, sketch_keys=None):
+        return dict((key, self.sketches[key]) for key in sketch_keys or self.sketches if key in self.sketches)
+
+    def set_sketches(self, sketches):
+        self.sketches.update(sketches)
+
+
+def test_quantile_is_within_relative_accuracy():
+    render_times = list(range(1, 1001))
+    sketch = TaskDurationSketch.TaskDurationSketch.from_render_times(render_times)
+    assert sketch.count == 1000
+    assert sketch.quantile(0.95) == pytest.approx(950, rel=TaskDurationSketch.default_relative_accuracy)
+    assert TaskDurationSketch.TaskDurationSketch().quantile(0.95) is None
+
+
+def test_merge_and_difference_round_trip():
+    first = TaskDurationSketch.TaskDurationSketch.from_render_times([10, 20, 30])
+    second = TaskDurationSketch.TaskDurationSketch.from_render_times([40, 0])
+    merged = TaskDurationSketch.TaskDurationSketch.from_json(first.to_json()).merge(second)
+    assert merged.count == 5
+    assert merged.difference(second).counts == first.counts
+    assert merged.difference(second).zero_count == 0
+
+
+def test_record_job_sketch_only_counts_new_tasks_once():
+    sketch_store = FakeSketchStore()
+    keys = TaskDurationSketch.sketch_keys("job", "Nuke", "abc", "abc_010")
+    TaskDurationSketch.record_job_sketch(sketch_store, "job", "Nuke", "abc", "abc_010", [(100, 1), (120, 1)])
+    # The same tasks again, plus a new one of 2 frames.
+    TaskDurationSketch.record_job_sketch(sketch_store, "job", "Nuke", "abc", "abc_010",
+                                         [(100, 1), (120, 1), (220, 2)])
+    for key in keys:
+        assert TaskDurationSketch.TaskDurationSketch.from_json(sketch_store.sketches[key]).count == 3
+
+
+def test_timeout_scales_by_frames_per_task():
+    # 5 minutes a frame.
+    sketch = TaskDurationSketch.TaskDurationSketch.from_render_times([300] * 10)
+    one_frame = TaskDurationSketch.adaptive_timeout_minutes([sketch], multiple=3, floor_minutes=1)
+    four_frames = TaskDurationSketch.adaptive_timeout_minutes([sketch], frames_per_task=4, multiple=3,
+                                                              floor_minutes=1)
+    assert one_frame[0] == pytest.approx(15, abs=1)
+    assert four_frames[0] == pytest.approx(60, abs=2)
+
+
+def test_timeout_uses_first_sketch_with_enough_tasks_and_clamps():
+    small = TaskDurationSketch.TaskDurationSketch.from_render_times([30] * 2)
+    large = TaskDurationSketch.TaskDurationSketch.from_render_times([30] * 10)
+    assert TaskDurationSketch.adaptive_timeout_minutes([small, None, large], floor_minutes=10) == (10, 2)
+    assert TaskDurationSketch.adaptive_timeout_minutes([small]) is None
+    huge = TaskDurationSketch.TaskDurationSketch.from_render_times([36000] * 10)
+    assert TaskDurationSketch.adaptive_timeout_minutes([huge], ceiling_minutes=720) == (720, 0)
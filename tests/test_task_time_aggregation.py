@@ -0,0 +1,86 @@
+import types
+from datetime import datetime, timedelta
+
+import pytest
+
+import ChunkingAdvisor
+import FarmStateStore
+import FrameTimeEstimator
+import JobPatch
+import TaskDurationSketch
+from fake_deadline import FakeJob, FakeRepositoryUtils, FakeWorkerInventory, import_event
+
+
+@pytest.fixture
+def repository(monkeypatch, tmp_path):
+    monkeypatch.setattr(FarmStateStore, "default_state_dir", str(tmp_path / "local"))
+    monkeypatch.setattr(FarmStateStore, "default_shared_state_dir", str(tmp_path / "shared"))
+    monkeypatch.setattr(FrameTimeEstimator, "default_model_path", str(tmp_path / "frame_time_model.json"))
+    repository = FakeRepositoryUtils([FakeJob("job_a", JobPlugin="Nuke"), FakeJob("job_b", JobPlugin="Nuke")])
+    monkeypatch.setattr(JobPatch, "RepositoryUtils", repository)
+    return repository
+
+
+@pytest.fixture
+def event(monkeypatch, repository):
+    return import_event(monkeypatch,
+                        "TaskTimeAggregation",
+                        repository,
+                        ChunkingAdvisor=ChunkingAdvisor,
+                        DeadlineToolbox=types.SimpleNamespace(worker_inventory=FakeWorkerInventory()),
+                        FarmStateStore=FarmStateStore,
+                        FrameTimeEstimator=FrameTimeEstimator,
+                        JobPatch=JobPatch,
+                        TaskDurationSketch=TaskDurationSketch
+                        )
+
+
+@pytest.fixture
+def listener(monkeypatch, event):
+    monkeypatch.setattr(ChunkingAdvisor, "advise_frames_per_task", lambda job, model, machines: 5)
+    return event.TaskTimeAggregation()
+
+
+def snapshot(repository):
+    return [repository.GetJob(job_id, True) for job_id in sorted(repository.jobs)]
+
+
+def test_update_jobs_chunks_each_job_once(repository, listener):
+    listener.update_jobs(snapshot(repository))
+    # The jobs are written from the bulk_patch_jobs threads.
+    assert [job.JobFramesPerTask for job in snapshot(repository)] == [5, 5]
+    assert repository.call_names("job_a").count("SetJobFrameRange") == 1
+
+    # A wrangler sets the frames per task back, it isn't chunked again.
+    repository.jobs["job_a"].JobFramesPerTask = 2
+    listener.update_jobs(snapshot(repository))
+    assert repository.jobs["job_a"].JobFramesPerTask == 2
+    assert repository.call_names("job_a").count("SetJobFrameRange") == 1
+
+
+def test_eta_scales_the_frame_time_by_frames_per_task(event):
+    now = datetime(2024, 3, 1, 22, 0)
+    # 10 tasks left of 2 frames each, 2 rendering at once, and a minute a frame.
+    job = FakeJob(JobTaskCount=20, JobCompletedTasks=10, JobRenderingTasks=2, JobFramesPerTask=2)
+    job_task_times = {"timed_tasks": 5, "timed_frames": 10, "render_seconds": 600}
+    estimator = FrameTimeEstimator.FrameTimeEstimator()
+    assert event.estimate_job_eta(job, job_task_times, estimator, now) == now + timedelta(minutes=10)
+    # With nothing rendered yet, the fixed 20 minutes a frame guess for Arnold.
+    job.JobCompletedTasks = 0
+    assert event.estimate_job_eta(job, None, estimator, now) == now + timedelta(minutes=20 * 2 * 20 / 2)
+
+
+def test_adaptive_timeout_only_replaces_the_submission_or_its_own_timeout(event):
+    sketches = {TaskDurationSketch.job_sketch_key("job"): TaskDurationSketch.TaskDurationSketch.from_render_times(
+        [600] * 10)}
+    submission_timeouts = {"Nuke Timeout": 15 * 60, "Maya and Houdini Timeout": 10 * 60,
+                           "Arnold and Mantra Timeout": 180 * 60}
+    job = FakeJob(JobPlugin="Nuke", JobTaskTimeoutSeconds=15 * 60)
+    timeout_seconds = event.adaptive_timeout_seconds(job, sketches, submission_timeouts)
+    assert timeout_seconds == pytest.approx(30 * 60, abs=60)
+    # A wrangler set this one by hand.
+    job.JobTaskTimeoutSeconds = 20 * 60
+    assert event.adaptive_timeout_seconds(job, sketches, submission_timeouts) is None
+    # Unless it's the one we set last time.
+    job.SetJobExtraInfoKeyValue(event.adaptive_timeout_key, str(20 * 60))
+    assert event.adaptive_timeout_seconds(job, sketches, submission_timeouts) == timeout_seconds